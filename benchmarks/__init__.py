@@ -0,0 +1 @@
+"""Benchmarks for agent-smith-ai, run against local stand-ins for remote services."""
@@ -0,0 +1,232 @@
+"""Drives UtilityAgent, CLIAgent and the bash agent through scripted multi-turn tool conversations against local
+stand-ins for OpenAI and an OpenAPI server, reporting per-turn latency, network calls per turn, tokenization CPU time
+and peak memory. Results can be saved as a baseline, and later runs compared with it; the comparison exits with
+status 1 if any metric regressed by more than the tolerance.
+
+Usage:
+    python -m benchmarks.agent_turns [--turns 20] [--latency 0] [--save baseline.json] [--baseline baseline.json] [--tolerance 0.2]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+import openai
+
+from agent_smith_ai import tokenizer
+from agent_smith_ai.bash_agent.agent.bashai_agent import BashAIAgent
+from agent_smith_ai.cli_agent import CLIAgent
+from agent_smith_ai.endpoint_cache import get_default_endpoint_cache
+from agent_smith_ai.moderation import get_default_moderation_batcher
+from agent_smith_ai.utility_agent import UtilityAgent
+from benchmarks.stub_servers import StubOpenAIServer, StubOpenAPIServer
+
+
+# each turn is a tool call and the reply written from its result
+SCENARIOS = {
+    "UtilityAgent": {
+        "script": [{"name": "api-get_item_1", "arguments": {"id": "HGNC:1884", "limit": 10}}, "Item 1 is associated with CFTR."],
+        "prompt": "What is associated with item 1? (turn {turn})",
+    },
+    "CLIAgent": {
+        "script": [{"name": "time", "arguments": {}}, "It is currently the afternoon."],
+        "prompt": "What time is it? (turn {turn})",
+    },
+    "BashAIAgent": {
+        "script": [{"name": "execute_bash_command", "arguments": {"command": "echo hello"}}, "The command printed hello."],
+        "prompt": "Please say hello from the shell. (turn {turn})",
+    },
+}
+
+# metrics, all lower-is-better
+METRICS = ["turn_ms_mean", "turn_ms_p95", "completions_per_turn", "moderations_per_turn", "endpoint_calls_per_turn",
+           "tokenizer_cpu_ms_per_turn", "peak_memory_mb"]
+
+
+def _make_agent(name: str, api_server: StubOpenAPIServer):
+    if name == "UtilityAgent":
+        agent = UtilityAgent(name = "Bench")
+        agent.register_api("api", api_server.spec_url, api_server.url)
+        return agent
+    if name == "CLIAgent":
+        return CLIAgent(name = "Bench", dotfile_history = False, stream = True)
+    return BashAIAgent("bench", "You are a helpful AI assistant that can execute commands in a bash shell.")
+
+
+def _run_turn(name: str, agent: UtilityAgent, prompt: str) -> None:
+    if name == "CLIAgent":
+        # rendered as in the chat UI, streamed
+        for message in agent.chat(prompt, stream = True):
+            agent._log_message(message)
+    else:
+        list(agent.chat(prompt))
+
+
+class _TokenizerTimer:
+    """Accumulates the CPU time spent in the tokenizer's entry points while installed. Only the outermost call on each
+    thread is timed, as the entry points call each other. Process CPU time is used, as count_many encodes in threads."""
+
+    ENTRY_POINTS = ["count_tokens", "truncate", "count_message", "count_messages", "count_many", "count_functions", "count_prompt"]
+
+    def __init__(self) -> None:
+        self.seconds = 0.0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._originals = {}
+
+    def __enter__(self) -> "_TokenizerTimer":
+        for name in self.ENTRY_POINTS:
+            self._originals[name] = getattr(tokenizer, name)
+            setattr(tokenizer, name, self._timed(self._originals[name]))
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        for name, function in self._originals.items():
+            setattr(tokenizer, name, function)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.seconds = 0.0
+
+    def _timed(self, function: Callable) -> Callable:
+        def timed(*args, **kwargs):
+            if getattr(self._local, "depth", 0) > 0:
+                return function(*args, **kwargs)
+            self._local.depth = 1
+            start = time.process_time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.process_time() - start
+                self._local.depth = 0
+                with self._lock:
+                    self.seconds += elapsed
+        return timed
+
+
+def _run_scenario(name: str, num_turns: int, latency: float, trace_memory: bool) -> Dict[str, Any]:
+    """Runs a scenario's conversation against fresh stub servers, returning per-turn timings and request counts, and the
+    peak memory allocated during the turns if trace_memory (tracing slows everything down, so timings are taken in a
+    separate run)."""
+    scenario = SCENARIOS[name]
+    # verdicts and results cached by earlier runs would hide requests
+    get_default_moderation_batcher().cache.clear()
+    get_default_endpoint_cache().clear()
+
+    previous_api_base = openai.api_base
+    with StubOpenAIServer(script = scenario["script"], latency = latency) as openai_server, \
+         StubOpenAPIServer(num_operations = 10, latency = latency) as api_server, \
+         contextlib.redirect_stdout(io.StringIO()), \
+         _TokenizerTimer() as timer:
+        openai.api_base = openai_server.api_base
+        try:
+            agent = _make_agent(name, api_server)
+            # a first turn loads the tokenizer's encodings and opens connections, which later turns don't pay for
+            _run_turn(name, agent, scenario["prompt"].format(turn = "warm-up"))
+            openai_server.reset_counts()
+            api_server.reset_counts()
+            timer.reset()
+            if trace_memory:
+                tracemalloc.start()
+
+            turn_seconds = []
+            for turn in range(num_turns):
+                start = time.perf_counter()
+                _run_turn(name, agent, scenario["prompt"].format(turn = turn))
+                turn_seconds.append(time.perf_counter() - start)
+
+            peak = None
+            if trace_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+        finally:
+            openai.api_base = previous_api_base
+
+        return {"turn_seconds": turn_seconds,
+                "completions": openai_server.request_counts["/v1/chat/completions"],
+                "moderations": openai_server.request_counts["/v1/moderations"],
+                "endpoint_calls": api_server.total_requests() - api_server.request_counts["/openapi.json"],
+                "tokenizer_seconds": timer.seconds,
+                "peak_bytes": peak}
+
+
+def run(num_turns: int = 20, latency: float = 0.0, scenarios: Optional[List[str]] = None) -> Dict[str, Dict[str, float]]:
+    """Runs the scenarios, returning their metrics by scenario name."""
+    results = {}
+    for name in scenarios if scenarios is not None else list(SCENARIOS):
+        timed = _run_scenario(name, num_turns, latency, trace_memory = False)
+        traced = _run_scenario(name, num_turns, latency, trace_memory = True)
+        turn_ms = sorted([1000 * seconds for seconds in timed["turn_seconds"]])
+        results[name] = {"turn_ms_mean": statistics.mean(turn_ms),
+                         "turn_ms_p95": turn_ms[min(int(0.95 * len(turn_ms)), len(turn_ms) - 1)],
+                         "completions_per_turn": timed["completions"] / num_turns,
+                         "moderations_per_turn": timed["moderations"] / num_turns,
+                         "endpoint_calls_per_turn": timed["endpoint_calls"] / num_turns,
+                         "tokenizer_cpu_ms_per_turn": 1000 * timed["tokenizer_seconds"] / num_turns,
+                         "peak_memory_mb": traced["peak_bytes"] / 1e6}
+    return results
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], tolerance: float = 0.2) -> List[str]:
+    """Returns the metrics (as "scenario.metric") that are worse than the baseline by more than tolerance, a fraction."""
+    regressions = []
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            previous = baseline.get(name, {}).get(metric)
+            if previous is not None and value > previous * (1 + tolerance) + 1e-9:
+                regressions.append(f"{name}.{metric}")
+    return regressions
+
+
+def report(results: Dict[str, Dict[str, float]], baseline: Optional[Dict[str, Dict[str, float]]] = None, tolerance: float = 0.2) -> None:
+    regressions = compare(results, baseline, tolerance) if baseline is not None else []
+    for name, metrics in results.items():
+        print(f"{name}:")
+        for metric in METRICS:
+            line = f"  {metric:28s}{metrics[metric]:10.3f}"
+            previous = baseline.get(name, {}).get(metric) if baseline is not None else None
+            if previous is not None:
+                change = f"{100 * (metrics[metric] - previous) / previous:+7.1f}%" if previous else ""
+                line += f"   baseline {previous:10.3f} {change}"
+                if f"{name}.{metric}" in regressions:
+                    line += "  REGRESSION"
+            print(line)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description = "Offline agent benchmarks against local stub servers.")
+    parser.add_argument("--turns", type = int, default = 20, help = "The number of turns per conversation.")
+    parser.add_argument("--latency", type = float, default = 0.0, help = "Seconds the stub servers take to answer each request.")
+    parser.add_argument("--scenario", action = "append", choices = list(SCENARIOS), help = "Only run this scenario (may be repeated).")
+    parser.add_argument("--save", help = "Save the results as a baseline to this file.")
+    parser.add_argument("--baseline", help = "Compare the results with the baseline saved in this file.")
+    parser.add_argument("--tolerance", type = float, default = 0.2, help = "The fraction by which a metric may exceed its baseline before it is reported as a regression.")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    results = run(num_turns = args.turns, latency = args.latency, scenarios = args.scenario)
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    report(results, baseline, args.tolerance)
+
+    if args.save is not None:
+        with open(args.save, "w") as f:
+            json.dump({"settings": {"turns": args.turns, "latency": args.latency}, "results": results}, f, indent = 2)
+
+    if baseline is not None and len(compare(results, baseline, args.tolerance)) > 0:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,51 @@
+"""Measures OpenAPI endpoint calls per second against a local stub API, comparing a fresh requests.Session per call
+(the previous behavior) with the pooled keep-alive clients now used by APIWrapper.
+
+Usage:
+    python -m benchmarks.endpoint_calls_per_second
+"""
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+import requests
+
+from agent_smith_ai.http_client import HTTPClientPool
+from agent_smith_ai.openapi_wrapper import APIWrapperSet
+from benchmarks.stub_servers import StubOpenAPIServer
+
+
+def _session_per_call(url: str) -> int:
+    with requests.Session() as session:
+        return session.get(url, params = {"id": "HGNC:1884"}).status_code
+
+
+def _measure(call, num_calls: int, num_threads: int) -> float:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers = num_threads) as executor:
+        results = list(executor.map(lambda i: call(i), range(num_calls)))
+    elapsed = time.perf_counter() - start
+    assert all([result == 200 for result in results])
+    return num_calls / elapsed
+
+
+def run(num_calls: int = 500) -> None:
+    with StubOpenAPIServer(num_operations = 10) as server:
+        api_set = APIWrapperSet([], client_pool = HTTPClientPool(max_connections = 16, max_keepalive_connections = 16))
+        api_set.add_api("stub", server.spec_url, server.url)
+
+        def pooled(i):
+            return api_set.call_endpoint({"name": f"stub-get_item_{i % 10}", "arguments": {"id": "HGNC:1884"}})["status_code"]
+
+        def unpooled(i):
+            return _session_per_call(f"{server.url}/items/{i % 10}")
+
+        for num_threads in [1, 8]:
+            before = _measure(unpooled, num_calls, num_threads)
+            after = _measure(pooled, num_calls, num_threads)
+            print(f"{num_threads} thread(s): session per call {before:8.1f} calls/s, pooled keep-alive {after:8.1f} calls/s")
+
+        api_set.client_pool.close()
+
+
+if __name__ == "__main__":
+    run()
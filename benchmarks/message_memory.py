@@ -0,0 +1,68 @@
+"""Measures the cost of messages in long-lived sessions: message construction and memory, the memory held by a
+10k-message history, and building a request from it.
+
+Usage:
+    python -m benchmarks.message_memory
+"""
+import timeit
+import tracemalloc
+
+from agent_smith_ai.models import Chat, Message, to_wire_format
+
+
+def _messages(num_messages: int):
+    messages = [Message(role = "system", content = "You are a helpful assistant.", author = "System", intended_recipient = "Assistant")]
+    for i in range(num_messages - 1):
+        if i % 4 == 0:
+            messages.append(Message(role = "user", content = f"What genes are associated with disease {i}?", author = "User", intended_recipient = "Assistant"))
+        elif i % 4 == 1:
+            messages.append(Message(role = "assistant", is_function_call = True, func_name = "monarch-get_disease_gene_associations",
+                                    func_arguments = {"disease_id": f"MONDO:{i:07d}", "limit": 10}, author = "Assistant", intended_recipient = "Assistant (monarch function)"))
+        elif i % 4 == 2:
+            messages.append(Message(role = "function", func_name = "monarch-get_disease_gene_associations", content = '{"associations":[{"gene":"HGNC:1884"}]}',
+                                    author = "Assistant (monarch function)", intended_recipient = "Assistant"))
+        else:
+            messages.append(Message(role = "assistant", content = f"Disease {i} is associated with CFTR.", author = "Assistant", intended_recipient = "User"))
+    return messages
+
+
+def _rebuilt_wire_format(messages):
+    # what each request used to do: reserialize the whole history
+    wire = []
+    for message in messages:
+        serialized = to_wire_format(message)
+        if "tool_calls" in serialized and len(wire) > 0 and "tool_calls" in wire[-1]:
+            wire[-1] = {**wire[-1], "tool_calls": wire[-1]["tool_calls"] + serialized["tool_calls"]}
+        else:
+            wire.append(serialized)
+    return wire
+
+
+def run(num_messages: int = 10000) -> None:
+    print(f"{num_messages} messages:")
+    seconds = timeit.timeit(lambda: _messages(num_messages), number = 3) / 3
+    print(f"  construction: {1e6 * seconds / num_messages:6.2f} us per message")
+
+    tracemalloc.start()
+    messages = _messages(num_messages)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del messages
+    print(f"  messages: {current / 1e6:.1f} MB, {current / num_messages:.0f} bytes per message")
+
+    tracemalloc.start()
+    chat = Chat()
+    for message in _messages(num_messages):
+        chat.append(message)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"  history (messages and wire format): {current / 1e6:.1f} MB, {current / num_messages:.0f} bytes per message, peak {peak / 1e6:.1f} MB")
+
+    rebuilt = timeit.timeit(lambda: _rebuilt_wire_format(chat.messages), number = 10) / 10
+    cached = timeit.timeit(lambda: chat.wire_format, number = 10) / 10
+    print(f"  request messages, rebuilt per request: {1e3 * rebuilt:8.3f} ms")
+    print(f"  request messages, kept on append:      {1e3 * cached:8.3f} ms")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,35 @@
+"""Counts the provider requests made per user turn by a UtilityAgent, using a local OpenAI stand-in.
+
+Usage:
+    python -m benchmarks.network_calls_per_turn
+"""
+import os
+import time
+
+import openai
+
+from agent_smith_ai.utility_agent import UtilityAgent
+from benchmarks.stub_servers import StubOpenAIServer
+
+
+def run(num_turns: int = 5, check_toxicity: bool = True) -> None:
+    with StubOpenAIServer() as server:
+        openai.api_base = server.api_base
+        agent = UtilityAgent(openai_api_key = "stub", check_toxicity = check_toxicity)
+
+        start = time.perf_counter()
+        for i in range(num_turns):
+            list(agent.chat(f"Hello, this is turn {i}."))
+        elapsed = time.perf_counter() - start
+
+        completions = server.request_counts["/v1/chat/completions"]
+        moderations = server.request_counts["/v1/moderations"]
+        print(f"check_toxicity={check_toxicity}: {num_turns} turns, "
+              f"{completions / num_turns:.1f} completion + {moderations / num_turns:.1f} moderation requests per turn, "
+              f"{1000 * elapsed / num_turns:.1f} ms per turn")
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    run(check_toxicity = True)
+    run(check_toxicity = False)
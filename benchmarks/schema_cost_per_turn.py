@@ -0,0 +1,53 @@
+"""Measures the time spent producing function schemas per model round-trip, before and after compiling them at registration.
+
+Usage:
+    python -m benchmarks.schema_cost_per_turn
+"""
+import os
+import timeit
+from typing import Any, Dict, List
+
+from agent_smith_ai.function_registry import _generate_schema
+from agent_smith_ai.utility_agent import UtilityAgent
+
+
+class SchemaHeavyAgent(UtilityAgent):
+    def __init__(self):
+        super().__init__(name = "Bench", openai_api_key = "stub")
+        self.register_callable_functions({f"lookup_{i}": self.lookup for i in range(20)})
+
+    def lookup(self, identifier: str, limit: int, categories: List[str], filters: Dict[str, Any]) -> Dict[str, Any]:
+        """Looks up an entity.
+
+        Args:
+            identifier (str): The entity identifier.
+            limit (int): The maximum number of results.
+            categories (List[str]): Categories to include.
+            filters (Dict[str, Any]): Additional filters.
+
+        Returns:
+            The entity."""
+        return {}
+
+
+def run(number: int = 1000) -> None:
+    agent = SchemaHeavyAgent()
+
+    def uncompiled():
+        # what each request used to do: reparse every docstring and signature
+        return agent.api_set.get_function_schemas() + [_generate_schema(f) for f in agent.callable_functions.values()]
+
+    def compiled():
+        return agent.function_registry.schemas
+
+    # chat(), the recursive response processing and help() each built the schema list
+    per_call_before = timeit.timeit(uncompiled, number = number) / number
+    per_call_after = timeit.timeit(compiled, number = number) / number
+    print(f"{len(agent.callable_functions)} callables, 3 schema builds per round-trip:")
+    print(f"  before: {3 * per_call_before * 1e6:10.1f} us per round-trip")
+    print(f"  after:  {3 * per_call_after * 1e6:10.1f} us per round-trip")
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    run()
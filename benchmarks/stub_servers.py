@@ -0,0 +1,333 @@
+"""Local HTTP stand-ins for the remote services used by agents, so benchmarks can run offline and count network calls."""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional
+import collections
+import json
+import re
+import threading
+import time
+import urllib.parse
+
+
+class StubServer:
+    """Base class for a threaded local HTTP server that records the requests it receives: how many were made to each
+    path, and a log of each request's body and when it arrived and was answered, so tests can check which requests
+    overlapped without timing whole operations."""
+
+    def __init__(self) -> None:
+        self.request_counts = collections.Counter()
+        self._log = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target = self._server.serve_forever, daemon = True)
+
+    @property
+    def url(self) -> str:
+        """The base URL of the running server."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "StubServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def reset_counts(self) -> None:
+        with self._lock:
+            self.request_counts.clear()
+            self._log.clear()
+
+    def request_log(self, path: str = None) -> List[Dict[str, Any]]:
+        """Returns the requests received (to the given path, if any) in the order they arrived, each a dictionary with
+        "path", "body", and the "started" and "finished" times (from time.monotonic; None while being answered)."""
+        with self._lock:
+            return [dict(entry) for entry in self._log if path is None or entry["path"] == path]
+
+    def total_requests(self) -> int:
+        with self._lock:
+            return sum(self.request_counts.values())
+
+    def handle(self, method: str, path: str, body: Any, headers: Dict[str, str]) -> Dict[str, Any]:
+        """Returns a dictionary with "status", "body" and optionally "headers" for the given request. A missing or None
+        body is sent as an empty response. Instead of a body, "events" may be an iterable of JSON-serializable events to
+        send as a stream of server-sent events."""
+        raise NotImplementedError
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def _dispatch(self, method):
+                length = int(self.headers.get("Content-Length", 0))
+                raw = self.rfile.read(length) if length else b""
+                body = json.loads(raw) if raw else None
+                path = self.path.split("?")[0]
+                entry = {"path": path, "body": body, "started": time.monotonic(), "finished": None}
+                with stub._lock:
+                    stub.request_counts[path] += 1
+                    stub._log.append(entry)
+                try:
+                    self._respond(method, body)
+                finally:
+                    with stub._lock:
+                        entry["finished"] = time.monotonic()
+
+            def _respond(self, method, body):
+                result = stub.handle(method, self.path, body, dict(self.headers.items()))
+                if "events" in result:
+                    self._send_events(result)
+                    return
+                payload = json.dumps(result["body"]).encode("utf-8") if result.get("body") is not None else b""
+                self.send_response(result.get("status", 200))
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for key, value in result.get("headers", {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _send_events(self, result):
+                # server-sent events, written as they are produced; the connection is closed to end the stream
+                self.close_connection = True
+                self.send_response(result.get("status", 200))
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                try:
+                    for event in result["events"]:
+                        self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                        self.wfile.flush()
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client stopped reading the stream
+
+            def do_GET(self):
+                self._dispatch("GET")
+
+            def do_POST(self):
+                self._dispatch("POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class StubOpenAIServer(StubServer):
+    """An OpenAI-compatible stand-in serving /v1/chat/completions and /v1/moderations.
+
+    Completions are scripted: each entry of `script` is either a string (an assistant reply), a dictionary with
+    "name" and "arguments" keys (a function call, or a single tool call if the request offers tools), or a list of such
+    dictionaries (parallel tool calls). The script is cycled through in order. Streamed requests are answered with the
+    reply split into word-sized chunks, and function call arguments split into short fragments. After refuse_next,
+    requests are refused as if a rate limit was exceeded.
+
+    Args:
+        script (List[Any], optional): The scripted completions. Defaults to a single assistant reply.
+        latency (float, optional): Seconds to sleep before answering each request. Defaults to 0.
+        chunk_latency (float, optional): Seconds to sleep before sending each chunk of a streamed response. Defaults to 0.
+        flagged_terms (List[str], optional): Moderation flags inputs containing any of these terms. Defaults to none.
+    """
+
+    def __init__(self, script: List[Any] = None, latency: float = 0.0, chunk_latency: float = 0.0, flagged_terms: List[str] = None) -> None:
+        self.script = script if script is not None else ["Hello! How can I help?"]
+        self.latency = latency
+        self.chunk_latency = chunk_latency
+        self.flagged_terms = flagged_terms if flagged_terms is not None else []
+        self._position = 0
+        self._refusals = 0
+        self._refusal_status = 429
+        self._refusal_headers = {}
+        self.refused = 0
+        super().__init__()
+
+    @property
+    def api_base(self) -> str:
+        """The value to use for openai.api_base."""
+        return self.url + "/v1"
+
+    def refuse_next(self, count: int, status: int = 429, headers: Dict[str, str] = None) -> None:
+        """Refuses the next count requests with an OpenAI-style error, e.g. a 429 with a retry-after header."""
+        with self._lock:
+            self._refusals = count
+            self._refusal_status = status
+            self._refusal_headers = headers if headers is not None else {}
+
+    def _refusal(self) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if self._refusals == 0:
+                return None
+            self._refusals -= 1
+            self.refused += 1
+            return {"status": self._refusal_status, "headers": self._refusal_headers,
+                    "body": {"error": {"message": "Rate limit reached for requests", "type": "requests", "param": None,
+                                       "code": "rate_limit_exceeded" if self._refusal_status == 429 else None}}}
+
+    def _next_scripted(self) -> Any:
+        with self._lock:
+            entry = self.script[self._position % len(self.script)]
+            self._position += 1
+        return entry
+
+    def handle(self, method: str, path: str, body: Any, headers: Dict[str, str]) -> Dict[str, Any]:
+        time.sleep(self.latency)
+
+        refusal = self._refusal()
+        if refusal is not None:
+            return refusal
+
+        if path.startswith("/v1/moderations"):
+            inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            return {"body": {"id": "modr-stub", "model": "text-moderation-stub",
+                             "results": [{"flagged": any([term in text for term in self.flagged_terms]), "categories": {}, "category_scores": {}}
+                                         for text in inputs]}}
+
+        if path.startswith("/v1/chat/completions"):
+            entry = self._next_scripted()
+            if isinstance(entry, dict) and "tools" in body:
+                entry = [entry]
+            if isinstance(entry, list):
+                message = {"role": "assistant", "content": None,
+                           "tool_calls": [{"id": f"call_{self._position}_{i}", "type": "function",
+                                           "function": {"name": call["name"], "arguments": json.dumps(call.get("arguments", {}))}}
+                                          for i, call in enumerate(entry)]}
+                finish_reason = "tool_calls"
+            elif isinstance(entry, dict):
+                message = {"role": "assistant", "content": None,
+                           "function_call": {"name": entry["name"], "arguments": json.dumps(entry.get("arguments", {}))}}
+                finish_reason = "function_call"
+            else:
+                message = {"role": "assistant", "content": entry}
+                finish_reason = "stop"
+
+            prompt_chars = len(json.dumps(body.get("messages", []))) + len(json.dumps(body.get("functions", body.get("tools", []))))
+            completion_chars = len(json.dumps(message))
+            usage = {"prompt_tokens": prompt_chars // 4, "completion_tokens": completion_chars // 4}
+            usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+            if body.get("stream"):
+                return {"events": self._chunks(message, finish_reason, body.get("model"))}
+
+            return {"body": {"id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()),
+                             "model": body.get("model"),
+                             "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+                             "usage": usage}}
+
+        return {"status": 404, "body": {"error": {"message": f"Unknown path {path}"}}}
+
+
+    def _chunks(self, message: Dict[str, Any], finish_reason: str, model: str) -> Iterator[Dict[str, Any]]:
+        deltas = [{"role": "assistant"}]
+        if message.get("content"):
+            deltas += [{"content": piece} for piece in re.findall(r"\S+\s*|\s+", message["content"])]
+        if "function_call" in message:
+            arguments = message["function_call"]["arguments"]
+            deltas.append({"function_call": {"name": message["function_call"]["name"], "arguments": ""}})
+            deltas += [{"function_call": {"arguments": arguments[i:i + 8]}} for i in range(0, len(arguments), 8)]
+        for index, tool_call in enumerate(message.get("tool_calls", [])):
+            arguments = tool_call["function"]["arguments"]
+            deltas.append({"tool_calls": [{"index": index, "id": tool_call["id"], "type": "function",
+                                           "function": {"name": tool_call["function"]["name"], "arguments": ""}}]})
+            deltas += [{"tool_calls": [{"index": index, "function": {"arguments": arguments[i:i + 8]}}]} for i in range(0, len(arguments), 8)]
+
+        created = int(time.time())
+        for delta in deltas:
+            time.sleep(self.chunk_latency)
+            yield {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": created, "model": model,
+                   "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+        yield {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": created, "model": model,
+               "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]}
+
+
+class StubOpenAPIServer(StubServer):
+    """A stand-in REST API serving a synthetic OpenAPI spec at /openapi.json.
+
+    The spec has `num_operations` GET operations named `get_item_{i}` at /items/{i}, each taking a required `id` query
+    parameter and an optional `limit` query parameter; each returns its arguments as JSON. The spec and the items are
+    served with ETags, and conditional requests for them are answered with 304 Not Modified. After fail_next, item
+    requests fail as if the API were unhealthy.
+
+    Args:
+        num_operations (int, optional): The number of operations in the spec. Defaults to 10.
+        latency (float, optional): Seconds to sleep before answering each endpoint request. Defaults to 0.
+        cache_control (str, optional): The Cache-Control header sent with items, e.g. "max-age=60". Defaults to None (not sent).
+    """
+
+    def __init__(self, num_operations: int = 10, latency: float = 0.0, cache_control: str = None) -> None:
+        self.num_operations = num_operations
+        self.latency = latency
+        self.cache_control = cache_control
+        self._failures = 0
+        self._failure_status = 503
+        self._failure_headers = {}
+        self._failure_delay = 0.0
+        super().__init__()
+
+    def fail_next(self, count: int, status: int = 503, headers: Dict[str, str] = None, delay: float = 0.0) -> None:
+        """Fails the next count item requests with the given status, after sleeping for delay seconds (e.g. past a client's read timeout)."""
+        with self._lock:
+            self._failures = count
+            self._failure_status = status
+            self._failure_headers = headers if headers is not None else {}
+            self._failure_delay = delay
+
+    @property
+    def spec_url(self) -> str:
+        return self.url + "/openapi.json"
+
+    def spec(self) -> Dict[str, Any]:
+        paths = {}
+        for i in range(self.num_operations):
+            paths[f"/items/{i}"] = {
+                "get": {
+                    "operationId": f"get_item_{i}",
+                    "description": f"Get item {i} by identifier.",
+                    "parameters": [
+                        {"name": "id", "in": "query", "required": True, "schema": {"type": "string"}},
+                        {"name": "limit", "in": "query", "required": False, "schema": {"type": "integer"}},
+                    ],
+                }
+            }
+        return {"openapi": "3.0.2", "info": {"title": "Stub API", "version": "1.0"}, "paths": paths}
+
+    def handle(self, method: str, path: str, body: Any, headers: Dict[str, str]) -> Dict[str, Any]:
+        route, _, query = path.partition("?")
+        if route == "/openapi.json":
+            etag = f'"spec-{self.num_operations}"'
+            if headers.get("If-None-Match") == etag:
+                return {"status": 304, "headers": {"ETag": etag}}
+            return {"body": self.spec(), "headers": {"ETag": etag}}
+
+        time.sleep(self.latency)
+        with self._lock:
+            failing = self._failures > 0 and route.startswith("/items/")
+            if failing:
+                self._failures -= 1
+        if failing:
+            time.sleep(self._failure_delay)
+            return {"status": self._failure_status, "headers": self._failure_headers, "body": {"detail": "Service Unavailable"}}
+
+        if route.startswith("/items/"):
+            params = dict(urllib.parse.parse_qsl(query))
+            item_headers = {"ETag": f'"{route}?{query}"'}
+            if self.cache_control is not None:
+                item_headers["Cache-Control"] = self.cache_control
+            if headers.get("If-None-Match") == item_headers["ETag"]:
+                return {"status": 304, "headers": item_headers}
+            return {"body": {"item": int(route.rsplit("/", 1)[1]), "method": method, "params": params}, "headers": item_headers}
+
+        return {"status": 404, "body": {"detail": "Not Found"}}
@@ -2,6 +2,8 @@ import os
 import json
 import shutil
 
+from agent_smith_ai import tokenizer
+
 CONFIG_DIR = os.path.expanduser("~/.bash_ai")
 
 
@@ -51,5 +53,14 @@ def read_last_n_lines(file_path, n):
         lines = file.readlines()
         return lines[-n:]
 
-
-
+def read_chat_context(file_path, n, max_tokens, model="gpt-3.5-turbo-0613"):
+    """Reads the last n lines of a conversation log, dropping the oldest lines until the rest fit within max_tokens."""
+    lines = read_last_n_lines(file_path, n)
+    counts = tokenizer.count_many(lines, model=model)
+
+    total = sum(counts)
+    start = 0
+    while start < len(lines) and total > max_tokens:
+        total -= counts[start]
+        start += 1
+    return lines[start:]
@@ -1,6 +1,6 @@
 from agent.bashai_agent import BashAIAgent
 from config.init import initialize, read_config
-from config.profiles import create_profile, read_profile_config, get_profile_config_path, get_conversation_log_path, read_last_n_lines
+from config.profiles import create_profile, read_profile_config, get_profile_config_path, get_conversation_log_path, read_chat_context
 from utils.conversation_log import log_conversation
 import argparse
 import json
@@ -15,6 +15,7 @@ def parse_arguments():
     parser.add_argument('--system-prompt', type=str, default="You are a helpful AI assistant that can execute commands in a bash shell.", help='System prompt for the agent.')
     parser.add_argument('--api-key', type=str, help='API key for the agent.')
     parser.add_argument('--chat-context', type=int, default=10, help='The number of recent messages to load as chat context.')
+    parser.add_argument('--chat-context-tokens', type=int, default=2000, help='The maximum number of tokens of chat context to load; older messages are dropped first.')
     parser.add_argument('question', type=str, nargs='?', default="Please describe your functionality", help='A free-text question for the AI agent.')
     return parser.parse_args()
 
@@ -50,7 +51,7 @@ def main():
     agent = BashAIAgent(profile_name, system_prompt, api_key=api_key)
 
     # Load chat context
-    chat_context = read_last_n_lines(get_conversation_log_path(profile_name), args.chat_context)
+    chat_context = read_chat_context(get_conversation_log_path(profile_name), args.chat_context, args.chat_context_tokens, model=agent.model)
 
     # Add chat context to question
     args.question = 'The following conversation history may be of use for the question that follows:\n\n' + ''.join(chat_context) + "\n\nNow, here is the user's question:\n\n" +  args.question
@@ -6,6 +6,7 @@ from prompt_toolkit.history import FileHistory
 from prompt_toolkit.styles import Style
 
 from rich.console import Console
+from rich.live import Live
 from rich.markdown import Markdown
 from rich.text import Text
 from rich.panel import Panel
@@ -18,7 +19,7 @@ import sys
 class CLIAgent(UtilityAgent):
     """An agent designed for interactive, multi-turn chats on the command line. Inherits from UtilityAgent, and may be inherited from to create custom command-line agents."""
 
-    def __init__(self, name: str = "Assistant", system_message: str = f"You are a helpful assistant.", model: str = "gpt-3.5-turbo-0613", openai_api_key: str = None, dotfile_history: bool = True) -> None:
+    def __init__(self, name: str = "Assistant", system_message: str = f"You are a helpful assistant.", model: str = "gpt-3.5-turbo-0613", openai_api_key: str = None, dotfile_history: bool = True, stream: bool = True) -> None:
         """Initializes the agent.
         
         Args:
@@ -26,10 +27,13 @@ class CLIAgent(UtilityAgent):
             system_message (str, optional): The system message provided to the agent. Defaults to f"You are a helpful assistant named {name}."
             model (str, optional): The model to use for the agent. Defaults to "gpt-3.5-turbo-0613".
             openai_api_key (str, optional): The OpenAI API key to use for the agent. Defaults to None, which will use the OPENAI_API_KEY environment variable.
-            dotfile_history (bool, optional): Whether to save the agent's history to a dotfile. Defaults to True."""
+            dotfile_history (bool, optional): Whether to save the agent's history to a dotfile. Defaults to True.
+            stream (bool, optional): Whether to stream replies, rendering them as they arrive. Defaults to True."""
 
         super().__init__(name, system_message, model, openai_api_key)
         self.dotfile_history = dotfile_history
+        self.stream = stream
+        self._live_reply = None
 
         style = Style.from_dict({
             'prompt': '#00aaaa'
@@ -95,25 +99,22 @@ class CLIAgent(UtilityAgent):
             newline (bool, optional): Whether to print a newline before the panel. Defaults to True.
         """
         console = Console(width = 100)
-        title = Text(title, style = style)
-        if self._is_valid_json(content):
-            content = "```json\n" + json.dumps(json.loads(content), indent = 4).strip() + "\n```"
         if newline:
             console.print()
-        console.print(Panel(Markdown(f"{content}"), title = title, title_align=title_align))
+        console.print(self._panel(content, title, style = style, title_align = title_align))
 
 
     def start_chat_ui(self) -> None:
         """Starts the chat UI, prompting the user for an initial message."""
         user_input = self.prompt_session.prompt([('class:prompt', 'User: ')])
 
-        for message in self.chat(user_input):
+        for message in self.chat(user_input, stream = self.stream):
             self._log_message(message)
 
         while user_input != "exit":
             user_input = self.prompt_session.prompt([('class:prompt', 'User: ')])
 
-            for message in self.chat(user_input):
+            for message in self.chat(user_input, stream = self.stream):
                 self._log_message(message)
 
 
@@ -126,8 +127,38 @@ class CLIAgent(UtilityAgent):
         return True
 
 
+    def _panel(self, content: str, title: str, style = "default", title_align: str = "left") -> Panel:
+        """Builds the panel rendered by render_panel, showing JSON content as a formatted code block."""
+        title = Text(title, style = style)
+        if self._is_valid_json(content):
+            content = "```json\n" + json.dumps(json.loads(content), indent = 4).strip() + "\n```"
+        return Panel(Markdown(f"{content}"), title = title, title_align=title_align)
+
+
     def _log_message(self, message: Message) -> None:
-        """Logs a message to the console using render_panel."""
+        """Logs a message to the console using render_panel. Streamed replies are rendered live as their deltas arrive,
+        and the panel is finalized with the complete message."""
+
+        if message.is_delta:
+            if self._live_reply is None:
+                console = Console(width = 100)
+                console.print()
+                self._live_reply = {"content": "", "live": Live(console = console, auto_refresh = False)}
+                self._live_reply["live"].start()
+            self._live_reply["content"] += message.content
+            self._live_reply["live"].update(self._panel(self._live_reply["content"], message.author + " -> " + message.intended_recipient, style = "blue"), refresh = True)
+            return
+
+        if self._live_reply is not None:
+            # the complete message replaces the live panel, rather than being rendered again
+            live = self._live_reply["live"]
+            self._live_reply = None
+            if message.role == "assistant" and message.content:
+                live.update(self._panel(message.content, message.author + " -> " + message.intended_recipient, style = "blue"), refresh = True)
+                live.stop()
+                self._log_function_call(message)
+                return
+            live.stop()
 
         if message.role == "user":
             self.render_panel(message.content, message.author + " -> " + message.intended_recipient, style = "cyan")
@@ -138,8 +169,13 @@ class CLIAgent(UtilityAgent):
         elif message.role == "assistant":
             if(message.content):
                 self.render_panel(message.content, message.author + " -> " + message.intended_recipient, style = "blue")
-            if(message.is_function_call and os.environ["SHOW_FUNCTION_CALLS"] == 'True'):
-                self.render_panel(f"```\n{message.func_name}(params = {message.func_arguments})\n```", message.author + " -> " + message.intended_recipient, style = "default")
+            self._log_function_call(message)
                 
         elif message.role == "function" and os.environ["SHOW_FUNCTION_CALLS"] == 'True':
             self.render_panel(message.content, message.author + " -> " + message.intended_recipient, style = "default", newline = False)
+
+
+    def _log_function_call(self, message: Message) -> None:
+        """Logs the call made by a function call message, if function calls are shown."""
+        if(message.is_function_call and os.environ["SHOW_FUNCTION_CALLS"] == 'True'):
+            self.render_panel(f"```\n{message.func_name}(params = {message.func_arguments})\n```", message.author + " -> " + message.intended_recipient, style = "default")
@@ -0,0 +1,154 @@
+# Standard library imports
+import collections
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Tuple
+
+
+class CompletionCache:
+    """A cache of ChatCompletion responses keyed by a canonical hash of the request (model, temperature, messages and
+    function definitions), for deterministic (temperature 0) requests that are repeated, e.g. by regression suites, demos,
+    or popular questions. Responses are kept in an in-memory LRU tier, and optionally in an sqlite database on disk that
+    persists across processes; both tiers are bounded in size and entries expire after a time-to-live.
+
+    Args:
+        max_entries (int, optional): The maximum number of responses kept in memory. Defaults to 1000.
+        ttl (float, optional): Seconds a response is kept. Defaults to 86400 (one day).
+        path (str, optional): The sqlite database file for the disk tier. Defaults to None (memory only).
+        max_disk_entries (int, optional): The maximum number of responses kept on disk. Defaults to 100000.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 86400.0, path: Optional[str] = None, max_disk_entries: int = 100000) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+        self._entries: "collections.OrderedDict[str, Tuple[float, Dict[str, Any]]]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path is not None:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok = True)
+            self._db = sqlite3.connect(path, check_same_thread = False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)")
+            self._db.commit()
+
+
+    def get(self, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Returns the cached response to a request, or None.
+
+        Args:
+            request (Dict[str, Any]): The arguments of the ChatCompletion request.
+
+        Returns:
+            Optional[Dict[str, Any]]: The cached response."""
+        key = request_key(request)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+
+            if self._db is not None:
+                row = self._db.execute("SELECT response, created FROM completions WHERE key = ?", (key,)).fetchone()
+                if row is not None and now - row[1] <= self.ttl:
+                    self._db.execute("UPDATE completions SET accessed = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+                    response = json.loads(row[0])
+                    self._remember(key, row[1], response)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return response
+
+            self.misses += 1
+            return None
+
+
+    def set(self, request: Dict[str, Any], response: Dict[str, Any]) -> None:
+        """Caches the response to a request.
+
+        Args:
+            request (Dict[str, Any]): The arguments of the ChatCompletion request.
+            response (Dict[str, Any]): The response."""
+        key = request_key(request)
+        response = json.loads(json.dumps(response)) # a plain copy, detached from the client's response object
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, response)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO completions (key, response, created, accessed) VALUES (?, ?, ?, ?)", (key, json.dumps(response), now, now))
+                self._db.execute("DELETE FROM completions WHERE created < ?", (now - self.ttl,))
+                self._db.execute("DELETE FROM completions WHERE key NOT IN (SELECT key FROM completions ORDER BY accessed DESC LIMIT ?)", (self.max_disk_entries,))
+                self._db.commit()
+
+
+    def clear(self) -> None:
+        """Removes all cached responses, in memory and on disk."""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM completions")
+                self._db.commit()
+
+
+    def close(self) -> None:
+        """Closes the disk tier's database connection."""
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+    def _remember(self, key: str, created: float, response: Dict[str, Any]) -> None:
+        self._entries[key] = (created, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last = False)
+
+
+
+def request_key(request: Dict[str, Any]) -> str:
+    """Returns the canonical hash of a ChatCompletion request: the sha256 of its JSON serialization with sorted keys.
+
+    Args:
+        request (Dict[str, Any]): The arguments of the request.
+
+    Returns:
+        str: The hex digest."""
+    canonical = json.dumps(request, sort_keys = True, separators = (",", ":"), default = str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def replay_chunks(response: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Replays a cached response as the chunks of a streamed response (a single chunk carrying the whole message).
+
+    Args:
+        response (Dict[str, Any]): The cached response.
+
+    Yields:
+        The chunk."""
+    choice = response["choices"][0]
+    delta = dict(choice["message"])
+    if "tool_calls" in delta:
+        delta["tool_calls"] = [{**tool_call, "index": index} for index, tool_call in enumerate(delta["tool_calls"])]
+    yield {"id": response.get("id"), "object": "chat.completion.chunk", "model": response.get("model"),
+           "choices": [{"index": 0, "delta": delta, "finish_reason": choice.get("finish_reason")}]}
+
+
+async def areplay_chunks(response: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+    """The asyncio counterpart of replay_chunks."""
+    for chunk in replay_chunks(response):
+        yield chunk
@@ -0,0 +1,178 @@
+# Standard library imports
+import collections
+import copy
+import email.utils
+import json
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+# Third party imports
+import httpx
+
+
+class EndpointResponseCache:
+    """A process-wide, thread-safe cache of API endpoint results for GET calls, following HTTP caching semantics.
+
+    Results are keyed by (method, URL, query parameters, body). A response's freshness lifetime comes from its
+    Cache-Control max-age or Expires headers (or a per-API TTL override, or the default TTL); fresh results are served
+    without a request. Stale results with an ETag or Last-Modified validator are revalidated with a conditional request,
+    and reused if the API answers 304 Not Modified. Responses marked no-store or private are never cached (the cache is
+    shared by every agent and session in the process), and no-cache responses are always revalidated. Results are copied
+    in and out of the cache, so callers may modify them. Memory use is bounded by evicting the least recently used results.
+
+    Args:
+        max_bytes (int, optional): The maximum total size of the cached response bodies. Defaults to 64 MB.
+        default_ttl (float, optional): The freshness lifetime, in seconds, of responses without caching headers. Defaults to 0 (revalidate them, if they have a validator).
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, default_ttl: float = 0.0) -> None:
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+        self.size = 0
+        self._entries: "collections.OrderedDict[Tuple, Dict[str, Any]]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def key(self, method: str, url: str, params: Dict[str, Any], body: Any) -> Tuple:
+        """Returns the cache key for a request."""
+        return (method.upper(), url, json.dumps(params, sort_keys = True, default = str), json.dumps(body, sort_keys = True, default = str))
+
+
+    def lookup(self, key: Tuple) -> Tuple[Optional[Dict[str, Any]], bool]:
+        """Looks up the cached entry for a request.
+
+        Args:
+            key (Tuple): The request's cache key.
+
+        Returns:
+            The entry (or None), and whether it is fresh enough to use without revalidation."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, False
+            self._entries.move_to_end(key)
+            if time.monotonic() < entry["expires_at"]:
+                self.hits += 1
+                return entry, True
+            return entry, False
+
+
+    def result(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        """Returns a copy of a cached entry's result."""
+        return copy.deepcopy(entry["result"])
+
+
+    def conditional_headers(self, entry: Optional[Dict[str, Any]]) -> Dict[str, str]:
+        """Returns the headers to revalidate a stale entry with (none if there is no entry)."""
+        headers = {}
+        if entry is not None:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+
+    def store(self, key: Tuple, response: httpx.Response, result: Dict[str, Any], ttl: Optional[float] = None) -> None:
+        """Caches the result of a successful request, if its response allows it.
+
+        Args:
+            key (Tuple): The request's cache key.
+            response (httpx.Response): The response.
+            result (Dict[str, Any]): The result returned for the response.
+            ttl (Optional[float], optional): A freshness lifetime overriding the response's caching headers. Defaults to None."""
+        lifetime = self._lifetime(response, ttl)
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if lifetime is None or (lifetime <= 0 and etag is None and last_modified is None):
+            return
+
+        entry = {"result": copy.deepcopy(result),
+                 "etag": etag,
+                 "last_modified": last_modified,
+                 "expires_at": time.monotonic() + lifetime,
+                 "size": len(response.content)}
+        if entry["size"] > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous["size"]
+            self._entries[key] = entry
+            self.size += entry["size"]
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last = False)
+                self.size -= evicted["size"]
+
+
+    def revalidated(self, key: Tuple, entry: Dict[str, Any], response: httpx.Response, ttl: Optional[float] = None) -> Dict[str, Any]:
+        """Refreshes a stale entry after a 304 Not Modified response, returning its result.
+
+        Args:
+            key (Tuple): The request's cache key.
+            entry (Dict[str, Any]): The stale entry.
+            response (httpx.Response): The 304 response.
+            ttl (Optional[float], optional): A freshness lifetime overriding the response's caching headers. Defaults to None."""
+        lifetime = self._lifetime(response, ttl)
+        with self._lock:
+            self.revalidations += 1
+            if lifetime is None:
+                if self._entries.get(key) is entry:
+                    del self._entries[key]
+                    self.size -= entry["size"]
+            else:
+                entry["expires_at"] = time.monotonic() + lifetime
+                entry["etag"] = response.headers.get("ETag", entry["etag"])
+        return self.result(entry)
+
+
+    def clear(self) -> None:
+        """Removes all cached results."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+    def _lifetime(self, response: httpx.Response, ttl: Optional[float]) -> Optional[float]:
+        """Returns the freshness lifetime of a response in seconds, or None if it must not be stored."""
+        directives = {}
+        for directive in response.headers.get("Cache-Control", "").split(","):
+            name, _, value = directive.strip().partition("=")
+            if name:
+                directives[name.lower()] = value.strip('"')
+
+        # private responses are meant for a single user, and this cache is shared
+        if "no-store" in directives or "private" in directives:
+            return None
+        if ttl is not None:
+            return ttl
+        if "no-cache" in directives:
+            return 0.0
+        if "max-age" in directives:
+            try:
+                return max(float(directives["max-age"]) - float(response.headers.get("Age", 0)), 0.0)
+            except ValueError:
+                return 0.0
+        if "Expires" in response.headers:
+            try:
+                expires = email.utils.parsedate_to_datetime(response.headers["Expires"])
+                date = email.utils.parsedate_to_datetime(response.headers["Date"]) if "Date" in response.headers else None
+                return max((expires - date).total_seconds() if date is not None else expires.timestamp() - time.time(), 0.0)
+            except (TypeError, ValueError):
+                return 0.0
+        return self.default_ttl
+
+
+
+_default_cache = EndpointResponseCache()
+
+
+def get_default_endpoint_cache() -> EndpointResponseCache:
+    """Returns the process-wide endpoint response cache used by APIWrappers that aren't given their own."""
+    return _default_cache
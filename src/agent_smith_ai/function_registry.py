@@ -0,0 +1,206 @@
+# Standard library imports
+import hashlib
+import inspect
+import json
+from typing import Any, Callable, Dict, List, Literal, Tuple, Union, get_args, get_origin
+
+# Third party imports
+from docstring_parser import parse
+
+
+class FunctionRegistry:
+    """The functions an agent can call, with their JSON schemas compiled once at registration time.
+
+    The combined schema list (API endpoints first, then local callables) is kept as an immutable tuple together with a
+    fingerprint of its JSON serialization; both are rebuilt only when registrations change, and can otherwise be reused
+    across every request of every turn. The schemas themselves are frozen (see freeze_schema), as they are shared by
+    every request and handed out by the properties below."""
+
+    def __init__(self) -> None:
+        self.callables: Dict[str, Callable] = {}
+        self._method_schemas: Dict[str, Dict[str, Any]] = {}
+        self._api_schemas: Tuple[Dict[str, Any], ...] = ()
+        self._api_names = frozenset()
+        self._schemas = None
+        self._tools = None
+        self._fingerprint = None
+
+
+    def register_callable(self, name: str, func: Callable) -> None:
+        """Registers a local callable, compiling its schema from its signature and docstring.
+
+        Args:
+            name (str): The name to register the callable under.
+            func (Callable): The callable."""
+        self.callables[name] = func
+        self._method_schemas[name] = freeze_schema(_generate_schema(func))
+        self._invalidate()
+
+
+    def set_api_schemas(self, schemas: List[Dict[str, Any]]) -> None:
+        """Sets the schemas of the callable API endpoints, replacing any previously set.
+
+        Args:
+            schemas (List[Dict[str, Any]]): The endpoint schemas."""
+        self._api_schemas = tuple([freeze_schema(schema) for schema in schemas])
+        self._api_names = frozenset([schema['name'] for schema in self._api_schemas])
+        self._invalidate()
+
+
+    def has_function(self, name: str) -> bool:
+        """Returns whether a function (API endpoint or local callable) is registered under the given name.
+
+        Args:
+            name (str): The function name.
+
+        Returns:
+            bool: Whether the function is registered."""
+        return name in self.callables or name in self._api_names
+
+
+    @property
+    def method_schemas(self) -> Tuple[Dict[str, Any], ...]:
+        """The compiled schemas of the local callables, in registration order."""
+        return tuple(self._method_schemas.values())
+
+
+    @property
+    def schemas(self) -> Tuple[Dict[str, Any], ...]:
+        """The combined API endpoint and local callable schemas, in the form sent to the model."""
+        if self._schemas is None:
+            self._schemas = self._api_schemas + self.method_schemas
+        return self._schemas
+
+
+    @property
+    def tools(self) -> Tuple[Dict[str, Any], ...]:
+        """The combined schemas wrapped as tools, the form sent to the model when it may make parallel tool calls."""
+        if self._tools is None:
+            self._tools = tuple([freeze_schema({"type": "function", "function": schema}) for schema in self.schemas])
+        return self._tools
+
+
+    @property
+    def fingerprint(self) -> str:
+        """A sha256 hex digest of the serialized combined schemas, for keying caches on the function set."""
+        if self._fingerprint is None:
+            serialized = json.dumps(self.schemas, sort_keys = True, default = str)
+            self._fingerprint = hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+        return self._fingerprint
+
+
+    def _invalidate(self) -> None:
+        self._schemas = None
+        self._tools = None
+        self._fingerprint = None
+
+
+
+
+_READ_ONLY_MESSAGE = "compiled function schemas are read-only; copy them (e.g. with copy.deepcopy) to modify"
+
+
+def _read_only(self, *args, **kwargs):
+    raise TypeError(_READ_ONLY_MESSAGE)
+
+
+class _FrozenDict(dict):
+    """A dict that can't be modified in place. Still a dict, so it serializes and compares like the schema it was built from."""
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        # copies (and deep copies) are plain, modifiable dicts
+        return (dict, (dict(self),))
+
+
+class _FrozenList(list):
+    """A list that can't be modified in place, see _FrozenDict."""
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = append = clear = extend = insert = pop = remove = reverse = sort = _read_only
+
+    def __reduce__(self):
+        return (list, (list(self),))
+
+
+def freeze_schema(schema: Any) -> Any:
+    """Returns a read-only copy of a function schema, whose dicts and lists raise TypeError when modified in place.
+
+    Schemas that are already frozen are returned as they are, so schemas shared between agents stay shared.
+
+    Args:
+        schema (Any): The schema (or part of one) to freeze.
+
+    Returns:
+        Any: The frozen schema."""
+    if isinstance(schema, (_FrozenDict, _FrozenList)):
+        return schema
+    if isinstance(schema, dict):
+        return _FrozenDict({key: freeze_schema(value) for key, value in schema.items()})
+    if isinstance(schema, list):
+        return _FrozenList([freeze_schema(value) for value in schema])
+    return schema
+
+
+def _python_type_to_json_schema(py_type: type) -> Dict[str, any]:
+    """Translate Python typing annotation to JSON schema-like types."""
+    origin = get_origin(py_type)
+    if origin is None:  # means it's a built-in type
+        if py_type in [float, int]:
+            return {'type': 'number'}
+        elif py_type is str:
+            return {'type': 'string'}
+        elif py_type is bool:
+            return {'type': 'boolean'}
+        elif py_type is None:
+            return {'type': 'null'}
+        elif py_type is Any:
+            return {'type': 'object'}
+        else:
+            raise NotImplementedError(f'Unsupported type: {py_type}')
+    elif origin is list:
+        item_type = get_args(py_type)[0]
+        return {'type': 'array', 'items': _python_type_to_json_schema(item_type)}
+    elif origin is dict:
+        key_type, value_type = get_args(py_type)
+        return {'type': 'object', 'properties': {
+            'key': _python_type_to_json_schema(key_type),
+            'value': _python_type_to_json_schema(value_type)
+        }}
+    elif origin is Union:
+        return {'anyOf': [_python_type_to_json_schema(t) for t in get_args(py_type)]}
+    elif origin is Literal:
+        return {'enum': get_args(py_type)}
+    elif origin is tuple:
+        return {'type': 'array', 'items': [_python_type_to_json_schema(t) for t in get_args(py_type)]}
+    elif origin is set:
+        return {'type': 'array', 'items': _python_type_to_json_schema(get_args(py_type)[0]), 'uniqueItems': True}
+    else:
+        raise NotImplementedError(f'Unsupported type: {origin}')
+
+
+
+def _generate_schema(fn: Callable) -> Dict[str, Any]:
+    """Generate JSON schema for a function. Used to generate the function schema for a local method.
+
+    Args:
+        fn (Callable): The function to generate the schema for.
+
+    Returns:
+        Dict[str, Any]: The generated schema."""
+    docstring = parse(fn.__doc__)
+    sig = inspect.signature(fn)
+    params = sig.parameters
+    schema = {
+        'name': fn.__name__,
+        'parameters': {
+            'type': 'object',
+            'properties': {},
+            'required': list(params.keys())
+        },
+        'description': docstring.short_description,
+    }
+    for p in docstring.params:
+        schema['parameters']['properties'][p.arg_name] = {
+            **_python_type_to_json_schema(params[p.arg_name].annotation),
+            'description': p.description
+        }
+    return schema
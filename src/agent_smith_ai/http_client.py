@@ -0,0 +1,128 @@
+# Standard library imports
+import asyncio
+import threading
+import weakref
+from typing import Any, Dict, Optional
+
+# Third party imports
+import httpx
+
+
+class HTTPClientPool:
+    """Persistent, thread-safe HTTP clients for API endpoint calls, one per base URL, so that connections are kept alive
+    and reused across tool calls (and across agents sharing the pool) instead of paying a new TCP+TLS handshake per call.
+    Async clients are kept separately per event loop, as their connections are bound to the loop that opened them.
+
+    Args:
+        max_connections (int, optional): Maximum concurrent connections per host. Defaults to 20.
+        max_keepalive_connections (int, optional): Maximum idle keep-alive connections kept per host. Defaults to 10.
+        keepalive_expiry (float, optional): Seconds an idle connection is kept alive. Defaults to 30.0.
+        http2 (bool, optional): Whether to negotiate HTTP/2 where the server supports it; requires the `h2` package (`pip install httpx[http2]`). Defaults to False.
+        timeout (Optional[float], optional): Request timeout in seconds, for requests that don't set their own (API endpoint calls use their API's EndpointPolicy timeouts); None for no timeout. Defaults to None.
+    """
+
+    def __init__(self,
+                 max_connections: int = 20,
+                 max_keepalive_connections: int = 10,
+                 keepalive_expiry: float = 30.0,
+                 http2: bool = False,
+                 timeout: Optional[float] = None) -> None:
+        self.defaults = {"max_connections": max_connections,
+                         "max_keepalive_connections": max_keepalive_connections,
+                         "keepalive_expiry": keepalive_expiry,
+                         "http2": http2,
+                         "timeout": timeout}
+        self.host_overrides: Dict[str, Dict[str, Any]] = {}
+        self._clients: Dict[str, httpx.Client] = {}
+        self._async_clients = weakref.WeakKeyDictionary()  # event loop -> {base_url: httpx.AsyncClient}
+        self._lock = threading.Lock()
+
+
+    def configure_host(self, base_url: str, **settings: Any) -> None:
+        """Overrides the pool defaults (any of the constructor arguments) for one base URL. Takes effect the next time
+        a client is created for it; an existing client for the base URL is closed.
+
+        Args:
+            base_url (str): The base URL to configure.
+            **settings: Settings to override, e.g. max_connections=50 or http2=True."""
+        unknown = set(settings) - set(self.defaults)
+        if unknown:
+            raise ValueError(f"Unknown HTTP client settings: {', '.join(sorted(unknown))}")
+
+        with self._lock:
+            self.host_overrides[base_url] = {**self.host_overrides.get(base_url, {}), **settings}
+            client = self._clients.pop(base_url, None)
+            for loop_clients in self._async_clients.values():
+                loop_clients.pop(base_url, None)  # dropped rather than closed, as they belong to other event loops
+        if client is not None:
+            client.close()
+
+
+    def get_client(self, base_url: str) -> httpx.Client:
+        """Returns the shared client for a base URL, creating it on first use.
+
+        Args:
+            base_url (str): The base URL of the API.
+
+        Returns:
+            httpx.Client: The client."""
+        client = self._clients.get(base_url)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(base_url)
+                if client is None:
+                    client = self._create_client(base_url)
+                    self._clients[base_url] = client
+        return client
+
+
+    def get_async_client(self, base_url: str) -> httpx.AsyncClient:
+        """Returns the shared async client for a base URL in the running event loop, creating it on first use.
+
+        Args:
+            base_url (str): The base URL of the API.
+
+        Returns:
+            httpx.AsyncClient: The client."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            loop_clients = self._async_clients.setdefault(loop, {})
+            client = loop_clients.get(base_url)
+            if client is None:
+                client = self._create_client(base_url, client_class = httpx.AsyncClient)
+                loop_clients[base_url] = client
+        return client
+
+
+    async def aclose(self) -> None:
+        """Closes the async clients created in the running event loop."""
+        with self._lock:
+            loop_clients = self._async_clients.pop(asyncio.get_running_loop(), {})
+        for client in loop_clients.values():
+            await client.aclose()
+
+
+    def close(self) -> None:
+        """Closes all clients in the pool."""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients = {}
+        for client in clients:
+            client.close()
+
+
+    def _create_client(self, base_url: str, client_class: type = httpx.Client) -> httpx.Client:
+        settings = {**self.defaults, **self.host_overrides.get(base_url, {})}
+        limits = httpx.Limits(max_connections = settings["max_connections"],
+                              max_keepalive_connections = settings["max_keepalive_connections"],
+                              keepalive_expiry = settings["keepalive_expiry"])
+        return client_class(limits = limits, http2 = settings["http2"], timeout = settings["timeout"])
+
+
+
+_default_pool = HTTPClientPool()
+
+
+def get_default_pool() -> HTTPClientPool:
+    """Returns the process-wide client pool used by APIWrapperSets that aren't given their own."""
+    return _default_pool
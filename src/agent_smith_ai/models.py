@@ -1,5 +1,6 @@
 from typing import Any, Dict, List, Optional
-from pydantic import BaseModel, RootModel, Field
+import json
+from pydantic import BaseModel, RootModel, Field, PrivateAttr
 
 
 class Message(BaseModel):
@@ -29,6 +30,15 @@ class Message(BaseModel):
     finish_reason: Optional[str] = None
     """The reason the conversation ended, as used by the OpenAI API; largely ignorable."""
 
+    tool_call_id: Optional[str] = None
+    """The id of the tool call, for function calls (and their results) made as one of possibly several parallel tool calls."""
+
+    is_delta: bool = False
+    """Whether the message is a piece of a streamed reply, with content holding just the newly arrived text; the complete message follows the deltas."""
+
+    _num_tokens: Optional[int] = PrivateAttr(default = None)
+    """The number of tokens the message uses in a model request; computed once by the agent and cached here. Not serialized."""
+
 
 class Chat(BaseModel):
     """A chat conversation."""
@@ -36,6 +46,92 @@ class Chat(BaseModel):
     messages: List[Message] = []
     """The messages in the conversation."""
 
+    _num_tokens: int = PrivateAttr(default = 0)
+    """Running total of the cached token counts of the messages."""
+
+    _wire_format: List[Dict[str, Any]] = PrivateAttr(default_factory = list)
+    """The messages in the format used by the OpenAI API, serialized as they are appended."""
+
+    def model_post_init(self, __context: Any) -> None:
+        self._num_tokens = sum([message._num_tokens or 0 for message in self.messages])
+        self._wire_format = []
+        for message in self.messages:
+            self._append_wire_format(message)
+
+    @property
+    def wire_format(self) -> List[Dict[str, Any]]:
+        """The messages in the format used by the OpenAI API (see to_wire_format), with consecutive parallel tool calls merged
+        back into the single assistant message the model sent them in. Each message is serialized once, when it is appended,
+        and the list is shared rather than copied, so it must be treated as read-only."""
+        return self._wire_format
+
+    @property
+    def num_tokens(self) -> int:
+        """The total token count of the messages, as cached on each message (excluding per-request overhead)."""
+        return self._num_tokens
+
+    def append(self, message: Message) -> None:
+        """Appends a message to the conversation and adds its cached token count to the running total. 
+        Messages should have their token count cached (see UtilityAgent._count_message_tokens) before being appended.
+
+        Args:
+            message (Message): The message to append."""
+        self.messages.append(message)
+        self._num_tokens += message._num_tokens or 0
+        self._append_wire_format(message)
+
+    def reset(self, messages: List[Message]) -> None:
+        """Replaces the messages in the conversation, recomputing the running token total from the cached counts.
+
+        Args:
+            messages (List[Message]): The new messages."""
+        self.messages = list(messages)
+        self._num_tokens = sum([message._num_tokens or 0 for message in self.messages])
+        # a new list, so requests already holding the old one are unaffected
+        self._wire_format = []
+        for message in self.messages:
+            self._append_wire_format(message)
+
+    def _append_wire_format(self, message: Message) -> None:
+        serialized = to_wire_format(message)
+        if "tool_calls" in serialized and len(self._wire_format) > 0 and "tool_calls" in self._wire_format[-1]:
+            previous = self._wire_format[-1]
+            self._wire_format[-1] = {**previous, "tool_calls": previous["tool_calls"] + serialized["tool_calls"]}
+        else:
+            self._wire_format.append(serialized)
+
+
+def to_wire_format(message: Message) -> Dict[str, Any]:
+    """Serializes a message into a dictionary in the format used by the OpenAI API.
+
+    Args:
+        message (Message): The message to serialize.
+
+    Returns:
+        Dict[str, Any]: The serialized message."""
+    if message.is_function_call and message.tool_call_id is not None:
+        return {"role": message.role,
+                "content": message.content,
+                "tool_calls": [{"id": message.tool_call_id,
+                                "type": "function",
+                                "function": {"name": message.func_name,
+                                             "arguments": json.dumps(message.func_arguments)}}]}
+    if message.is_function_call:
+        return {"role": message.role,
+                "content": message.content,
+                "function_call": {"name": message.func_name,
+                                  "arguments": json.dumps(message.func_arguments)}}
+    if message.role == "function" and message.tool_call_id is not None:
+        return {"role": "tool",
+                "tool_call_id": message.tool_call_id,
+                "content": message.content}
+    if message.role == "function":
+        return {"role": message.role,
+                "name": message.func_name,
+                "content": message.content}
+
+    return {"role": message.role, "content": message.content}
+
 # for function JSON schema sent to the model
 
 class ParameterProperty(BaseModel):
@@ -0,0 +1,199 @@
+# Standard library imports
+import asyncio
+import collections
+import concurrent.futures
+import hashlib
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+# Third party imports
+import openai
+
+# Local application imports
+from agent_smith_ai.rate_limits import RequestScheduler, get_default_request_scheduler
+
+
+class ModerationCache:
+    """A thread-safe LRU cache of moderation verdicts keyed by a hash of the moderated content, with entries expiring
+    after a time-to-live so that changes to the moderation model are eventually picked up.
+
+    Args:
+        max_entries (int, optional): The maximum number of verdicts kept. Defaults to 10000.
+        ttl (float, optional): Seconds a verdict is kept. Defaults to 3600.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 3600.0) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "collections.OrderedDict[str, Tuple[float, Dict[str, Any]]]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def get(self, content: str) -> Optional[Dict[str, Any]]:
+        """Returns the cached verdict for some content, or None if there isn't a current one.
+
+        Args:
+            content (str): The moderated content.
+
+        Returns:
+            Optional[Dict[str, Any]]: The verdict (one entry of a moderation response's results)."""
+        key = _content_key(content)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+
+    def set(self, content: str, verdict: Dict[str, Any]) -> None:
+        """Caches the verdict for some content, evicting the least recently used verdicts beyond max_entries.
+
+        Args:
+            content (str): The moderated content.
+            verdict (Dict[str, Any]): The verdict."""
+        key = _content_key(content)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), verdict)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last = False)
+
+
+    def clear(self) -> None:
+        """Removes all cached verdicts."""
+        with self._lock:
+            self._entries.clear()
+
+
+
+class ModerationBatcher:
+    """Moderates content for any number of concurrent sessions, sync or async, combining the inputs pending at any moment
+    into a single Moderation request (the endpoint accepts a list). Verdicts are cached, so repeated inputs aren't sent again.
+
+    Requests are made one at a time by a background thread: a lone input is sent immediately, and inputs arriving while
+    a request is in flight are sent together in the next one, so batching costs no added latency.
+
+    Args:
+        cache (ModerationCache, optional): The verdict cache. Defaults to a new ModerationCache.
+        max_batch_size (int, optional): The maximum number of inputs per request. Defaults to 32.
+        max_wait (float, optional): Seconds to wait for more inputs before sending a request that isn't full. Defaults to 0.
+        request_scheduler (RequestScheduler, optional): Schedules the moderation requests within the provider's rate limits. Defaults to None (the process-wide scheduler).
+    """
+
+    def __init__(self, cache: ModerationCache = None, max_batch_size: int = 32, max_wait: float = 0.0, request_scheduler: RequestScheduler = None) -> None:
+        self.cache = cache if cache is not None else ModerationCache()
+        self.request_scheduler = request_scheduler
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests_sent = 0
+        self._queue: "queue.Queue[Tuple[str, concurrent.futures.Future]]" = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+
+    def moderate(self, content: str) -> Dict[str, Any]:
+        """Moderates some content, blocking until the verdict is available.
+
+        Args:
+            content (str): The content to moderate.
+
+        Returns:
+            Dict[str, Any]: The verdict (one entry of a moderation response's results, with "flagged" and "categories" keys).
+
+        Raises:
+            openai.error.OpenAIError: If the moderation request fails."""
+        verdict = self.cache.get(content)
+        if verdict is not None:
+            return verdict
+        return self._submit(content).result()
+
+
+    async def amoderate(self, content: str) -> Dict[str, Any]:
+        """The asyncio counterpart of moderate; waiting doesn't block the event loop.
+
+        Args:
+            content (str): The content to moderate.
+
+        Returns:
+            Dict[str, Any]: The verdict."""
+        verdict = self.cache.get(content)
+        if verdict is not None:
+            return verdict
+        return await asyncio.wrap_future(self._submit(content))
+
+
+    def _submit(self, content: str) -> concurrent.futures.Future:
+        future = concurrent.futures.Future()
+        self._queue.put((content, future))
+        # the worker is (re)started if it isn't running, so a worker that died can't leave callers waiting forever
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target = self._run, daemon = True)
+                    self._thread.start()
+        return future
+
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        batch.append(self._queue.get(timeout = remaining))
+                    else:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self._send(batch)
+            except Exception as e:
+                # whatever went wrong, the batch's callers get the error rather than waiting forever, and the worker carries on
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+
+    def _send(self, batch: List[Tuple[str, concurrent.futures.Future]]) -> None:
+        # identical inputs in a batch are only sent once
+        inputs = list(dict.fromkeys([content for content, _ in batch]))
+        # the process-wide batcher is created at import, so the process-wide scheduler is looked up when it's needed
+        scheduler = self.request_scheduler if self.request_scheduler is not None else get_default_request_scheduler()
+        response = scheduler.call(openai.Moderation.create, input = inputs, session = self)
+        self.requests_sent += 1
+
+        results = response.get("results") if isinstance(response, dict) else None
+        if not isinstance(results, list) or len(results) != len(inputs):
+            raise openai.error.APIError(f"Malformed moderation response: expected {len(inputs)} results, got {len(results) if isinstance(results, list) else 'none'}")
+
+        for content, verdict in zip(inputs, results):
+            self.cache.set(content, verdict)
+        verdicts = dict(zip(inputs, results))
+
+        for content, future in batch:
+            future.set_result(verdicts[content])
+
+
+
+def _content_key(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+_default_batcher = ModerationBatcher()
+
+
+def get_default_moderation_batcher() -> ModerationBatcher:
+    """Returns the process-wide moderation batcher used by agents that aren't given their own."""
+    return _default_batcher
@@ -1,27 +1,54 @@
 import requests
+import httpx
 import json
+import asyncio
+import threading
+import time
+from types import MappingProxyType
+
+from agent_smith_ai.function_registry import freeze_schema
+from agent_smith_ai.http_client import get_default_pool
+from agent_smith_ai.spec_cache import SpecUnavailableError, get_default_spec_cache
+from agent_smith_ai.endpoint_cache import get_default_endpoint_cache
+from agent_smith_ai.resilience import CircuitBreaker, get_default_endpoint_policy
 
 
 class APIWrapper:
-    def __init__(self, prefix, spec_url, base_url, callable_endpoints = []):
+    def __init__(self, prefix, spec_url, base_url, callable_endpoints = [], client_pool = None, spec_cache = None, response_cache = None, cache_ttl = None,
+                 endpoint_policy = None):
         self.prefix = prefix
         self.spec_url = spec_url
         self.base_url = base_url
+        self.client_pool = client_pool if client_pool is not None else get_default_pool()
+        self.spec_cache = spec_cache if spec_cache is not None else get_default_spec_cache()
+        # GET results are cached following HTTP caching semantics; cache_ttl (seconds) overrides the API's caching headers
+        self.response_cache = response_cache if response_cache is not None else get_default_endpoint_cache()
+        self.cache_ttl = cache_ttl
+        # timeouts and retries of calls, and a circuit breaker failing calls fast while the API is unhealthy
+        self.endpoint_policy = endpoint_policy if endpoint_policy is not None else get_default_endpoint_policy()
+        self.circuit_breaker = CircuitBreaker(self.endpoint_policy.failure_threshold, self.endpoint_policy.reset_timeout)
         self.endpoints = self.parse_openapi_spec()
 
-        if len(callable_endpoints) > 0:
+        if len(callable_endpoints) > 0 and isinstance(self.endpoints, list):
             callable_endpoints = [prefix + "-" + ep for ep in callable_endpoints]
             self.endpoints = [ep for ep in self.endpoints if ep['name'] in callable_endpoints]
 
+        # frozen once here, so the registries of the agents sharing this wrapper share its schemas too
+        if isinstance(self.endpoints, list):
+            self.endpoints = [freeze_schema(ep) for ep in self.endpoints]
+
+        # name -> compiled endpoint, for constant-time dispatch; empty if the spec couldn't be parsed
+        # (read-only, as wrappers may be shared between agents, see get_shared_api_wrapper)
+        self.endpoint_index = MappingProxyType({})
+        if isinstance(self.endpoints, list):
+            self.endpoint_index = MappingProxyType({ep['name']: _compile_endpoint(ep) for ep in self.endpoints})
+
     def parse_openapi_spec(self):
+        # the spec comes from the (disk-backed, conditionally revalidated) spec cache where possible
         try:
-            response = requests.get(self.spec_url, timeout=10)
-            response.raise_for_status()
-        except requests.exceptions.RequestException as e:
+            spec = self.spec_cache.get(self.spec_url)
+        except (requests.exceptions.RequestException, SpecUnavailableError) as e:
             return {'error': str(e)}
-
-        try:
-            spec = response.json()
         except json.JSONDecodeError as e:
             return {'error': f'Error parsing JSON: {str(e)}'}
 
@@ -42,13 +69,17 @@ class APIWrapper:
                             'path': path
                         }
                         for param in operation.get('parameters', []):
-                            endpoint['parameters']['properties'][param['name']] = param['schema']
+                            # copied, as the parsed spec is shared through the spec cache
+                            endpoint['parameters']['properties'][param['name']] = dict(param['schema'])
                             endpoint['parameters']['properties'][param['name']]['in'] = param['in']
                         endpoints.append(endpoint)
 
         return endpoints
 
     def get_function_schemas(self):
+        # a wrapper whose spec couldn't be loaded offers no functions; the error is kept in self.endpoints
+        if not isinstance(self.endpoints, list):
+            return []
         return self.endpoints
         function_schemas = []
         for ep in self.endpoints:
@@ -68,42 +99,131 @@ class APIWrapper:
                 function_schemas.append(schema)
         return function_schemas
 
+    def has_function(self, name):
+        return name in self.endpoint_index
+
     def call_endpoint(self, function_call):
+        request = self._prepare_request(function_call)
+        if 'status_code' in request:
+            return request
+
+        # Serve fresh cached results without a request, and revalidate stale ones
+        key, entry, fresh = self._cache_lookup(request)
+        if fresh:
+            return self.response_cache.result(entry)
+
+        # Fail fast while the API is unhealthy
+        if not self.circuit_breaker.allow():
+            return self._circuit_open_error()
+
+        # Make the API call with the pooled, keep-alive client for this API, retrying transient failures, and return the result
+        client = self.client_pool.get_client(self.base_url)
+        attempt = 0
+        try:
+            while True:
+                response, error = None, None
+                try:
+                    response = client.request(request['method'], request['url'], params=request['params'], json=request['json'],
+                                              headers=self.response_cache.conditional_headers(entry), timeout=self.endpoint_policy.timeout)
+                except httpx.HTTPError as e:
+                    error = e
+                if not self.endpoint_policy.should_retry(request['method'], attempt, response, error):
+                    break
+                time.sleep(self.endpoint_policy.delay(attempt, response))
+                attempt += 1
+        except BaseException as e:
+            self.circuit_breaker.record_failure(repr(e))
+            raise
+
+        return self._handle_outcome(response, error, key, entry)
+
+    async def acall_endpoint(self, function_call):
+        request = self._prepare_request(function_call)
+        if 'status_code' in request:
+            return request
+
+        key, entry, fresh = self._cache_lookup(request)
+        if fresh:
+            return self.response_cache.result(entry)
+
+        if not self.circuit_breaker.allow():
+            return self._circuit_open_error()
+
+        # as call_endpoint, but with the pooled async client for the running event loop
+        client = self.client_pool.get_async_client(self.base_url)
+        attempt = 0
+        try:
+            while True:
+                response, error = None, None
+                try:
+                    response = await client.request(request['method'], request['url'], params=request['params'], json=request['json'],
+                                                    headers=self.response_cache.conditional_headers(entry), timeout=self.endpoint_policy.timeout)
+                except httpx.HTTPError as e:
+                    error = e
+                if not self.endpoint_policy.should_retry(request['method'], attempt, response, error):
+                    break
+                await asyncio.sleep(self.endpoint_policy.delay(attempt, response))
+                attempt += 1
+        except BaseException as e:
+            # including cancellation, so a half-open circuit's trial call is never left unfinished
+            self.circuit_breaker.record_failure(repr(e))
+            raise
+
+        return self._handle_outcome(response, error, key, entry)
+
+    def health(self):
+        """Returns the health of the API's upstream (see CircuitBreaker.health), for monitoring."""
+        return {'api': self.prefix, 'base_url': self.base_url, 'retry_in': self.circuit_breaker.retry_in(), **self.circuit_breaker.health()}
+
+    def _prepare_request(self, function_call):
         # Find the endpoint matching the function name
-        endpoint = next((ep for ep in self.endpoints if ep['name'] == function_call['name']), None)
-        if endpoint is None or 'error' in endpoint:
+        endpoint = self.endpoint_index.get(function_call['name'])
+        if endpoint is None:
             return {'status_code': 400, 'data': None, 'error': f"Invalid function name: {function_call['name']}"}
 
         # Extract the method, path, and parameters
-        method = endpoint['method']
-        path = endpoint['path']
         all_parameters = function_call['arguments']
+        locations = endpoint['param_locations']
 
         # Separate query and body parameters
-        query_params = {name: value for name, value in all_parameters.items()
-                        if endpoint['parameters']['properties'][name]['in'] == 'query'}
-        body_params = {name: value for name, value in all_parameters.items()
-                       if endpoint['parameters']['properties'][name]['in'] == 'body'}
+        query_params = {name: value for name, value in all_parameters.items() if locations[name] == 'query'}
+        body_params = {name: value for name, value in all_parameters.items() if locations[name] == 'body'}
 
         # Construct the full URL
-        url = self.base_url + path
+        return {
+            'method': endpoint['method'],
+            'url': self.base_url + endpoint['path'],
+            'params': query_params,
+            'json': body_params if body_params else None,
+        }
 
-        # Prepare the request
-        if body_params:
-            req = requests.Request(method, url, params=query_params, json=body_params)
+    def _cache_lookup(self, request):
+        # only GET calls are cached; returns the cache key (None if not cacheable), any cached entry, and whether it is fresh
+        if request['method'] != 'get':
+            return None, None, False
+        key = self.response_cache.key(request['method'], request['url'], request['params'], request['json'])
+        entry, fresh = self.response_cache.lookup(key)
+        return key, entry, fresh
+
+    def _handle_outcome(self, response, error, key = None, entry = None):
+        # server errors and failures to get a response count against the API's health; client errors don't
+        if response is None or response.status_code >= 500:
+            self.circuit_breaker.record_failure(f"{type(error).__name__}: {error}" if response is None else f"HTTP {response.status_code}")
         else:
-            req = requests.Request(method, url, params=query_params)
-        prepped = req.prepare()
+            self.circuit_breaker.record_success()
+
+        if error is not None:
+            return {'status_code': 500, 'data': None, 'error': str(error) or type(error).__name__}
+        return self._handle_response(response, key, entry)
 
-        #print(f'Final URL: {prepped.url}')
-        #print(f'Final body: {prepped.body}')
+    def _circuit_open_error(self):
+        return {'status_code': 503, 'data': None,
+                'error': f"The {self.prefix} API is unavailable after repeated failures ({self.circuit_breaker.last_error}); "
+                         f"calls to it are paused for {self.circuit_breaker.retry_in():.0f} more seconds."}
 
-        # Make the API call and return the result
-        with requests.Session() as session:
-            try:
-                response = session.send(prepped)
-            except requests.exceptions.RequestException as e:
-                return {'status_code': 500, 'data': None, 'error': str(e)}
+    def _handle_response(self, response, key = None, entry = None):
+        if response.status_code == 304 and entry is not None:
+            return self.response_cache.revalidated(key, entry, response, ttl = self.cache_ttl)
 
         if response.status_code >= 400:
             return {
@@ -113,35 +233,124 @@ class APIWrapper:
                 'response_body': response.text
             }
 
-        return {'status_code': response.status_code, 'data': response.json() if response.content else None}
+        result = {'status_code': response.status_code, 'data': response.json() if response.content else None}
+        if key is not None and response.status_code == 200:
+            self.response_cache.store(key, response, result, ttl = self.cache_ttl)
+        return result
 
 
 class APIWrapperSet:
-    def __init__(self, api_wrappers):
+    def __init__(self, api_wrappers, client_pool = None, spec_cache = None, response_cache = None):
         self.api_wrappers = api_wrappers
+        self.client_pool = client_pool if client_pool is not None else get_default_pool()
+        self.spec_cache = spec_cache
+        self.response_cache = response_cache
 
-    def add_api(self, name: str, spec_url: str, base_url: str, callable_endpoints = []):
-        self.api_wrappers.append(APIWrapper(name, spec_url, base_url, callable_endpoints))
+        # function name -> wrapper handling it; when names collide across wrappers the first registered wins
+        self.function_index = {}
+        for wrapper in self.api_wrappers:
+            self._index_wrapper(wrapper)
+
+    def add_api(self, name: str, spec_url: str, base_url: str, callable_endpoints = [], cache_ttl = None, endpoint_policy = None):
+        wrapper = get_shared_api_wrapper(name, spec_url, base_url, callable_endpoints, client_pool = self.client_pool, spec_cache = self.spec_cache,
+                                         response_cache = self.response_cache, cache_ttl = cache_ttl, endpoint_policy = endpoint_policy)
+        self.api_wrappers.append(wrapper)
+        self._index_wrapper(wrapper)
 
     def get_function_schemas(self):
         return [schema for wrapper in self.api_wrappers for schema in wrapper.get_function_schemas()]
 
     def get_function_names(self):
-        return [schema['name'] for schema in self.get_function_schemas()]
+        return list(self.function_index.keys())
+
+    def has_function(self, name):
+        return name in self.function_index
+
+    def health(self):
+        return [wrapper.health() for wrapper in self.api_wrappers]
 
     def call_endpoint(self, function_call):
         # Find the wrapper that can handle this function call
-        wrapper = None
-        for w in self.api_wrappers:
-            for ep in w.endpoints:
-                if ep['name'] == function_call['name']:
-                    wrapper = w
-                    break
-            if wrapper is not None:
-                break
+        wrapper = self.function_index.get(function_call['name'])
 
         if wrapper is None:
             return {'status_code': 400, 'data': None, 'error': f"Invalid function name: {function_call['name']}"}
 
         # Delegate the function call to the appropriate wrapper
         return wrapper.call_endpoint(function_call)
+
+    async def acall_endpoint(self, function_call):
+        wrapper = self.function_index.get(function_call['name'])
+
+        if wrapper is None:
+            return {'status_code': 400, 'data': None, 'error': f"Invalid function name: {function_call['name']}"}
+
+        return await wrapper.acall_endpoint(function_call)
+
+    def _index_wrapper(self, wrapper):
+        for name in wrapper.endpoint_index:
+            self.function_index.setdefault(name, wrapper)
+
+
+def _compile_endpoint(endpoint):
+    """Precomputes what call_endpoint needs from a parsed endpoint: its method, path, and the location of each parameter."""
+    return {
+        'method': endpoint['method'],
+        'path': endpoint['path'],
+        'param_locations': {name: prop['in'] for name, prop in endpoint['parameters']['properties'].items()},
+    }
+
+
+# process-wide registry of compiled wrappers, so agents registering the same API share one parsed copy
+_shared_wrappers = {}
+_shared_wrapper_locks = {} # key -> [lock, number of registrations using it], only while wrappers are being built
+_shared_wrappers_lock = threading.Lock()
+
+
+def get_shared_api_wrapper(prefix, spec_url, base_url, callable_endpoints = [], client_pool = None, spec_cache = None, response_cache = None, cache_ttl = None,
+                           endpoint_policy = None):
+    """Returns the process-wide APIWrapper for an API, building it on first request. Wrappers are keyed by
+    (prefix, spec_url, base_url, callable_endpoints), the client pool they call through, their response caching and
+    their endpoint policy (compared by value), and must be treated as read-only by the agents sharing them (which also share its circuit
+    breaker, so they all see the API's health). Wrappers whose spec couldn't be loaded are not shared,
+    so later registrations retry."""
+    client_pool = client_pool if client_pool is not None else get_default_pool()
+    response_cache = response_cache if response_cache is not None else get_default_endpoint_cache()
+    endpoint_policy = endpoint_policy if endpoint_policy is not None else get_default_endpoint_policy()
+    key = (prefix, spec_url, base_url, tuple(callable_endpoints), client_pool, response_cache, cache_ttl, endpoint_policy)
+
+    wrapper = _shared_wrappers.get(key)
+    if wrapper is not None:
+        return wrapper
+
+    # one lock per key, so concurrent registrations of the same API build it once without serializing other APIs;
+    # the lock is dropped when the last registration using it is done, so locks don't accumulate with the keys
+    with _shared_wrappers_lock:
+        key_lock = _shared_wrapper_locks.setdefault(key, [threading.Lock(), 0])
+        key_lock[1] += 1
+
+    try:
+        with key_lock[0]:
+            wrapper = _shared_wrappers.get(key)
+            if wrapper is None:
+                wrapper = APIWrapper(prefix, spec_url, base_url, callable_endpoints, client_pool = client_pool, spec_cache = spec_cache,
+                                     response_cache = response_cache, cache_ttl = cache_ttl, endpoint_policy = endpoint_policy)
+                if isinstance(wrapper.endpoints, list):
+                    _shared_wrappers[key] = wrapper
+    finally:
+        with _shared_wrappers_lock:
+            key_lock[1] -= 1
+            if key_lock[1] == 0 and _shared_wrapper_locks.get(key) is key_lock:
+                del _shared_wrapper_locks[key]
+    return wrapper
+
+
+def get_api_health():
+    """Returns the health of the APIs registered in this process (see APIWrapper.health), e.g. for a status page."""
+    return [wrapper.health() for wrapper in list(_shared_wrappers.values())]
+
+
+def clear_shared_api_wrappers():
+    """Empties the process-wide wrapper registry; agents keep the wrappers they already hold."""
+    with _shared_wrappers_lock:
+        _shared_wrappers.clear()
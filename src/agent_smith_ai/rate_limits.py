@@ -0,0 +1,291 @@
+# Standard library imports
+import asyncio
+import collections
+import email.utils
+import random
+import re
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+# Third party imports
+import openai
+
+# Local application imports
+from agent_smith_ai.token_bucket import SQLiteBucketStore, TokenBucket
+
+
+class RequestScheduler:
+    """Schedules the requests made to the OpenAI API (completions, moderation and summarization) so that together they
+    stay within the provider's rate limits, rather than each session finding the limits by being refused.
+
+    Requests are admitted against a requests-per-minute and a tokens-per-minute budget (either optional). A request
+    reserves its estimated prompt tokens when admitted, and the reservation is corrected to the usage the API reports
+    once it completes, or given back if it fails. Requests waiting for budget are queued per session and admitted round-robin, so a session
+    making many requests (e.g. a long tool loop) can't starve the others.
+
+    Requests refused with a 429 (or 503) are retried: all requests are paused for as long as the response's
+    retry-after or x-ratelimit-reset headers ask, or, without them, for a jittered exponentially growing delay.
+    Refusals for an exhausted quota aren't retried.
+
+    Args:
+        requests_per_minute (float, optional): The requests allowed per minute. Defaults to None (no limit).
+        tokens_per_minute (float, optional): The tokens allowed per minute. Defaults to None (no limit).
+        max_retries (int, optional): The most times a refused request is retried before its error is raised. Defaults to 5.
+        backoff (float, optional): The delay, in seconds, before the first retry of a refusal without rate limit headers; it doubles with each retry. Defaults to 1.
+        max_backoff (float, optional): The longest delay between retries, in seconds. Defaults to 60.
+        store (SQLiteBucketStore, optional): A store for the budgets, shared by processes using the same API key. Defaults to None (in memory).
+    """
+
+    def __init__(self,
+                 requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None,
+                 max_retries: int = 5,
+                 backoff: float = 1.0,
+                 max_backoff: float = 60.0,
+                 store: SQLiteBucketStore = None) -> None:
+        self.requests = None if requests_per_minute is None else TokenBucket(requests_per_minute, requests_per_minute / 60.0, store = store, key = "openai-requests" if store is not None else None)
+        self.tokens = None if tokens_per_minute is None else TokenBucket(tokens_per_minute, tokens_per_minute / 60.0, store = store, key = "openai-tokens" if store is not None else None)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.requests_sent = 0
+        self.retries = 0
+        self._paused_until = 0.0
+        self._sessions: "collections.OrderedDict[Hashable, collections.deque]" = collections.OrderedDict() # waiting tickets, in round-robin order
+        self._condition = threading.Condition()
+
+
+    def call(self, func: Callable[..., Any], *args, estimated_tokens: int = 0, session: Hashable = None, **kwargs) -> Any:
+        """Calls an OpenAI API function once the request is admitted, retrying it if it is refused for exceeding a rate limit.
+
+        Args:
+            func (Callable[..., Any]): The function, e.g. openai.ChatCompletion.create.
+            *args: Positional arguments for the function.
+            estimated_tokens (int, optional): The request's estimated prompt tokens. Defaults to 0.
+            session (Hashable, optional): The session making the request, for fair queueing. Defaults to None (a session shared by all such requests).
+            **kwargs: Keyword arguments for the function.
+
+        Returns:
+            Any: The function's result.
+
+        Raises:
+            openai.error.OpenAIError: If the request fails, or is still refused after max_retries retries."""
+        attempt = 0
+        while True:
+            reserved = self._admit(session, estimated_tokens)
+            completed = False
+            try:
+                response = func(*args, **kwargs)
+                completed = True
+            except (openai.error.RateLimitError, openai.error.ServiceUnavailableError, openai.error.TryAgain) as e:
+                if not self._retry_after(e, attempt):
+                    raise
+                attempt += 1
+                continue
+            finally:
+                if not completed:
+                    self._release(reserved)
+            self._reconcile(reserved, response)
+            return response
+
+
+    async def acall(self, func: Callable[..., Awaitable[Any]], *args, estimated_tokens: int = 0, session: Hashable = None, **kwargs) -> Any:
+        """The asyncio counterpart of call, for coroutine functions such as openai.ChatCompletion.acreate; waiting doesn't block the event loop."""
+        attempt = 0
+        while True:
+            reserved = await self._aadmit(session, estimated_tokens)
+            completed = False
+            try:
+                response = await func(*args, **kwargs)
+                completed = True
+            except (openai.error.RateLimitError, openai.error.ServiceUnavailableError, openai.error.TryAgain) as e:
+                if not self._retry_after(e, attempt):
+                    raise
+                attempt += 1
+                continue
+            finally:
+                if not completed:
+                    self._release(reserved)
+            self._reconcile(reserved, response)
+            return response
+
+
+    def pause(self, seconds: float) -> None:
+        """Holds back all requests for the given number of seconds (or longer, if already paused for longer)."""
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._condition.notify_all()
+
+
+    def _admit(self, session: Hashable, estimated_tokens: int) -> int:
+        """Waits for a request's turn and budget, and consumes the budget; returns the tokens reserved."""
+        ticket = self._enqueue(session, estimated_tokens)
+        try:
+            with self._condition:
+                while True:
+                    wait = self._try_admit(ticket)
+                    if wait == 0:
+                        return ticket.reserved
+                    self._condition.wait(wait)
+        finally:
+            self._dequeue(ticket)
+
+
+    async def _aadmit(self, session: Hashable, estimated_tokens: int) -> int:
+        """The asyncio counterpart of _admit."""
+        ticket = self._enqueue(session, estimated_tokens)
+        try:
+            while True:
+                with self._condition:
+                    wait = self._try_admit(ticket)
+                if wait == 0:
+                    return ticket.reserved
+                # requests further back in the queue check again shortly, as their turn can come at any time
+                await asyncio.sleep(_QUEUE_POLL_INTERVAL if wait is None else wait)
+        finally:
+            self._dequeue(ticket)
+
+
+    def _enqueue(self, session: Hashable, estimated_tokens: int) -> "_Ticket":
+        ticket = _Ticket(session, estimated_tokens)
+        with self._condition:
+            self._sessions.setdefault(session, collections.deque()).append(ticket)
+        return ticket
+
+
+    def _dequeue(self, ticket: "_Ticket") -> None:
+        """Removes a ticket that gave up waiting (e.g. was cancelled), letting the next request go."""
+        with self._condition:
+            tickets = self._sessions.get(ticket.session)
+            if tickets is None or ticket not in tickets:
+                return
+            tickets.remove(ticket)
+            if len(tickets) == 0:
+                del self._sessions[ticket.session]
+            self._condition.notify_all()
+
+
+    def _try_admit(self, ticket: "_Ticket") -> Optional[float]:
+        """Admits a ticket if it is first in the queue and the budget allows, consuming the budget. Called holding the lock.
+
+        Returns:
+            0 if the ticket was admitted, None if it isn't first in the queue, otherwise the seconds until it may be."""
+        session, tickets = next(iter(self._sessions.items()))
+        if tickets[0] is not ticket:
+            return None
+
+        wait = self._paused_until - time.monotonic()
+        reserved = ticket.tokens if self.tokens is None else min(ticket.tokens, self.tokens.max_tokens)
+        if self.requests is not None:
+            wait = max(wait, self.requests.time_until_tokens_available(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.time_until_tokens_available(reserved))
+        if wait > 0:
+            # a small margin, so the next attempt doesn't arrive just short of the budget
+            return wait + 0.001
+
+        # another process sharing the budgets may have taken it in the meantime
+        if self.requests is not None and not self.requests.consume(1):
+            return _QUEUE_POLL_INTERVAL
+        if self.tokens is not None and not self.tokens.consume(reserved):
+            if self.requests is not None:
+                self.requests.adjust(-1)
+            return _QUEUE_POLL_INTERVAL
+
+        ticket.reserved = reserved
+        self.requests_sent += 1
+        # the session goes to the back of the round-robin, behind the other waiting sessions
+        tickets.popleft()
+        del self._sessions[session]
+        if len(tickets) > 0:
+            self._sessions[session] = tickets
+        self._condition.notify_all()
+        return 0
+
+
+    def _release(self, reserved: int) -> None:
+        """Gives back the tokens reserved by a request that failed (or was refused, or cancelled) without using them."""
+        if self.tokens is not None:
+            self.tokens.adjust(-reserved)
+
+
+    def _reconcile(self, reserved: int, response: Any) -> None:
+        """Corrects a request's reserved tokens to the usage reported in its response (streamed responses report none)."""
+        if self.tokens is None or not isinstance(response, dict) or "usage" not in response:
+            return
+        self.tokens.adjust(response["usage"]["total_tokens"] - reserved)
+
+
+    def _retry_after(self, error: openai.error.OpenAIError, attempt: int) -> bool:
+        """Pauses all requests before a refused request is retried; returns False if it shouldn't be retried."""
+        if attempt >= self.max_retries or error.code == "insufficient_quota":
+            return False
+        delay = retry_delay(error.headers)
+        if delay is None:
+            delay = min(self.backoff * 2 ** attempt, self.max_backoff) * random.uniform(0.5, 1.0)
+        self.retries += 1
+        self.pause(min(delay, self.max_backoff))
+        return True
+
+
+
+class _Ticket:
+    """A request waiting to be admitted; tickets compare by identity."""
+    __slots__ = ("session", "tokens", "reserved")
+
+    def __init__(self, session: Hashable, tokens: int) -> None:
+        self.session = session
+        self.tokens = tokens
+        self.reserved = 0
+
+
+_QUEUE_POLL_INTERVAL = 0.005
+
+
+def retry_delay(headers: Dict[str, str]) -> Optional[float]:
+    """Returns the seconds to wait before retrying a refused request according to its response headers: retry-after-ms,
+    retry-after (seconds or an HTTP date), or the longest of the x-ratelimit-reset-requests and x-ratelimit-reset-tokens
+    durations (e.g. "1s", "6m0s" or "20ms"). Returns None if there are no such headers."""
+    headers = {key.lower(): value for key, value in headers.items()}
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000.0
+        if "retry-after" in headers:
+            try:
+                return float(headers["retry-after"])
+            except ValueError:
+                return max(email.utils.parsedate_to_datetime(headers["retry-after"]).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        pass
+
+    resets = [_duration(headers[key]) for key in ["x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"] if key in headers]
+    resets = [reset for reset in resets if reset is not None]
+    return max(resets) if len(resets) > 0 else None
+
+
+def _duration(text: str) -> Optional[float]:
+    """Parses a duration such as "1h2m3.5s" or "20ms" into seconds."""
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", text)
+    if len(parts) == 0 or "".join([number + unit for number, unit in parts]) != text.strip():
+        return None
+    units = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+    return sum([float(number) * units[unit] for number, unit in parts])
+
+
+_default_scheduler = RequestScheduler()
+
+
+def get_default_request_scheduler() -> RequestScheduler:
+    """Returns the process-wide request scheduler used by agents and moderation batchers that aren't given their own. It
+    has no rate limits configured, so it only paces retries of refused requests; see set_default_request_scheduler."""
+    return _default_scheduler
+
+
+def set_default_request_scheduler(scheduler: RequestScheduler) -> None:
+    """Replaces the process-wide request scheduler, e.g. with one configured with the account's rate limits.
+
+    Args:
+        scheduler (RequestScheduler): The new default scheduler."""
+    global _default_scheduler
+    _default_scheduler = scheduler
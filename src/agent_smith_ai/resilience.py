@@ -0,0 +1,183 @@
+# Standard library imports
+import dataclasses
+import random
+import threading
+import time
+from typing import Any, Dict, Optional
+
+# Third party imports
+import httpx
+
+# Local application imports
+from agent_smith_ai.rate_limits import retry_delay
+
+
+@dataclasses.dataclass(frozen = True)
+class EndpointPolicy:
+    """How the endpoints of an API are called: timeouts, retries of transient failures, and when to stop calling an
+    upstream that keeps failing (see CircuitBreaker). Failures left after the retries are still returned to the model as
+    error results, but many fewer of them, so fewer model round-trips are spent asking for a call to be made again.
+
+    Only idempotent calls (GET, HEAD, OPTIONS, PUT and DELETE) are retried after a response or a read timeout; calls of
+    any method are retried if the connection couldn't be made, as the request was then never sent. Retries wait for a
+    jittered, exponentially growing delay, or as long as a 429 or 503 response's Retry-After header asks.
+
+    Policies are immutable and compare by value, so agents registering an API with equal policies share its wrapper.
+
+    Args:
+        max_retries (int, optional): The most retries of a call. Defaults to 2.
+        backoff (float, optional): The delay, in seconds, before the first retry; it doubles with each retry. Defaults to 0.5.
+        max_backoff (float, optional): The longest delay between retries, in seconds. Defaults to 10.
+        connect_timeout (Optional[float], optional): Seconds to wait for a connection. Defaults to 5. None for no timeout.
+        read_timeout (Optional[float], optional): Seconds to wait for each read of the response. Defaults to 30. None for no timeout.
+        failure_threshold (int, optional): The number of consecutive failed calls after which the API's circuit opens. Defaults to 5.
+        reset_timeout (float, optional): Seconds a circuit stays open before a trial call is let through. Defaults to 30.
+    """
+
+    max_retries: int = 2
+    backoff: float = 0.5
+    max_backoff: float = 10.0
+    connect_timeout: Optional[float] = 5.0
+    read_timeout: Optional[float] = 30.0
+    failure_threshold: int = 5
+    reset_timeout: float = 30.0
+
+
+    @property
+    def timeout(self) -> httpx.Timeout:
+        """The timeouts of each request, for httpx."""
+        return httpx.Timeout(connect = self.connect_timeout, read = self.read_timeout, write = self.read_timeout, pool = self.connect_timeout)
+
+
+    def should_retry(self, method: str, attempt: int, response: Optional[httpx.Response] = None, error: Optional[httpx.HTTPError] = None) -> bool:
+        """Whether a call should be retried after an attempt's response or error.
+
+        Args:
+            method (str): The call's HTTP method.
+            attempt (int): The number of retries made so far.
+            response (Optional[httpx.Response], optional): The attempt's response. Defaults to None.
+            error (Optional[httpx.HTTPError], optional): The attempt's error. Defaults to None."""
+        if attempt >= self.max_retries:
+            return False
+        if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+            return True
+        if method.lower() not in _IDEMPOTENT_METHODS:
+            return False
+        if error is not None:
+            return isinstance(error, httpx.TransportError)
+        return response is not None and response.status_code in _RETRIED_STATUSES
+
+
+    def delay(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        """Returns the seconds to wait before a retry: as long as the response's Retry-After header asks (up to
+        max_backoff), or otherwise a jittered exponential backoff."""
+        delay = retry_delay(response.headers) if response is not None else None
+        if delay is None:
+            delay = min(self.backoff * 2 ** attempt, self.max_backoff) * random.uniform(0.5, 1.0)
+        return min(delay, self.max_backoff)
+
+
+
+class CircuitBreaker:
+    """Tracks the health of an upstream API, failing calls fast while it is unhealthy rather than letting each wait for
+    timeouts and retries.
+
+    The circuit is closed (calls are made) until failure_threshold consecutive calls fail, when it opens: calls are
+    refused without a request for reset_timeout seconds. Then it is half-open, and a single trial call is let through;
+    the circuit closes if it succeeds, and opens again if it fails.
+
+    Args:
+        failure_threshold (int, optional): The number of consecutive failures that open the circuit. Defaults to 5.
+        reset_timeout (float, optional): Seconds the circuit stays open. Defaults to 30.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.consecutive_failures = 0
+        self.failures = 0
+        self.successes = 0
+        self.refused = 0
+        self.last_error = None
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+
+    @property
+    def state(self) -> str:
+        """"closed", "open" or "half-open"."""
+        with self._lock:
+            return self._state(time.monotonic())
+
+
+    def allow(self) -> bool:
+        """Whether a call may be made now; while half-open, only the first caller gets to make the trial call. A call
+        that was allowed must be followed by record_success or record_failure."""
+        with self._lock:
+            state = self._state(time.monotonic())
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.refused += 1
+            return False
+
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.successes += 1
+            self.consecutive_failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+
+    def record_failure(self, error: str) -> None:
+        with self._lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.last_error = error
+            if self._trial_in_flight or self.consecutive_failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+
+    def retry_in(self) -> float:
+        """Seconds until the open circuit lets a trial call through (0 if it isn't open)."""
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            return max(self._opened_at + self.reset_timeout - time.monotonic(), 0.0)
+
+
+    def health(self) -> Dict[str, Any]:
+        """Returns a summary of the upstream's health, for monitoring."""
+        with self._lock:
+            return {"state": self._state(time.monotonic()),
+                    "consecutive_failures": self.consecutive_failures,
+                    "failures": self.failures,
+                    "successes": self.successes,
+                    "refused": self.refused,
+                    "last_error": self.last_error}
+
+
+    def _state(self, now: float) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if now < self._opened_at + self.reset_timeout:
+            return "open"
+        return "half-open"
+
+
+
+_IDEMPOTENT_METHODS = {"get", "head", "options", "put", "delete"}
+_RETRIED_STATUSES = {429, 502, 503, 504}
+
+
+_default_policy = EndpointPolicy()
+
+
+def get_default_endpoint_policy() -> EndpointPolicy:
+    """Returns the endpoint policy used by APIs registered without their own."""
+    return _default_policy
@@ -0,0 +1,123 @@
+# Standard library imports
+import json
+from typing import Any, List, Optional, Tuple
+
+# Local application imports
+from agent_smith_ai import tokenizer
+
+
+class ResultCompactor:
+    """Compacts the data returned by an API endpoint before it is sent to the model, where it is re-sent on every later
+    request of the conversation. Results are encoded as JSON without whitespace, and optionally projected to a set of
+    fields and limited to a number of rows, with a marker noting how many rows were shown. A token budget is enforced
+    last: rows are dropped until the result fits, and a result that still doesn't fit is truncated.
+
+    The data given is never modified, so results shared with other agents (e.g. through the endpoint response cache)
+    are unaffected.
+
+    Args:
+        fields (List[str], optional): The fields to keep in each row (or in the result, if it has no rows), as dotted paths for nested fields, e.g. ["id", "subject.name"]. Defaults to None (keep all fields).
+        max_rows (int, optional): The maximum number of rows to keep. Defaults to None (keep all rows).
+        max_tokens (int, optional): The maximum number of tokens in the compacted result. Defaults to None (no limit).
+        rows_key (str, optional): The field of the result holding its rows. Defaults to None: the result itself if it is a list, otherwise its first list-valued field.
+    """
+
+    def __init__(self, fields: Optional[List[str]] = None, max_rows: Optional[int] = None, max_tokens: Optional[int] = None, rows_key: Optional[str] = None) -> None:
+        self.fields = fields
+        self.max_rows = max_rows
+        self.max_tokens = max_tokens
+        self.rows_key = rows_key
+
+
+    def compact(self, data: Any, model: str = "gpt-3.5-turbo-0613") -> str:
+        """Returns the compacted JSON encoding of an API result.
+
+        Args:
+            data (Any): The decoded JSON data returned by the endpoint.
+            model (str, optional): The model whose tokenizer measures the token budget. Defaults to "gpt-3.5-turbo-0613".
+
+        Returns:
+            str: The compacted result."""
+        rows_key, rows = self._rows(data)
+        if rows is None:
+            return self._fit(_encode(self._project(data)), model)
+
+        rows = [self._project(row) for row in rows]
+        num_rows = len(rows) if self.max_rows is None else min(len(rows), self.max_rows)
+        text = _encode(_with_rows(data, rows_key, rows, num_rows))
+        if self.max_tokens is None or tokenizer.count_tokens(text, model = model) <= self.max_tokens:
+            return text
+
+        # find the most rows that fit the budget
+        low, high = 0, num_rows - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if tokenizer.count_tokens(_encode(_with_rows(data, rows_key, rows, middle)), model = model) <= self.max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        return self._fit(_encode(_with_rows(data, rows_key, rows, low)), model)
+
+
+    def _rows(self, data: Any) -> Tuple[Optional[str], Optional[List[Any]]]:
+        """Returns the field holding the rows of a result (None if the result is itself a list of rows) and the rows (None if there aren't any)."""
+        if isinstance(data, list):
+            return None, data
+        if isinstance(data, dict):
+            if self.rows_key is not None:
+                return (self.rows_key, data[self.rows_key]) if isinstance(data.get(self.rows_key), list) else (None, None)
+            for key, value in data.items():
+                if isinstance(value, list):
+                    return key, value
+        return None, None
+
+
+    def _project(self, value: Any) -> Any:
+        """Returns a copy of a row with only the configured fields."""
+        if self.fields is None or not isinstance(value, dict):
+            return value
+        projected = {}
+        for path in self.fields:
+            _copy_path(value, projected, path.split("."))
+        return projected
+
+
+    def _fit(self, text: str, model: str) -> str:
+        """Truncates text to the token budget, marking it as truncated."""
+        if self.max_tokens is None or tokenizer.count_tokens(text, model = model) <= self.max_tokens:
+            return text
+        return tokenizer.truncate(text, self.max_tokens - _TRUNCATED_MARKER_TOKENS, model = model) + _TRUNCATED_MARKER
+
+
+
+_TRUNCATED_MARKER = "... [truncated]"
+_TRUNCATED_MARKER_TOKENS = 5
+
+
+def _encode(data: Any) -> str:
+    return json.dumps(data, separators = (",", ":"), ensure_ascii = False)
+
+
+def _with_rows(data: Any, rows_key: Optional[str], rows: List[Any], num_rows: int) -> Any:
+    """Returns a copy of a result keeping its first num_rows rows, with a marker if any were dropped."""
+    kept = rows[:num_rows]
+    if num_rows < len(rows):
+        kept = kept + [f"truncated {num_rows} of {len(rows)}"]
+    if rows_key is None:
+        return kept
+    return {**data, rows_key: kept}
+
+
+def _copy_path(source: Any, target: dict, path: List[str]) -> None:
+    """Copies the value at a dotted path of source into target, creating the intermediate dictionaries."""
+    if not isinstance(source, dict) or path[0] not in source:
+        return
+    if len(path) == 1:
+        target[path[0]] = source[path[0]]
+    elif isinstance(source[path[0]], list):
+        # a path into a list of objects applies to each of them
+        items = target.setdefault(path[0], [{} for _ in source[path[0]]])
+        for item, projected in zip(source[path[0]], items):
+            _copy_path(item, projected, path[1:])
+    else:
+        _copy_path(source[path[0]], target.setdefault(path[0], {}), path[1:])
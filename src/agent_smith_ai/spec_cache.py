@@ -0,0 +1,207 @@
+# Standard library imports
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+# Third party imports
+import requests
+
+
+class SpecUnavailableError(Exception):
+    """Raised when a spec isn't cached and can't be fetched (e.g. in offline mode)."""
+
+
+class SpecCache:
+    """A persistent cache of OpenAPI specs keyed by URL, so agent construction doesn't have to download and parse
+    every spec again. Entries store the raw spec along with its ETag/Last-Modified validators.
+
+    Cached specs younger than `revalidate_after` seconds are served without any network access. Older ones are
+    revalidated with a conditional GET (a 304 response just refreshes the entry), either before returning or, with
+    `stale_while_revalidate`, in a background thread while the cached copy is served immediately. If revalidation fails,
+    the cached copy is served. In offline mode the network is never used.
+
+    Args:
+        cache_dir (str, optional): Directory to store specs in. Defaults to the AGENT_SMITH_AI_CACHE_DIR environment variable, or ~/.cache/agent_smith_ai, with specs in its "specs" subdirectory.
+        revalidate_after (float, optional): Seconds after which a cached spec is revalidated. Defaults to 300.
+        stale_while_revalidate (bool, optional): Serve stale specs immediately and revalidate in the background. Defaults to True.
+        offline (bool, optional): Never access the network, serving only cached specs. Defaults to the AGENT_SMITH_AI_OFFLINE environment variable being set to "1" or "true".
+        timeout (float, optional): Timeout in seconds for spec downloads. Defaults to 10.
+    """
+
+    def __init__(self,
+                 cache_dir: Optional[str] = None,
+                 revalidate_after: float = 300.0,
+                 stale_while_revalidate: bool = True,
+                 offline: Optional[bool] = None,
+                 timeout: float = 10.0) -> None:
+        if cache_dir is None:
+            base_dir = os.environ.get("AGENT_SMITH_AI_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "agent_smith_ai"))
+            cache_dir = os.path.join(base_dir, "specs")
+        if offline is None:
+            offline = os.environ.get("AGENT_SMITH_AI_OFFLINE", "").lower() in ["1", "true"]
+
+        self.cache_dir = cache_dir
+        self.revalidate_after = revalidate_after
+        self.stale_while_revalidate = stale_while_revalidate
+        self.offline = offline
+        self.timeout = timeout
+
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._specs: Dict[str, Dict[str, Any]] = {}
+        self._revalidating = set()
+        self._lock = threading.Lock()
+
+
+    def get(self, url: str) -> Dict[str, Any]:
+        """Returns the parsed spec for a URL, from the cache where possible.
+
+        Args:
+            url (str): The URL of the spec.
+
+        Returns:
+            Dict[str, Any]: The parsed spec.
+
+        Raises:
+            SpecUnavailableError: If offline and the spec isn't cached.
+            requests.exceptions.RequestException: If the spec isn't cached and can't be downloaded.
+            json.JSONDecodeError: If a downloaded spec isn't valid JSON."""
+        entry = self._load_entry(url)
+
+        if entry is None:
+            if self.offline:
+                raise SpecUnavailableError(f"No cached spec for {url} (offline mode)")
+            entry = self._fetch(url, None)
+
+        elif not self.offline and time.time() - entry["fetched_at"] > self.revalidate_after:
+            if self.stale_while_revalidate:
+                self._revalidate_in_background(url, entry)
+            else:
+                try:
+                    entry = self._fetch(url, entry)
+                except (requests.exceptions.RequestException, ValueError):
+                    pass  # serve the cached copy
+
+        return self._parsed(url, entry)
+
+
+    def clear(self) -> None:
+        """Removes all cached specs, in memory and on disk."""
+        with self._lock:
+            self._entries = {}
+            self._specs = {}
+        if os.path.isdir(self.cache_dir):
+            for filename in os.listdir(self.cache_dir):
+                if filename.endswith(".json"):
+                    os.remove(os.path.join(self.cache_dir, filename))
+
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+
+
+    def _load_entry(self, url: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(url)
+        if entry is not None:
+            return entry
+
+        try:
+            with open(self._path(url), "r") as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+
+        with self._lock:
+            self._entries.setdefault(url, entry)
+            return self._entries[url]
+
+
+    def _fetch(self, url: str, entry: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Downloads the spec, conditionally if there is a cached entry, stores the result and returns the new entry."""
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = requests.get(url, headers = headers, timeout = self.timeout)
+        if response.status_code == 304 and entry is not None:
+            new_entry = {**entry, "fetched_at": time.time()}
+        else:
+            response.raise_for_status()
+            json.loads(response.text)  # validate before caching
+            new_entry = {"url": url,
+                         "etag": response.headers.get("ETag"),
+                         "last_modified": response.headers.get("Last-Modified"),
+                         "fetched_at": time.time(),
+                         "spec": response.text}
+
+        self._store(url, new_entry)
+        return new_entry
+
+
+    def _store(self, url: str, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            previous = self._entries.get(url)
+            self._entries[url] = entry
+            if previous is None or previous["spec"] != entry["spec"]:
+                self._specs.pop(url, None)
+
+        try:
+            os.makedirs(self.cache_dir, exist_ok = True)
+            path = self._path(url)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as file:
+                json.dump(entry, file)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass  # an unwritable cache directory only costs us persistence
+
+
+    def _parsed(self, url: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+        spec = self._specs.get(url)
+        if spec is None:
+            spec = json.loads(entry["spec"])
+            with self._lock:
+                if self._entries.get(url) is entry:
+                    self._specs[url] = spec
+        return spec
+
+
+    def _revalidate_in_background(self, url: str, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            if url in self._revalidating:
+                return
+            self._revalidating.add(url)
+
+        def revalidate():
+            try:
+                self._fetch(url, entry)
+            except (requests.exceptions.RequestException, ValueError):
+                pass
+            finally:
+                with self._lock:
+                    self._revalidating.discard(url)
+
+        threading.Thread(target = revalidate, daemon = True).start()
+
+
+
+_default_spec_cache = SpecCache()
+
+
+def get_default_spec_cache() -> SpecCache:
+    """Returns the process-wide spec cache used by APIWrappers that aren't given their own."""
+    return _default_spec_cache
+
+
+def set_default_spec_cache(spec_cache: SpecCache) -> None:
+    """Replaces the process-wide spec cache, e.g. to change its directory or enable offline mode.
+
+    Args:
+        spec_cache (SpecCache): The new default spec cache."""
+    global _default_spec_cache
+    _default_spec_cache = spec_cache
@@ -37,8 +37,6 @@ def set_app_agents(agents_func):
         for agent in st.session_state.agents.values():
             if "conversation_started" not in agent:
                 agent["conversation_started"] = False
-            if "messages" not in agent:
-                agent["messages"] = []
 
 
 def serve_app():
@@ -81,8 +79,8 @@ def _has_valid_api_key():
     return bool(st.session_state.user_api_key) or bool(st.session_state.default_api_key)
 
 
-# Render chat message
-def _render_message(message):
+# Render chat message; the text of a streamed reply has already been rendered as it arrived (see _render_delta)
+def _render_message(message, streamed = False):
     current_agent_avatar = st.session_state.agents[st.session_state.current_agent_name].get("avatar", None)
     current_user_avatar = st.session_state.agents[st.session_state.current_agent_name].get("user_avatar", None)
 
@@ -94,7 +92,7 @@ def _render_message(message):
         with st.chat_message("assistant", avatar="ℹ️"):
             st.write(message.content)
 
-    elif message.role == "assistant" and not message.is_function_call:
+    elif message.role == "assistant" and message.content and not streamed:
         with st.chat_message("assistant", avatar=current_agent_avatar):
             st.write(message.content)
 
@@ -116,6 +114,17 @@ def _render_message(message):
 
     return current_action
     
+# Render a piece of a streamed reply, starting a new chat message for the first piece
+def _render_delta(message, live_reply):
+    if live_reply is None:
+        current_agent_avatar = st.session_state.agents[st.session_state.current_agent_name].get("avatar", None)
+        with st.chat_message("assistant", avatar=current_agent_avatar):
+            live_reply = {"placeholder": st.empty(), "content": ""}
+
+    live_reply["content"] += message.content
+    live_reply["placeholder"].write(live_reply["content"])
+    return live_reply
+
 # Handle chat input and responses
 def _handle_chat_input():
     if prompt := st.chat_input(disabled=st.session_state.lock_widgets, on_submit=_lock_ui):  # Step 4: Add on_submit callback
@@ -123,18 +132,28 @@ def _handle_chat_input():
 
         # Continue with conversation
         if not agent.get('conversation_started', False):
-            messages = agent['agent'].chat(prompt, yield_prompt_message=True)
+            messages = agent['agent'].chat(prompt, yield_prompt_message=True, stream=True)
             agent['conversation_started'] = True
         else:
-            messages = agent['agent'].chat(prompt, yield_prompt_message=True)
+            messages = agent['agent'].chat(prompt, yield_prompt_message=True, stream=True)
 
         st.session_state.current_action = "*Thinking...*"
+        live_reply = None
         while True:
             try:
                 with st.spinner(st.session_state.current_action):
                     message = next(messages)
-                    agent['messages'].append(message)
-                    st.session_state.current_action = _render_message(message)
+
+                    # replies are streamed: render the text live, then replace it with the complete message
+                    if message.is_delta:
+                        live_reply = _render_delta(message, live_reply)
+                        continue
+
+                    streamed = live_reply is not None and message.role == "assistant"
+                    if streamed and message.content:
+                        live_reply["placeholder"].write(message.content)
+                    st.session_state.current_action = _render_message(message, streamed = streamed)
+                    live_reply = None
        
                     session_id = st.runtime.scriptrunner.add_script_run_ctx().streamlit_script_run_ctx.session_id
                     info = {"session_id": session_id, "message": message.model_dump(), "agent": st.session_state.current_agent_name}
@@ -149,7 +168,6 @@ def _clear_chat_current_agent():
     current_agent = st.session_state.agents[st.session_state.current_agent_name]
     current_agent['conversation_started'] = False
     current_agent['agent'].clear_history()
-    st.session_state.agents[st.session_state.current_agent_name]['messages'] = []
 
 
 # Lock the UI when user submits input
@@ -197,7 +215,9 @@ def _main():
     with st.chat_message("assistant", avatar = current_agent_avatar):
         st.write(st.session_state.agents[st.session_state.current_agent_name]['greeting'])
 
-    for message in st.session_state.agents[st.session_state.current_agent_name]['messages']:
+    # the transcript is the agent's own history (without its system message), rather than a copy kept alongside it
+    history = st.session_state.agents[st.session_state.current_agent_name]['agent'].history
+    for message in history.messages[1:] if history is not None else []:
         _render_message(message)
 
     # Check for valid API key and adjust chat input box accordingly
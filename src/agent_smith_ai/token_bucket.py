@@ -1,70 +1,260 @@
+# Standard library imports
+import asyncio
+import os
+import sqlite3
+import threading
 import time
+from typing import Dict, Optional, Tuple
+
 
 class TokenBucket:
-    """An implementation of the token bucket algorithm."""
-    def __init__(self, tokens: float, refill_rate: float):
+    """A thread-safe implementation of the token bucket algorithm. The bucket holds up to `tokens` tokens and gains
+    `refill_rate` tokens per second; consuming is atomic, and acquire waits (blocking or asynchronously) for tokens to
+    become available.
+
+    By default the bucket's state lives in memory and is measured with the monotonic clock. Given a SQLiteBucketStore and
+    a key, the state is kept in the store instead, so that buckets with the same key in several worker processes enforce
+    one shared budget.
+
+    Args:
+        tokens (float): The number of tokens the bucket starts with, and the maximum it can hold. None for an infinite bucket.
+        refill_rate (float): The number of tokens gained per second.
+        store (SQLiteBucketStore, optional): A store shared with other processes. Defaults to None (in memory).
+        key (str, optional): The bucket's key in the store. Required with a store.
+    """
+    def __init__(self, tokens: float, refill_rate: float, store: "SQLiteBucketStore" = None, key: str = None):
+        if store is not None and key is None:
+            raise ValueError("A key is required for buckets kept in a store.")
         self.tokens = tokens
         self.max_tokens = tokens
         self.refill_rate = refill_rate
-        self.last_refill = time.time()
+        self.store = store
+        self.key = key
+        self.last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
 
+    def consume(self, count=1) -> bool:
+        """Consumes count tokens if they are available, without waiting.
 
-    def consume(self, count=1):
+        Args:
+            count (float, optional): The number of tokens. Defaults to 1.
+
+        Returns:
+            bool: Whether the tokens were consumed."""
         # if max_tokens is None, bucket is infinite
         if self.max_tokens is None:
             return True
-        
-        if self.tokens >= count:
-            self.tokens -= count
+        return self._take(count)[0]
+
+
+    def acquire(self, count = 1, timeout: Optional[float] = None) -> bool:
+        """Consumes count tokens, waiting for them to become available.
+
+        Args:
+            count (float, optional): The number of tokens. Defaults to 1.
+            timeout (Optional[float], optional): The longest to wait, in seconds. Defaults to None (wait as long as it takes).
+
+        Returns:
+            bool: Whether the tokens were consumed; False if the timeout passed first, or if the bucket can never hold count tokens."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self._acquire_step(count, deadline)
+            if wait is None or wait is True:
+                return wait is True
+            time.sleep(wait)
+
+
+    async def aacquire(self, count = 1, timeout: Optional[float] = None) -> bool:
+        """The asyncio counterpart of acquire; waiting doesn't block the event loop."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self._acquire_step(count, deadline)
+            if wait is None or wait is True:
+                return wait is True
+            await asyncio.sleep(wait)
 
-            return True
-        
-        return False
 
+    def adjust(self, count: float) -> None:
+        """Removes count tokens whether or not they are available (or returns them, if count is negative), e.g. to
+        correct an estimated cost once the actual cost is known. A bucket may be left in debt, which later consumers wait
+        out; it never holds more than its maximum.
 
-    def refill(self):
+        Args:
+            count (float): The number of tokens."""
         if self.max_tokens is None:
             return
-        
-        now = time.time()
-        elapsed = now - self.last_refill
-        refill_amount = elapsed * self.refill_rate
-        self.tokens = min(self.tokens + refill_amount, self.max_tokens)
-        self.last_refill = now
-
-
-    def time_until_tokens_available(self, desired_tokens: str) -> float:
-        if self.tokens >= self.max_tokens or self.max_tokens is None:
-            return 0  # bucket is full
-        
+        self._take(count, force = True)
+
+
+    def refill(self) -> None:
+        """Brings the bucket's token count up to date."""
+        if self.max_tokens is None:
+            return
+        self._take(0)
+
+
+    def time_until_tokens_available(self, desired_tokens: float) -> float:
+        """Returns the number of seconds until desired_tokens tokens will be available (0 if they are now). Requests for
+        more than the bucket can hold are treated as requests for a full bucket.
+
+        Args:
+            desired_tokens (float): The number of tokens.
+
+        Returns:
+            float: The number of seconds."""
+        if self.max_tokens is None:
+            return 0
+        _, available = self._take(0)
         desired_tokens = min(desired_tokens, self.max_tokens)
-        tokens_needed = desired_tokens - self.tokens
-        seconds_until_refill = tokens_needed / self.refill_rate
-        return seconds_until_refill
+        if available >= desired_tokens:
+            return 0
+        if self.refill_rate <= 0:
+            return float("inf")
+        return (desired_tokens - available) / self.refill_rate
+
+
+    def _acquire_step(self, count: float, deadline: Optional[float]):
+        """Tries to consume count tokens; returns True if they were consumed, None if the attempt should be given up,
+        or otherwise the number of seconds to wait before trying again."""
+        if self.max_tokens is None:
+            return True
+        if count > self.max_tokens:
+            return None
+        granted, available = self._take(count)
+        if granted:
+            return True
+        if self.refill_rate <= 0:
+            return None
+        # a small margin, so the next attempt doesn't arrive just short of the tokens
+        wait = (count - available) / self.refill_rate + 0.001
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            wait = min(wait, remaining)
+        return wait
+
+
+    def _take(self, count: float, force: bool = False) -> Tuple[bool, float]:
+        """Atomically refills the bucket and consumes count tokens if they are available (or regardless, if forced).
+
+        Returns:
+            Whether the tokens were consumed, and the number of tokens left available."""
+        if self.store is not None:
+            granted, self.tokens = self.store.take(self.key, count, self.max_tokens, self.refill_rate, force = force)
+            return granted, self.tokens
+
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.tokens + (now - self.last_refill) * self.refill_rate, self.max_tokens)
+            self.last_refill = now
+            if force or self.tokens >= count:
+                self.tokens = min(self.tokens - count, self.max_tokens)
+                return True, self.tokens
+            return False, self.tokens
+
 
 
 class TokenBucketManager:
-    def __init__(self):
-        self.buckets = {}
+    """Keeps a token bucket per identifier, e.g. per user or per API key, optionally in a store shared by several processes.
+
+    Args:
+        store (SQLiteBucketStore, optional): The store to keep the buckets in. Defaults to None (in memory).
+    """
+    def __init__(self, store: "SQLiteBucketStore" = None):
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.store = store
+        self._lock = threading.Lock()
 
-    def get_bucket(self, identifier):
+    def get_bucket(self, identifier: str) -> Optional[TokenBucket]:
         return self.buckets.get(identifier)
 
-    def create_bucket(self, identifier, tokens, refill_rate):
-        self.buckets[identifier] = TokenBucket(tokens, refill_rate)
+    def create_bucket(self, identifier: str, tokens: float, refill_rate: float) -> TokenBucket:
+        bucket = TokenBucket(tokens, refill_rate, store = self.store, key = identifier if self.store is not None else None)
+        with self._lock:
+            self.buckets[identifier] = bucket
+        return bucket
+
+    def get_or_create_bucket(self, identifier: str, tokens: float, refill_rate: float) -> TokenBucket:
+        """Returns the bucket for an identifier, creating it with the given capacity and refill rate if there isn't one."""
+        with self._lock:
+            bucket = self.buckets.get(identifier)
+            if bucket is None:
+                bucket = TokenBucket(tokens, refill_rate, store = self.store, key = identifier if self.store is not None else None)
+                self.buckets[identifier] = bucket
+            return bucket
 
-    def consume(self, identifier, count=1):
+    def consume(self, identifier: str, count = 1) -> bool:
         bucket = self.get_bucket(identifier)
         if bucket:
             return bucket.consume(count)
         return False
 
-    def refill_buckets(self):
-        for bucket in self.buckets.values():
+    def acquire(self, identifier: str, count = 1, timeout: Optional[float] = None) -> bool:
+        bucket = self.get_bucket(identifier)
+        if bucket:
+            return bucket.acquire(count, timeout = timeout)
+        return False
+
+    async def aacquire(self, identifier: str, count = 1, timeout: Optional[float] = None) -> bool:
+        bucket = self.get_bucket(identifier)
+        if bucket:
+            return await bucket.aacquire(count, timeout = timeout)
+        return False
+
+    def refill_buckets(self) -> None:
+        for bucket in list(self.buckets.values()):
             bucket.refill()
 
-    def time_until_tokens_available(self, identifier, desired_tokens: str) -> float:
+    def time_until_tokens_available(self, identifier: str, desired_tokens: float) -> Optional[float]:
         bucket = self.get_bucket(identifier)
         if bucket:
-            return bucket.time_until_next_refill(desired_tokens)
-        return None
\ No newline at end of file
+            return bucket.time_until_tokens_available(desired_tokens)
+        return None
+
+
+
+class SQLiteBucketStore:
+    """Keeps token bucket state in an sqlite database, so that worker processes serving the same users share their
+    budgets. Each consume is a single immediate transaction, so it is atomic across processes. As monotonic clocks
+    aren't comparable between processes (or reboots), refills are measured with the wall clock; a clock stepping
+    backwards refills nothing.
+
+    Args:
+        path (str): The database file.
+    """
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+        self.path = path
+        # transactions are managed explicitly; waits up to 30 seconds for other processes' transactions
+        self._db = sqlite3.connect(path, timeout = 30, isolation_level = None, check_same_thread = False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS token_buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+        self._lock = threading.Lock()
+
+    def take(self, key: str, count: float, max_tokens: float, refill_rate: float, force: bool = False) -> Tuple[bool, float]:
+        """Atomically refills a bucket and consumes count tokens from it if they are available (or regardless, if forced,
+        which may leave the bucket in debt). A bucket not yet in the store starts full.
+
+        Returns:
+            Whether the tokens were consumed, and the number of tokens left available."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute("SELECT tokens, updated FROM token_buckets WHERE key = ?", (key,)).fetchone()
+                now = time.time()
+                tokens = max_tokens if row is None else min(row[0] + max(now - row[1], 0.0) * refill_rate, max_tokens)
+                granted = force or tokens >= count
+                if granted:
+                    tokens = min(tokens - count, max_tokens)
+                self._db.execute("INSERT OR REPLACE INTO token_buckets (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return granted, tokens
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
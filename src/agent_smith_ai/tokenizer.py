@@ -0,0 +1,264 @@
+"""Process-wide token counting for OpenAI chat models.
+
+Encodings and per-model message overheads are resolved once per model and cached, so counting in the hot path
+of a conversation turn is just encoding. Counting follows
+https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb (Aug 2023) for
+messages, and https://github.com/hmarr/openai-chat-tokens for function definitions.
+"""
+# Standard library imports
+import threading
+from typing import Any, Dict, List, Tuple, Union
+
+# Third party imports
+import tiktoken
+
+
+_encodings: Dict[str, tiktoken.Encoding] = {}
+_overheads: Dict[str, Tuple[int, int]] = {}
+_lock = threading.Lock()
+
+# every reply is primed with <|start|>assistant<|message|>
+REPLY_PRIMING_TOKENS = 3
+
+
+def get_encoding(model: str = "gpt-3.5-turbo-0613") -> tiktoken.Encoding:
+    """Return the (cached) tiktoken encoding for a model, falling back to cl100k_base for unknown models.
+
+    Args:
+        model (str, optional): The model name. Defaults to "gpt-3.5-turbo-0613".
+
+    Returns:
+        tiktoken.Encoding: The encoding used by the model."""
+    encoding = _encodings.get(model)
+    if encoding is None:
+        with _lock:
+            encoding = _encodings.get(model)
+            if encoding is None:
+                try:
+                    encoding = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    encoding = tiktoken.get_encoding("cl100k_base")
+                _encodings[model] = encoding
+    return encoding
+
+
+def _message_overheads(model: str) -> Tuple[int, int]:
+    """Return the (tokens_per_message, tokens_per_name) overheads for a model, resolved once and cached.
+    Unversioned gpt-3.5-turbo and gpt-4 variants are counted as their 0613 versions."""
+    overheads = _overheads.get(model)
+    if overheads is not None:
+        return overheads
+
+    if model == "gpt-3.5-turbo-0301":
+        overheads = (4, -1)  # every message follows <|start|>{role/name}\n{content}<|end|>\n; if there's a name, the role is omitted
+    elif "gpt-3.5-turbo" in model or "gpt-4" in model:
+        overheads = (3, 1)
+    else:
+        raise NotImplementedError(
+            f"""Token counting is not implemented for model {model}. See https://github.com/openai/openai-python/blob/main/chatml.md for information on how messages are converted to tokens."""
+        )
+
+    _overheads[model] = overheads
+    return overheads
+
+
+def count_tokens(text: str, model: str = "gpt-3.5-turbo-0613") -> int:
+    """Return the number of tokens in a string. Special-token text (e.g. "<|endoftext|>") is counted as ordinary text.
+
+    Args:
+        text (str): The text to count.
+        model (str, optional): The model to use for tokenization. Defaults to "gpt-3.5-turbo-0613".
+
+    Returns:
+        int: The number of tokens in the text."""
+    return len(get_encoding(model).encode_ordinary(text))
+
+
+def truncate(text: str, max_tokens: int, model: str = "gpt-3.5-turbo-0613") -> str:
+    """Return the longest prefix of a string that is at most max_tokens tokens long.
+
+    Args:
+        text (str): The text to truncate.
+        max_tokens (int): The maximum number of tokens to keep.
+        model (str, optional): The model to use for tokenization. Defaults to "gpt-3.5-turbo-0613".
+
+    Returns:
+        str: The text, or its truncated prefix."""
+    encoding = get_encoding(model)
+    tokens = encoding.encode_ordinary(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max(max_tokens, 0)])
+
+
+def count_message(message: Dict[str, Any], model: str = "gpt-3.5-turbo-0613") -> int:
+    """Return the number of tokens used by a single message, excluding the reply priming tokens added once per request.
+
+    Args:
+        message (Dict[str, Any]): The message, in the format used by the OpenAI API.
+        model (str, optional): The model to use for tokenization. Defaults to "gpt-3.5-turbo-0613".
+
+    Returns:
+        int: The number of tokens used by the message."""
+    tokens_per_message, tokens_per_name = _message_overheads(model)
+    encoding = get_encoding(model)
+
+    num_tokens = tokens_per_message
+    for key, value in message.items():
+        num_tokens += len(encoding.encode_ordinary(str(value)))
+        if key == "name":
+            num_tokens += tokens_per_name
+    return num_tokens
+
+
+def count_messages(messages: List[Dict[str, Any]], model: str = "gpt-3.5-turbo-0613") -> int:
+    """Return the number of tokens used by a list of messages, including the reply priming tokens.
+
+    Args:
+        messages (List[Dict[str, Any]]): The messages, in the format used by the OpenAI API.
+        model (str, optional): The model to use for tokenization. Defaults to "gpt-3.5-turbo-0613".
+
+    Returns:
+        int: The number of tokens used by the messages."""
+    return sum([count_message(message, model = model) for message in messages]) + REPLY_PRIMING_TOKENS
+
+
+def count_many(items: List[Union[str, Dict[str, Any]]], model: str = "gpt-3.5-turbo-0613", num_threads: int = 8) -> List[int]:
+    """Return token counts for many strings or messages at once, encoding them in parallel threads with tiktoken's batch encoder.
+    Strings are counted as with count_tokens, and message dictionaries as with count_message.
+
+    Args:
+        items (List[Union[str, Dict[str, Any]]]): The strings and/or messages to count.
+        model (str, optional): The model to use for tokenization. Defaults to "gpt-3.5-turbo-0613".
+        num_threads (int, optional): The number of threads to encode with. Defaults to 8.
+
+    Returns:
+        List[int]: The token count of each item, in order."""
+    texts = []
+    spans = []
+    for item in items:
+        start = len(texts)
+        if isinstance(item, str):
+            texts.append(item)
+        else:
+            texts.extend([str(value) for value in item.values()])
+        spans.append((start, len(texts)))
+
+    lengths = [len(tokens) for tokens in get_encoding(model).encode_ordinary_batch(texts, num_threads = num_threads)]
+
+    counts = []
+    for item, (start, end) in zip(items, spans):
+        num_tokens = sum(lengths[start:end])
+        if not isinstance(item, str):
+            tokens_per_message, tokens_per_name = _message_overheads(model)
+            num_tokens += tokens_per_message
+            if "name" in item:
+                num_tokens += tokens_per_name
+        counts.append(num_tokens)
+    return counts
+
+
+def _format_function_type(param: Dict[str, Any], indent: int) -> str:
+    """Render a JSON schema property as a TypeScript type, as done by the provider for function definitions.
+    Helper for format_function_definitions."""
+    param_type = param.get("type")
+    if param_type == "string":
+        if "enum" in param:
+            return " | ".join([f'"{v}"' for v in param["enum"]])
+        return "string"
+    elif param_type in ["number", "integer"]:
+        if "enum" in param:
+            return " | ".join([f"{v}" for v in param["enum"]])
+        return "number"
+    elif param_type == "boolean":
+        return "boolean"
+    elif param_type == "null":
+        return "null"
+    elif param_type == "object":
+        return "\n".join(["{", _format_object_properties(param, indent + 2), "}"])
+    elif param_type == "array":
+        if isinstance(param.get("items"), dict):
+            return f"{_format_function_type(param['items'], indent)}[]"
+        return "any[]"
+    return ""
+
+
+def _format_object_properties(obj: Dict[str, Any], indent: int) -> str:
+    """Render the properties of a JSON schema object as TypeScript object members, one per line.
+    Helper for format_function_definitions."""
+    lines = []
+    required = obj.get("required", [])
+    for name, param in (obj.get("properties") or {}).items():
+        if param.get("description") and indent < 2:
+            lines.append(f"// {param['description']}")
+        if name in required:
+            lines.append(f"{name}: {_format_function_type(param, indent)},")
+        else:
+            lines.append(f"{name}?: {_format_function_type(param, indent)},")
+    return "\n".join([" " * indent + line for line in lines])
+
+
+def format_function_definitions(functions: List[Dict[str, Any]]) -> str:
+    """Render function schemas in the TypeScript-namespace layout the provider uses when injecting them into the prompt.
+
+    Args:
+        functions (List[Dict[str, Any]]): The function schemas, as sent to the ChatCompletion API.
+
+    Returns:
+        str: The rendered function definitions."""
+    lines = ["namespace functions {", ""]
+    for function in functions:
+        if function.get("description"):
+            lines.append(f"// {function['description']}")
+        parameters = function.get("parameters") or {}
+        if len(parameters.get("properties") or {}) > 0:
+            lines.append(f"type {function['name']} = (_: {{")
+            lines.append(_format_object_properties(parameters, 0))
+            lines.append("}) => any;")
+        else:
+            lines.append(f"type {function['name']} = () => any;")
+        lines.append("")
+    lines.append("} // namespace functions")
+    return "\n".join(lines)
+
+
+def count_functions(functions: List[Dict[str, Any]], model: str = "gpt-3.5-turbo-0613") -> int:
+    """Return the number of prompt tokens used by a list of function schemas.
+
+    Args:
+        functions (List[Dict[str, Any]]): The function schemas to count the tokens of.
+        model (str, optional): The model to use for tokenization. Defaults to "gpt-3.5-turbo-0613".
+
+    Returns:
+        int: The number of tokens used by the function definitions, including fixed overhead (but not the system message adjustment)."""
+    if len(functions) == 0:
+        return 0
+    return count_tokens(format_function_definitions(functions), model = model) + 9
+
+
+def count_prompt(messages: List[Dict[str, Any]], functions: List[Dict[str, Any]] = [], model: str = "gpt-3.5-turbo-0613") -> int:
+    """Return the number of prompt tokens used by a full ChatCompletion request, as reported by usage.prompt_tokens.
+
+    Args:
+        messages (List[Dict[str, Any]]): The messages of the request.
+        functions (List[Dict[str, Any]], optional): The function schemas of the request. Defaults to [].
+        model (str, optional): The model to use for tokenization. Defaults to "gpt-3.5-turbo-0613".
+
+    Returns:
+        int: The number of prompt tokens used by the request."""
+    if len(functions) == 0:
+        return count_messages(messages, model = model)
+
+    # the provider appends a newline to the first system message when function definitions are present
+    padded_messages = []
+    padded_system = False
+    for message in messages:
+        if message["role"] == "system" and not padded_system:
+            message = {**message, "content": message["content"] + "\n"}
+            padded_system = True
+        padded_messages.append(message)
+
+    num_tokens = count_messages(padded_messages, model = model) + count_functions(functions, model = model)
+    if padded_system:
+        num_tokens -= 4
+    return num_tokens
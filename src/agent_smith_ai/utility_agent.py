@@ -1,20 +1,30 @@
 # Standard library imports
 from datetime import datetime
+import asyncio
+import concurrent.futures
 import inspect
 import os
 import json
+import threading
+import time
 import traceback
-from typing import Any, Dict, List, Union, Literal, get_args, get_origin, Generator, Callable
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, Iterator, List, Optional, Tuple, Union, Generator, Callable
 
 # Third party imports
-from docstring_parser import parse
 import openai
-import tiktoken
 
 # Local application imports
 from agent_smith_ai.openapi_wrapper import APIWrapperSet 
+from agent_smith_ai.function_registry import FunctionRegistry
+from agent_smith_ai.http_client import HTTPClientPool
+from agent_smith_ai.completion_cache import CompletionCache, replay_chunks, areplay_chunks
+from agent_smith_ai.moderation import ModerationBatcher, get_default_moderation_batcher
+from agent_smith_ai.resilience import EndpointPolicy
+from agent_smith_ai.result_compaction import ResultCompactor
 from agent_smith_ai.models import *
+from agent_smith_ai.rate_limits import RequestScheduler, get_default_request_scheduler
 from agent_smith_ai.token_bucket import TokenBucket
+from agent_smith_ai import tokenizer
 
 
 
@@ -29,7 +39,22 @@ class UtilityAgent:
                  max_tokens: float = None,
                  # in tokens/sec; 10000 tokens/hr = 10000 / 3600
                  token_refill_rate: float = 10000.0 / 3600.0,
-                 check_toxicity = True) -> None:
+                 check_toxicity = True,
+                 http_client_pool: HTTPClientPool = None,
+                 parallel_tool_calls: bool = False,
+                 max_parallel_tool_calls: int = 8,
+                 optimistic_moderation: bool = False,
+                 moderation_batcher: ModerationBatcher = None,
+                 completion_cache: CompletionCache = None,
+                 background_summarize_buffer_tokens: Union[int, None] = None,
+                 summary_chunk_tokens: Union[int, None] = None,
+                 max_parallel_summaries: int = 4,
+                 result_compactor: ResultCompactor = None,
+                 max_steps: Union[int, None] = 25,
+                 max_wall_time: Union[float, None] = None,
+                 max_tokens_per_turn: Union[int, None] = None,
+                 token_bucket: TokenBucket = None,
+                 request_scheduler: RequestScheduler = None) -> None:
         """A UtilityAgent is an AI-powered chatbot that can call API endpoints and local methods.
         
         Args:
@@ -42,6 +67,21 @@ class UtilityAgent:
             max_tokens (float, optional): The number of tokens an agent starts with, and the maximum it can bank. Defaults to None (infinite/no token limiting).
             token_refill_rate (float, optional): The number of tokens the agent gains per second. Defaults to 10000.0 / 3600.0 (10000 tokens per hour).
             check_toxicity (bool, optional): Whether to check the toxicity of user messages using OpenAI's moderation endpoint. Defaults to True.
+            http_client_pool (HTTPClientPool, optional): The pool of keep-alive HTTP clients used for API endpoint calls. Defaults to None (the process-wide pool).
+            parallel_tool_calls (bool, optional): Offer functions to the model as tools, so it can request several calls in one response; these are executed concurrently. Requires a model supporting tools (e.g. gpt-3.5-turbo-1106 or later). Defaults to False.
+            max_parallel_tool_calls (int, optional): The maximum number of tool calls executed at once. Defaults to 8.
+            optimistic_moderation (bool, optional): Request the completion while the user's message is being moderated, rather than after, saving a round-trip per turn. The completion is only used once the message has passed moderation, and is discarded otherwise. Defaults to False.
+            moderation_batcher (ModerationBatcher, optional): Moderates user messages, caching verdicts and batching the messages of concurrent sessions into one request. Defaults to None (the process-wide batcher).
+            completion_cache (CompletionCache, optional): A cache of model responses, answering repeated (temperature 0) requests without calling the model; also used for summarization. Defaults to None (no caching).
+            background_summarize_buffer_tokens (Union[int, None], optional): Start summarizing older turns in the background once the conversation comes within this many tokens of the context size (a soft watermark, larger than auto_summarize_buffer_tokens), and swap the summary into the history at the start of a later turn, so turns rarely wait on summarization. Defaults to None (only summarize once auto_summarize_buffer_tokens is reached).
+            summary_chunk_tokens (Union[int, None], optional): The most tokens of conversation sent in one summarization request. Longer conversations are split into parts of at most this size, which are summarized concurrently and their summaries then summarized together. Defaults to None (the model's context size less a reserve for the summary).
+            max_parallel_summaries (int, optional): The maximum number of parts of a long conversation summarized at once. Defaults to 4.
+            result_compactor (ResultCompactor, optional): Compacts the results of API endpoint calls before they are added to the history, for APIs registered without their own. Defaults to None (encode results as JSON without whitespace).
+            max_steps (Union[int, None], optional): The maximum number of rounds of function calls in a turn, after which the turn ends with a message saying so. Defaults to 25. Set to None for no limit.
+            max_wall_time (Union[float, None], optional): The maximum number of seconds a turn's rounds of function calls may take before the turn is ended. Defaults to None (no limit).
+            max_tokens_per_turn (Union[int, None], optional): The maximum number of prompt tokens sent to the model over a turn's rounds of function calls, beyond which the turn is ended. Defaults to None (no limit).
+            token_bucket (TokenBucket, optional): The token bucket to draw from, e.g. one shared by all of a user's agents, from a TokenBucketManager (which may keep its buckets in a store shared by several processes). Defaults to None (a bucket of the agent's own, from max_tokens and token_refill_rate).
+            request_scheduler (RequestScheduler, optional): Schedules the agent's completion and summarization requests, with those of other sessions, within the provider's rate limits, and retries requests refused for exceeding them. Defaults to None (the process-wide scheduler).
             """
  
         if openai_api_key is not None:
@@ -60,15 +100,40 @@ class UtilityAgent:
         self.system_message = system_message
         self.history = None
     
-        self.api_set = APIWrapperSet([])
-        self.callable_functions = {}
+        self.api_set = APIWrapperSet([], client_pool = http_client_pool)
+        self.function_registry = FunctionRegistry()
+        self.callable_functions = self.function_registry.callables
 
-        self.function_schema_tokens = None # to be computed later if needed by _count_function_schema_tokens, which costs a couple of messages and is cached; being lazy speeds up agent initialization
+        self.function_schema_tokens = None # computed lazily (and locally) by _count_function_schema_tokens, cached until the registered functions change
         self.register_callable_functions({"time": self.time, "help": self.help})
 
-        self.token_bucket = TokenBucket(tokens = max_tokens, refill_rate = token_refill_rate)
+        self.token_bucket = token_bucket if token_bucket is not None else TokenBucket(tokens = max_tokens, refill_rate = token_refill_rate)
         self.check_toxicity = check_toxicity
 
+        self.parallel_tool_calls = parallel_tool_calls
+        self.max_parallel_tool_calls = max_parallel_tool_calls
+        # the pool sync tool calls run on, kept for the agent's lifetime rather than built per step (threads are started as needed)
+        self._tool_executor = concurrent.futures.ThreadPoolExecutor(max_workers = max_parallel_tool_calls)
+        self.optimistic_moderation = optimistic_moderation
+        self.moderation_batcher = moderation_batcher if moderation_batcher is not None else get_default_moderation_batcher()
+        self.completion_cache = completion_cache
+        self.request_scheduler = request_scheduler if request_scheduler is not None else get_default_request_scheduler()
+        self._scheduler_session = self # summarizer agents queue their requests as part of the session they summarize
+
+        self.background_summarize = background_summarize_buffer_tokens
+        self._background_summary = None # (future, summarized messages) for a summary of older turns being prepared in the background
+        self._summary_lock = threading.Lock()
+        self.summary_chunk_tokens = summary_chunk_tokens
+        self.max_parallel_summaries = max_parallel_summaries
+
+        self.result_compactor = result_compactor if result_compactor is not None else ResultCompactor()
+        self.result_compactors = {} # by API name, or by function name for individual endpoints
+
+        self.max_steps = max_steps
+        self.max_wall_time = max_wall_time
+        self.max_tokens_per_turn = max_tokens_per_turn
+        self.last_turn_steps = [] # per-step timings of the latest turn's tool loop; see _TurnBudget
+
 
     def set_api_key(self, key: str) -> None:
         """Sets the OpenAI API key for the agent.
@@ -81,7 +146,8 @@ class UtilityAgent:
         os.environ["OPENAI_API_KEY"] = key
 
 
-    def register_api(self, name: str, spec_url: str, base_url: str, callable_endpoints: List[str] = []) -> None:
+    def register_api(self, name: str, spec_url: str, base_url: str, callable_endpoints: List[str] = [], cache_ttl: Optional[float] = None,
+                     result_compactor: Union[ResultCompactor, Dict[str, ResultCompactor], None] = None, endpoint_policy: EndpointPolicy = None) -> None:
         """Registers an API with the agent. The agent will be able to call the API's endpoints.
         
         Args:
@@ -89,22 +155,43 @@ class UtilityAgent:
             spec_url (str): The URL of the API's OpenAPI specification. Must be a URL to a JSON file. 
             base_url (str): The base URL of the API.
             callable_endpoints (List[str], optional): A list of endpoint names that the agent can call. Defaults to [].
+            cache_ttl (Optional[float], optional): Seconds to reuse results of the API's GET endpoints for, shared by all agents in the process, overriding the API's own caching headers. Defaults to None (follow the API's caching headers).
+            result_compactor (Union[ResultCompactor, Dict[str, ResultCompactor], None], optional): Compacts the API's results before they are added to the history (field projection, row limits and a token budget); either one for all endpoints, or a dictionary of them by endpoint name. Defaults to None (the agent's result_compactor).
+            endpoint_policy (EndpointPolicy, optional): The timeouts and retries of calls to the API, and when to stop calling it while it keeps failing. Defaults to None (the default EndpointPolicy).
         """
-        self.api_set.add_api(name, spec_url, base_url, callable_endpoints)
+        self.api_set.add_api(name, spec_url, base_url, callable_endpoints, cache_ttl = cache_ttl, endpoint_policy = endpoint_policy)
+        if isinstance(result_compactor, ResultCompactor):
+            self.result_compactors[name] = result_compactor
+        elif result_compactor is not None:
+            for endpoint, compactor in result_compactor.items():
+                self.result_compactors[name + "-" + endpoint] = compactor
+        self.function_registry.set_api_schemas(self.api_set.get_function_schemas())
+        self.function_schema_tokens = None
+
+
+    def api_health(self) -> List[Dict[str, Any]]:
+        """Returns the health of the agent's registered APIs: whether calls to each are being made ("closed"), failed
+        fast after repeated failures ("open"), or being tried again ("half-open"), with counts of failures and the last error.
+
+        Returns:
+            List[Dict[str, Any]]: One entry per API."""
+        return self.api_set.health()
 
 
     def register_callable_functions(self, functions: Dict[str, Callable]) -> None:
-        """Registers methods with the agent. The agent will be able to call these methods.
+        """Registers methods with the agent. The agent will be able to call these methods. Each method's schema is
+        compiled from its signature and docstring once, here.
         
         Args:
-            method_names (List[str]): A list of method names that the agent can call."""
+            functions (Dict[str, Callable]): A dictionary mapping names to the methods or functions that the agent can call."""
         for func_name in functions.keys():
             func = functions[func_name]
-            self.callable_functions[func_name] = func
+            self.function_registry.register_callable(func_name, func)
+        self.function_schema_tokens = None
 
 
 
-    def chat(self, user_message: str, yield_system_message = False, yield_prompt_message = False, author = "User") -> Generator[Message, None, None]:
+    def chat(self, user_message: str, yield_system_message = False, yield_prompt_message = False, author = "User", stream = False) -> Generator[Message, None, None]:
         """Starts a new chat or continues an existing chat. If starting a new chat, you can ask to have the system message yielded to the stream first.
         
         Args:
@@ -112,74 +199,135 @@ class UtilityAgent:
             yield_system_message (bool, optional): If true, yield the system message in the output stream as well. Defaults to False. Only applicable with a new or recently cleared chat.
             yield_prompt_message (bool, optional): If true, yield the user's message in the output stream as well. Defaults to False.
             author (str, optional): The name of the user. Defaults to "User".
+            stream (bool, optional): If true, stream the model's replies, yielding delta messages (with is_delta set) carrying each new piece of text as it arrives, ahead of the complete message. Only complete messages are added to the history. Defaults to False.
             
         Yields:
             One or more messages from the agent."""
         
-        if self.history is None:
-            self.history = Chat(messages = [Message(role = "system", content = self.system_message, author = "System", intended_recipient = self.name)])
+        messages, user_message = self._begin_turn(user_message, yield_system_message, yield_prompt_message, author)
+        yield from messages
+        if user_message is None:
+            return
 
-            if yield_system_message:
-                yield self.history.messages[0]
+        completion = None
+        if self.check_toxicity:
+            if self.optimistic_moderation and self._summary_needed() is None:
+                # request the completion while the message is moderated; it is only used (and cached) if the message passes
+                request = self._completion_request()
+                completion = _background_executor.submit(self._create_completion, stream = stream, request = request, cache_response = False)
 
-        user_message = Message(role = "user", content = user_message, author = author, intended_recipient = self.name)
+            try:
+                toxicity = self.moderation_batcher.moderate(user_message.content)
+            except Exception as e:
+                self._discard_turn(user_message, completion)
+                yield Message(role = "assistant", content = f"Error in toxicity check: {str(e)}", author = "System", intended_recipient = author)
+                return
+            flagged_message = self._flagged_message(toxicity, author)
+            if flagged_message is not None:
+                self._discard_turn(user_message, completion)
+                yield flagged_message
+                return
 
-        if yield_prompt_message:
-            yield user_message
+        yield from self._summarize_if_necessary()
+
+        try:
+            if completion is not None:
+                response_raw = completion.result()
+                self._cache_response(request, response_raw)
+            else:
+                response_raw = self._create_completion(stream = stream)
+
+            for message in self._process_model_response(response_raw, intended_recipient = author, stream = stream):
+                yield message
+                if message.is_delta:
+                    continue
+                self._append_to_history(message)
+                yield from self._summarize_if_necessary()
+        except Exception as e:
+            yield Message(role = "assistant", content = f"Error in message processing: {str(e)}. Full Traceback: {traceback.format_exc()}", author = "System", intended_recipient = author)
 
-        self.token_bucket.refill()
-        needed_tokens = self.compute_token_cost(user_message.content)
-        sufficient_budget = self.token_bucket.consume(needed_tokens)
-        if not sufficient_budget:
-            yield Message(role = "assistant", content = f"Sorry, I'm out of tokens. Please try again later.", author = "System", intended_recipient = author)
-            return
 
-        self.history.messages.append(user_message)
+    async def achat(self, user_message: str, yield_system_message = False, yield_prompt_message = False, author = "User", stream = False) -> AsyncGenerator[Message, None]:
+        """The asyncio counterpart of chat, yielding the same stream of messages. Model, moderation and API endpoint calls are made
+        with async HTTP clients, and async callable functions are awaited (sync ones run in a worker thread), so a single event loop
+        can drive many concurrent conversations.
         
+        Args:
+            user_message (str): The user's first message.
+            yield_system_message (bool, optional): If true, yield the system message in the output stream as well. Defaults to False. Only applicable with a new or recently cleared chat.
+            yield_prompt_message (bool, optional): If true, yield the user's message in the output stream as well. Defaults to False.
+            author (str, optional): The name of the user. Defaults to "User".
+            stream (bool, optional): If true, stream the model's replies, yielding delta messages (with is_delta set) carrying each new piece of text as it arrives, ahead of the complete message. Only complete messages are added to the history. Defaults to False.
+            
+        Yields:
+            One or more messages from the agent."""
+
+        messages, user_message = self._begin_turn(user_message, yield_system_message, yield_prompt_message, author)
+        for message in messages:
+            yield message
+        if user_message is None:
+            return
+
+        completion = None
         if self.check_toxicity:
+            if self.optimistic_moderation and self._summary_needed() is None:
+                request = self._completion_request()
+                completion = asyncio.ensure_future(self._acreate_completion(stream = stream, request = request, cache_response = False))
+
             try:
-                toxicity = openai.Moderation.create(input = user_message.content)
-                if toxicity['results'][0]['flagged']:
-                    yield Message(role = "assistant", content = f"I'm sorry, your message appears to contain inappropriate content. Please keep it civil.", author = "System", intended_recipient = author)
-                    return
+                toxicity = await self.moderation_batcher.amoderate(user_message.content)
             except Exception as e:
+                self._adiscard_turn(user_message, completion)
                 yield Message(role = "assistant", content = f"Error in toxicity check: {str(e)}", author = "System", intended_recipient = author)
                 return
+            flagged_message = self._flagged_message(toxicity, author)
+            if flagged_message is not None:
+                self._adiscard_turn(user_message, completion)
+                yield flagged_message
+                return
 
-        yield from self._summarize_if_necessary()
+        async for message in self._asummarize_if_necessary():
+            yield message
 
         try:
-            response_raw = openai.ChatCompletion.create(
-                      model=self.model,
-                      temperature = 0,
-                      messages = self._reserialize_history(),
-                      functions = self.api_set.get_function_schemas() + self._get_method_schemas(),
-                      function_call = "auto")
-
-            for message in self._process_model_response(response_raw, intended_recipient = author):
+            if completion is not None:
+                response_raw = await completion
+                self._cache_response(request, response_raw)
+            else:
+                response_raw = await self._acreate_completion(stream = stream)
+
+            async for message in self._aprocess_model_response(response_raw, intended_recipient = author, stream = stream):
                 yield message
-                self.history.messages.append(message)
-                yield from self._summarize_if_necessary()
+                if message.is_delta:
+                    continue
+                self._append_to_history(message)
+                async for summary_message in self._asummarize_if_necessary():
+                    yield summary_message
         except Exception as e:
             yield Message(role = "assistant", content = f"Error in message processing: {str(e)}. Full Traceback: {traceback.format_exc()}", author = "System", intended_recipient = author)
 
 
     def clear_history(self):
         """Clears the agent's history as though it were a new agent, but leaves the token bucket, model, and other information alone."""
-        self.history = None
+        with self._summary_lock:
+            self.history = None
+            self._background_summary = None
 
 
-    def compute_token_cost(self, proposed_message: str) -> int:
+    def compute_token_cost(self, proposed_message: Union[str, Message]) -> int:
         """Computes the total token count of the current history plus, plus function definitions, plus the proposed message. Can thus act
         as a proxy for the cost of the proposed message at the current point in the conversation, and to determine whether a conversation
-        summary is necessary.
+        summary is necessary. The history and function definition counts are cached, so only the proposed message is tokenized.
         
         Args:
-            proposed_message (str): The proposed message.
+            proposed_message (Union[str, Message]): The proposed message, either as a string (treated as a user message) or a Message.
             
         Returns:
             int: The total token count of the current history plus, plus function definitions, plus the proposed message."""
-        cost = self._count_history_tokens() + self._count_function_schema_tokens() + _num_tokens_from_messages([{"role": "user", "content": proposed_message}])
+        if isinstance(proposed_message, str):
+            proposed_message = Message(role = "user", content = proposed_message)
+
+        cost = self._count_history_tokens() + self._count_function_schema_tokens() + self._count_message_tokens(proposed_message)
         return cost
     
 
@@ -206,18 +354,179 @@ class UtilityAgent:
         return formatted_now
 
 
+
+    def _begin_turn(self, user_message: str, yield_system_message: bool, yield_prompt_message: bool, author: str) -> Tuple[List[Message], Optional[Message]]:
+        """Starts a turn of chat or achat: starts the history if needed, checks the token budget and appends the user's message.
+
+        Args:
+            user_message (str): The user's message.
+            yield_system_message (bool): Whether to yield the system message of a new chat.
+            yield_prompt_message (bool): Whether to yield the user's message.
+            author (str): The name of the user.
+
+        Returns:
+            The messages to yield, and the user's message as appended to the history (None if the turn should end here)."""
+        messages = []
+        if self.history is not None:
+            self._apply_background_summary()
+        else:
+            self.history = Chat()
+            self._append_to_history(Message(role = "system", content = self.system_message, author = "System", intended_recipient = self.name))
+
+            if yield_system_message:
+                messages.append(self.history.messages[0])
+
+        user_message = Message(role = "user", content = user_message, author = author, intended_recipient = self.name)
+
+        if yield_prompt_message:
+            messages.append(user_message)
+
+        out_of_tokens = self._check_token_budget(user_message, author)
+        if out_of_tokens is not None:
+            messages.append(out_of_tokens)
+            return messages, None
+
+        self._append_to_history(user_message)
+        return messages, user_message
+
+
+    def _check_token_budget(self, message: Message, intended_recipient: str) -> Optional[Message]:
+        """Consumes the cost of sending a message at this point in the conversation from the token bucket.
+
+        Args:
+            message (Message): The message about to be sent.
+            intended_recipient (str): Who to address the out-of-tokens message to.
+
+        Returns:
+            An out-of-tokens message if the budget is insufficient, otherwise None."""
+        # consuming refills the bucket first
+        needed_tokens = self.compute_token_cost(message)
+        sufficient_budget = self.token_bucket.consume(needed_tokens)
+        if not sufficient_budget:
+            return Message(role = "assistant", content = f"Sorry, I'm out of tokens. Please try again later.", author = "System", intended_recipient = intended_recipient)
+        return None
+
+
+    def _flagged_message(self, toxicity: Dict[str, Any], author: str) -> Optional[Message]:
+        """Returns the message to end the turn with if a moderation verdict is flagged, otherwise None."""
+        if toxicity['flagged']:
+            return Message(role = "assistant", content = f"I'm sorry, your message appears to contain inappropriate content. Please keep it civil.", author = "System", intended_recipient = author)
+        return None
+
+
+    def _discard_turn(self, user_message: Message, completion: Optional[concurrent.futures.Future] = None) -> None:
+        """Ends a turn that failed moderation: removes the user's message from the history, so it isn't sent to the model
+        in later turns, and discards the completion requested for it, if any.
+
+        Args:
+            user_message (Message): The user's message.
+            completion (Optional[concurrent.futures.Future], optional): The optimistically requested completion. Defaults to None."""
+        self.history.reset([message for message in self.history.messages if message is not user_message])
+        if completion is not None and not completion.cancel():
+            completion.add_done_callback(_close_discarded_completion)
+
+
+    def _adiscard_turn(self, user_message: Message, completion: Optional[asyncio.Future] = None) -> None:
+        """The asyncio counterpart of _discard_turn."""
+        self.history.reset([message for message in self.history.messages if message is not user_message])
+        if completion is not None:
+            completion.cancel()
+            completion.add_done_callback(_aclose_discarded_completion)
+
+
+    def _completion_request(self) -> Dict[str, Any]:
+        """Returns the arguments of a ChatCompletion request for the current history and registered functions."""
+        if self.parallel_tool_calls:
+            return {"model": self.model,
+                    "temperature": 0,
+                    "messages": self._reserialize_history(),
+                    "tools": self.function_registry.tools,
+                    "tool_choice": "auto"}
+
+        return {"model": self.model,
+                "temperature": 0,
+                "messages": self._reserialize_history(),
+                "functions": self.function_registry.schemas,
+                "function_call": "auto"}
+
+
+    def _create_completion(self, stream: bool = False, request: Optional[Dict[str, Any]] = None, cache_response: bool = True) -> Union[Dict[str, Any], Iterator[Dict[str, Any]]]:
+        """Requests a completion of the current history (or the given request) from the model, or answers it from the completion
+        cache; if streaming, the response is an iterator of chunks, cached once it has been read in full. A response that may
+        yet be discarded is requested with cache_response false, and cached with _cache_response if it is used."""
+        request = request if request is not None else self._completion_request()
+        cacheable = self.completion_cache is not None and request["temperature"] == 0
+        if cacheable:
+            response = self.completion_cache.get(request)
+            if response is not None:
+                return replay_chunks(response) if stream else response
+
+        estimated_tokens = self._count_history_tokens() + self._count_function_schema_tokens()
+        if stream:
+            chunks = self.request_scheduler.call(openai.ChatCompletion.create, **request, stream = True, estimated_tokens = estimated_tokens, session = self._scheduler_session)
+            return self._cache_chunks(request, chunks) if cacheable else chunks
+
+        response = self.request_scheduler.call(openai.ChatCompletion.create, **request, estimated_tokens = estimated_tokens, session = self._scheduler_session)
+        if cacheable and cache_response:
+            self.completion_cache.set(request, response)
+        return response
+
+
+    async def _acreate_completion(self, stream: bool = False, request: Optional[Dict[str, Any]] = None, cache_response: bool = True) -> Union[Dict[str, Any], AsyncIterator[Dict[str, Any]]]:
+        """The asyncio counterpart of _create_completion; if streaming, the response is an async iterator of chunks."""
+        request = request if request is not None else self._completion_request()
+        cacheable = self.completion_cache is not None and request["temperature"] == 0
+        if cacheable:
+            response = self.completion_cache.get(request)
+            if response is not None:
+                return areplay_chunks(response) if stream else response
+
+        estimated_tokens = self._count_history_tokens() + self._count_function_schema_tokens()
+        if stream:
+            chunks = await self.request_scheduler.acall(openai.ChatCompletion.acreate, **request, stream = True, estimated_tokens = estimated_tokens, session = self._scheduler_session)
+            return self._acache_chunks(request, chunks) if cacheable else chunks
+
+        response = await self.request_scheduler.acall(openai.ChatCompletion.acreate, **request, estimated_tokens = estimated_tokens, session = self._scheduler_session)
+        if cacheable and cache_response:
+            self.completion_cache.set(request, response)
+        return response
+
+
+    def _cache_response(self, request: Dict[str, Any], response: Union[Dict[str, Any], Iterator[Dict[str, Any]], AsyncIterator[Dict[str, Any]]]) -> None:
+        """Caches a response requested with cache_response false, once it is used. Streamed responses cache themselves
+        as they are read, so a discarded stream, closed unread, is never cached."""
+        if self.completion_cache is not None and request["temperature"] == 0 and isinstance(response, dict):
+            self.completion_cache.set(request, response)
+
+
+    def _cache_chunks(self, request: Dict[str, Any], chunks: Iterator[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """Passes through the chunks of a streamed response, caching the assembled response once the stream is complete."""
+        assembler = _StreamAssembler()
+        for chunk in chunks:
+            assembler.add(chunk)
+            yield chunk
+        self.completion_cache.set(request, assembler.response())
+
+
+    async def _acache_chunks(self, request: Dict[str, Any], chunks: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+        """The asyncio counterpart of _cache_chunks."""
+        assembler = _StreamAssembler()
+        async for chunk in chunks:
+            assembler.add(chunk)
+            yield chunk
+        self.completion_cache.set(request, assembler.response())
+
+
     def _get_method_schemas(self) -> List[Dict[str, Any]]:
         """Gets the schemas for the agent's callable methods.
         
         Returns:
             A list of schemas for the agent's callable methods."""
-        # methods = inspect.getmembers(self, predicate=inspect.ismethod)
-        # return [_generate_schema(m[1]) for m in methods if m[0] in self.callable_functions]
-
-        return [_generate_schema(self.callable_functions[m]) for m in self.callable_functions.keys()]
+        return list(self.function_registry.method_schemas)
 
     def _call_function(self, func_name: str, params: dict) -> Generator[Message, None, None]:
-        """Calls one of the agent's callable methods.
+        """Calls one of the agent's callable methods. Async methods are run on a dedicated event loop thread (see
+        _run_coroutine), so they can be called whether or not the calling thread is running an event loop.
         
         Args:
             method_name (str): The name of the method to call.
@@ -230,30 +539,127 @@ class UtilityAgent:
             result = func(**params)
             if inspect.isgenerator(result):
                 yield from result
+            elif inspect.isasyncgen(result):
+                while True:
+                    try:
+                        yield _run_coroutine(_await(result.__anext__()))
+                    except StopAsyncIteration:
+                        break
+            elif inspect.isawaitable(result):
+                yield _run_coroutine(_await(result))
             else:
                 yield result
         else:
             raise ValueError(f"No such function: {func_name}")
 
 
+    async def _acall_function(self, func_name: str, params: dict) -> AsyncGenerator[Message, None]:
+        """Calls one of the agent's callable methods from an event loop. Async methods are awaited, and sync methods
+        (and each step of sync generators) are run in a worker thread so they don't block the loop.
+        
+        Args:
+            func_name (str): The name of the method to call.
+            params (dict): The parameters to pass to the method.
+            
+        Yields:
+            One or more messages containing the result of the method call."""
+        func = self.callable_functions.get(func_name, None)
+        if func is None or not callable(func):
+            raise ValueError(f"No such function: {func_name}")
+
+        if inspect.isasyncgenfunction(func):
+            async for result in func(**params):
+                yield result
+            return
+
+        if inspect.iscoroutinefunction(func):
+            result = await func(**params)
+        else:
+            result = await asyncio.to_thread(func, **params)
+
+        if inspect.isgenerator(result):
+            done = object()
+            while True:
+                item = await asyncio.to_thread(next, result, done)
+                if item is done:
+                    break
+                yield item
+        elif inspect.isasyncgen(result):
+            async for item in result:
+                yield item
+        elif inspect.isawaitable(result):
+            yield await result
+        else:
+            yield result
+
+
     def _count_history_tokens(self) -> int:
         """
-        Uses the tiktoken library to count the number of tokens stored in self.history.
+        Returns the number of tokens stored in self.history, from the running total kept by the history as messages are appended.
 
         Returns: 
             The number of tokens in self.history.
         """
-        history_tokens = _num_tokens_from_messages(self._reserialize_history(), model = self.model)
-        return history_tokens
+        if self.history is None:
+            return tokenizer.REPLY_PRIMING_TOKENS
+
+        # the per-message counts exclude the reply priming tokens added once per request
+        return self.history.num_tokens + tokenizer.REPLY_PRIMING_TOKENS
+
+
+    def _count_message_tokens(self, message: Message) -> int:
+        """
+        Returns the number of tokens used by a single message, computing it with tiktoken the first time and caching it on the message.
+
+        Args:
+            message (Message): The message to count the tokens of.
+
+        Returns:
+            The number of tokens used by the message.
+        """
+        if message._num_tokens is None:
+            message._num_tokens = tokenizer.count_message(self._reserialize_message(message), model = self.model)
+        return message._num_tokens
+
+
+    def _count_messages_tokens(self, messages: List[Message]) -> int:
+        """
+        Returns the total number of tokens used by a list of messages, counting any not-yet-counted messages
+        in a single batched tokenizer call and caching the counts on them.
+
+        Args:
+            messages (List[Message]): The messages to count the tokens of.
+
+        Returns:
+            The total number of tokens used by the messages.
+        """
+        uncounted = [message for message in messages if message._num_tokens is None]
+        if len(uncounted) > 0:
+            counts = tokenizer.count_many([self._reserialize_message(message) for message in uncounted], model = self.model)
+            for message, count in zip(uncounted, counts):
+                message._num_tokens = count
+        return sum([message._num_tokens for message in messages])
+
+
+    def _append_to_history(self, message: Message) -> None:
+        """
+        Appends a message to self.history, counting its tokens once so the history's running total stays current.
+
+        Args:
+            message (Message): The message to append.
+        """
+        self._count_message_tokens(message)
+        self.history.append(message)
 
 
-    def _count_function_schema_tokens(self, force_update: bool = True) -> int:
+    def _count_function_schema_tokens(self, force_update: bool = False) -> int:
         """
         Counts tokens used by current function definition set, which counts against the conversation token limit. 
-        Makes a couple of API calls to OpenAI to do so, and the result is cached unless force_update is True.
+        The count is estimated locally with tiktoken (see tokenizer.count_functions), and cached until the set of registered
+        APIs or callable functions changes, or force_update is True.
 
         Args:
-            force_update (bool): If true, recompute the function schemas. Otherwise, use the cached count.
+            force_update (bool): If true, recompute the function schema token count. Otherwise, use the cached count.
 
         Returns:
             The number of tokens in the function schemas.
@@ -262,23 +668,17 @@ class UtilityAgent:
         if self.function_schema_tokens is not None and not force_update:
             return self.function_schema_tokens
 
-        response_raw_w_functions = openai.ChatCompletion.create(
-                  model=self.model,
-                  temperature = 0,
-                  messages = [{'role': 'system', 'content': 'You are a helpful assistant.'}, {'role': 'user', 'content': 'hi'}],
-                  functions = self.api_set.get_function_schemas() + self._get_method_schemas(),
-                  function_call = "auto")
-       
-        response_raw_no_functions = openai.ChatCompletion.create(
-                  model=self.model,
-                  temperature = 0,
-                  messages = [{'role': 'system', 'content': 'You are a helpful assistant.'}, {'role': 'user', 'content': 'hi'}])
+        cache_key = (self.model, self.function_registry.fingerprint, self.system_message)
 
-        diff = response_raw_w_functions['usage']['prompt_tokens'] - response_raw_no_functions['usage']['prompt_tokens']
-
-        self.function_schema_tokens = diff + 2 # I dunno why 2, a simple difference is just 2 off. start/end tokens possibly?
-        return diff
+        if cache_key not in _FUNCTION_SCHEMA_TOKENS:
+            # the provider folds the function definitions into the system message, so what they cost is what they add to a
+            # prompt starting with it (as agents' histories always do), rather than what they would cost counted separately
+            prompt = [{"role": "system", "content": self.system_message}]
+            schemas = list(self.function_registry.schemas)
+            _FUNCTION_SCHEMA_TOKENS[cache_key] = tokenizer.count_prompt(prompt, schemas, model = self.model) - tokenizer.count_prompt(prompt, [], model = self.model)
 
+        self.function_schema_tokens = _FUNCTION_SCHEMA_TOKENS[cache_key]
+        return self.function_schema_tokens
 
 
 
@@ -295,269 +695,719 @@ class UtilityAgent:
         
         Yields:
             One or more messages from the agent."""
-        if self.auto_summarize is not None and len(self.history.messages) > 1 and self.history.messages[-1].role != "assistant" and not self.history.messages[-1].is_function_call:
-            
-            new_user_message = self.history.messages[-1]
-            author = new_user_message.author
+        num_tokens = self._summary_needed()
+        if num_tokens is None:
+            self._start_background_summary()
+            return
+
+        # a summary of older turns prepared in the background may be enough, and is at least partly done
+        if self._background_summary is not None:
+            self._background_summary[0].exception() # waits for it
+            if self._apply_background_summary():
+                num_tokens = self._summary_needed()
+                if num_tokens is None:
+                    return
+
+        if not self.summarize_quietly:
+            yield self._summary_start_message(num_tokens)
+
+        summary_str = self._summarize(self.history.messages).content
+        summary_message = self._apply_summary(summary_str)
+
+        if not self.summarize_quietly:
+            yield summary_message
+
+
+    async def _asummarize_if_necessary(self) -> AsyncGenerator[Message, None]:
+        """The asyncio counterpart of _summarize_if_necessary, summarizing with achat.
+        
+        Yields:
+            One or more messages from the agent."""
+        num_tokens = self._summary_needed()
+        if num_tokens is None:
+            self._start_background_summary()
+            return
+
+        if self._background_summary is not None:
+            await asyncio.wait([asyncio.wrap_future(self._background_summary[0])])
+            if self._apply_background_summary():
+                num_tokens = self._summary_needed()
+                if num_tokens is None:
+                    return
+
+        if not self.summarize_quietly:
+            yield self._summary_start_message(num_tokens)
+
+        summary_str = (await self._asummarize(self.history.messages)).content
+        summary_message = self._apply_summary(summary_str)
+
+        if not self.summarize_quietly:
+            yield summary_message
+
+
+    def _summary_needed(self) -> Optional[int]:
+        """Returns the current number of tokens in the conversation if it needs summarizing, otherwise None."""
+        if self.auto_summarize is not None and len(self.history.messages) > 1 and self.history.messages[-1].role != "assistant" and not self.history.messages[-1].is_function_call and not self._tool_calls_pending():
+            num_tokens = self._count_history_tokens() + self._count_function_schema_tokens()
+            if num_tokens > _context_size(self.model) - self.auto_summarize:
+                return num_tokens
+        return None
+
+
+    def _tool_calls_pending(self) -> bool:
+        """Returns whether the history ends part-way through the results of a set of parallel tool calls."""
+        num_results = 0
+        num_calls = 0
+        for message in reversed(self.history.messages):
+            if message.tool_call_id is None:
+                break
+            elif message.is_function_call:
+                num_calls += 1
+            elif num_calls == 0:
+                num_results += 1
+            else:
+                break
+        return num_results < num_calls
+
+
+    def _summary_start_message(self, num_tokens: int) -> Message:
+        """Returns the message announcing that the conversation is about to be summarized."""
+        context_size = _context_size(self.model)
+        return Message(role = "assistant", content = f"I'm sorry, this conversation is getting too long for me to remember fully. My context size is only {context_size} tokens, but our conversation is currently {num_tokens} (and I've been instructed to leave a buffer of {self.auto_summarize}). I'll be continuing from the following summary:", author = self.name, intended_recipient = self.history.messages[-1].author)
+
+
+    def _summary_agent(self, messages: List[Message]) -> "UtilityAgent":
+        """Returns an agent holding a copy of the given messages, to be asked for a summary."""
+        # the summarization prompt is our own, and the conversation's messages were moderated as they came in
+        summary_agent = UtilityAgent(name = "Summarizer", model = self.model, auto_summarize_buffer_tokens = None, parallel_tool_calls = self.parallel_tool_calls, check_toxicity = False, completion_cache = self.completion_cache, request_scheduler = self.request_scheduler)
+        summary_agent._scheduler_session = self._scheduler_session
+        summary_agent._count_messages_tokens(messages) # no-op for messages already counted by this agent
+        summary_agent.history = Chat(messages = [message for message in messages]) # copy the messages (and their cached token counts)
+        return summary_agent
+
+
+    def _summarize(self, messages: List[Message]) -> Message:
+        """Asks a summarizer agent for a summary of a conversation. A conversation too long for one summarization request
+        is summarized in parts of at most summary_chunk_tokens, concurrently, and the summaries of the parts are then
+        summarized together (in parts again, if need be). If a round of part summaries doesn't reduce the number of parts,
+        the summaries are instead truncated to fit one request, so summarization always ends.
+
+        Args:
+            messages (List[Message]): The conversation, starting with the system message.
+
+        Returns:
+            The summarizer's reply (from "System" if summarization failed)."""
+        num_chunks = None
+        while True:
+            chunks = self._summary_chunks(messages)
+            if chunks is None:
+                return list(self._summary_agent(messages).chat(_SUMMARY_PROMPT))[0]
+            if num_chunks is not None and len(chunks) >= num_chunks:
+                return list(self._summary_agent(self._truncated_for_summary(messages)).chat(_SUMMARY_PROMPT))[0]
+            num_chunks = len(chunks)
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers = self.max_parallel_summaries) as executor:
+                part_summaries = list(executor.map(lambda chunk: list(self._summary_agent([messages[0], chunk]).chat(_PART_SUMMARY_PROMPT))[0], chunks))
+
+            failures = [summary for summary in part_summaries if summary.author == "System"]
+            if len(failures) > 0:
+                return failures[0]
+            messages = [messages[0]] + self._part_summary_messages(part_summaries)
+
+
+    async def _asummarize(self, messages: List[Message]) -> Message:
+        """The asyncio counterpart of _summarize."""
+        semaphore = asyncio.Semaphore(self.max_parallel_summaries)
+
+        async def summarize_part(system_message, chunk):
+            async with semaphore:
+                return [message async for message in self._summary_agent([system_message, chunk]).achat(_PART_SUMMARY_PROMPT)][0]
+
+        num_chunks = None
+        while True:
+            chunks = self._summary_chunks(messages)
+            if chunks is None:
+                return [message async for message in self._summary_agent(messages).achat(_SUMMARY_PROMPT)][0]
+            if num_chunks is not None and len(chunks) >= num_chunks:
+                return [message async for message in self._summary_agent(self._truncated_for_summary(messages)).achat(_SUMMARY_PROMPT)][0]
+            num_chunks = len(chunks)
+
+            part_summaries = await asyncio.gather(*[summarize_part(messages[0], chunk) for chunk in chunks])
+
+            failures = [summary for summary in part_summaries if summary.author == "System"]
+            if len(failures) > 0:
+                return failures[0]
+            messages = [messages[0]] + self._part_summary_messages(part_summaries)
+
+
+    def _summary_chunks(self, messages: List[Message]) -> Optional[List[Message]]:
+        """Splits a conversation too long for one summarization request into parts, each rendered as a transcript in a
+        single user message of at most summary_chunk_tokens (a single oversized message is truncated to fit). Rendering
+        the parts as text lets them be split anywhere, even between a tool call and its result.
+
+        Args:
+            messages (List[Message]): The conversation, starting with the system message.
+
+        Returns:
+            The parts, or None if the conversation fits in one request."""
+        budget = self._summary_budget()
+        if self._count_messages_tokens(messages) <= budget:
+            return None
+
+        # the part's user message and its line separators are counted with a little slack
+        line_budget = budget - self._count_messages_tokens(messages[:1]) - 16
+        lines = [_transcript_line(message) for message in messages[1:]]
+        counts = tokenizer.count_many(lines, model = self.model)
+
+        chunks = []
+        current = []
+        current_tokens = 0
+        for line, count in zip(lines, counts):
+            if count > line_budget:
+                line = tokenizer.truncate(line, line_budget - 8, model = self.model) + " [truncated]"
+                count = line_budget
+            if current_tokens + count + 1 > line_budget and len(current) > 0:
+                chunks.append(current)
+                current = []
+                current_tokens = 0
+            current.append(line)
+            current_tokens += count + 1
+        chunks.append(current)
 
-            num_tokens = _num_tokens_from_messages(self._reserialize_history(), model = self.model) + self._count_function_schema_tokens()
-            context_size = _context_size(self.model)
-            if num_tokens > context_size - self.auto_summarize:
-                if not self.summarize_quietly:
-                    yield Message(role = "assistant", content = f"I'm sorry, this conversation is getting too long for me to remember fully. My context size is only {context_size} tokens, but our conversation is currently {num_tokens} (and I've been instructed to leave a buffer of {self.auto_summarize}). I'll be continuing from the following summary:", author = self.name, intended_recipient = author)
+        return [Message(role = "user", content = "Here is part of our conversation:\n\n" + "\n".join(chunk), author = "System", intended_recipient = "Summarizer") for chunk in chunks]
 
-                summary_agent = UtilityAgent(name = "Summarizer", model = self.model, auto_summarize_buffer_tokens = None)
-                summary_agent.history = Chat(messages = []) # generate an empty history to copy the messages into
-                summary_agent.history.messages = [message for message in self.history.messages]
-                summary_str = list(summary_agent.chat("Please summarize our conversation so far. The goal is to be able to continue our conversation from the summary only. Do not editorialize or ask any questions."))[0].content
 
-                self.history.messages = [self.history.messages[0]] # reset with the system prompt
-                # modify the last message to include the summary 
-                new_user_message.content = "Here is a summary of our conversation thus far:\n\n" + summary_str + "\n\nNow, please respond to the following as if we were continuing the conversation naturally:\n\n" + new_user_message.content
-                # we have to add it back to the now reset history
-                self.history.messages.append(new_user_message)
+    def _summary_budget(self) -> int:
+        """Returns the most tokens the conversation may take up in one summarization request."""
+        return self.summary_chunk_tokens if self.summary_chunk_tokens is not None else _context_size(self.model) - _SUMMARY_RESERVE_TOKENS
 
-                if not self.summarize_quietly:
-                    yield Message(role = "assistant", content = "Previous conversation summary: " + summary_str + "\n\nThanks for your patience. If I've missed anything important, please mention it before we continue.", author = self.name, intended_recipient = author)
 
+    def _truncated_for_summary(self, messages: List[Message]) -> List[Message]:
+        """Truncates the messages after the system message to equal shares of one summarization request, for when
+        summarizing them in parts doesn't make them any shorter.
+
+        Args:
+            messages (List[Message]): The conversation, starting with the system message.
+
+        Returns:
+            The truncated conversation."""
+        # each message is counted with a little slack for its overhead and the truncation marker
+        share = max((self._summary_budget() - self._count_messages_tokens(messages[:1])) // max(len(messages) - 1, 1) - 16, 1)
+        truncated = messages[:1]
+        for message in messages[1:]:
+            content = tokenizer.truncate(message.content or "", share, model = self.model)
+            if content != message.content:
+                content += " [truncated]"
+            truncated.append(Message(role = message.role, content = content, author = message.author, intended_recipient = message.intended_recipient))
+        return truncated
+
+
+    def _part_summary_messages(self, part_summaries: List[Message]) -> List[Message]:
+        """Returns the summaries of consecutive parts of a conversation as messages, to be summarized together."""
+        num_parts = len(part_summaries)
+        return [Message(role = "user", content = f"Summary of part {index + 1} of {num_parts} of our conversation: {summary.content}", author = "System", intended_recipient = "Summarizer")
+                for index, summary in enumerate(part_summaries)]
+
+
+    def _start_background_summary(self) -> None:
+        """Starts summarizing the turns before the latest one in a background worker, if the conversation has crossed the
+        soft watermark set by background_summarize_buffer_tokens and no summary is already in progress."""
+        if self.background_summarize is None or self._background_summary is not None or self.history is None:
+            return
+        if self._count_history_tokens() + self._count_function_schema_tokens() <= _context_size(self.model) - self.background_summarize:
+            return
+
+        # the summary replaces everything between the system message and the latest user message, so the turns kept
+        # (including any tool calls and their results) stay complete
+        cut = self._latest_user_message_index()
+        if cut is None or cut < 2:
+            return
+
+        summarized = self.history.messages[1:cut]
+        with self._summary_lock:
+            future = _background_executor.submit(self._summarize_in_background, [self.history.messages[0]] + summarized)
+            self._background_summary = (future, summarized)
+
+
+    def _summarize_in_background(self, messages: List[Message]) -> str:
+        summary = self._summarize(messages)
+        if summary.author == "System":
+            raise RuntimeError(summary.content)
+        return summary.content
+
+
+    def _apply_background_summary(self) -> bool:
+        """Swaps a completed background summary into the history, replacing the turns it summarized, provided those are
+        still at the start of the history. A summary still in progress is left to finish.
+
+        Returns:
+            Whether the history was changed."""
+        with self._summary_lock:
+            if self._background_summary is None or not self._background_summary[0].done():
+                return False
+            future, summarized = self._background_summary
+            self._background_summary = None
+            if future.exception() is not None:
+                return False
+
+            messages = self.history.messages
+            kept = messages[len(summarized) + 1:]
+            if len(kept) == 0 or any([a is not b for a, b in zip(messages[1:len(summarized) + 1], summarized)]) or kept[0].role != "user":
+                return False # the history has moved on (e.g. it was summarized or cleared in the meantime)
+
+            # the first kept user message carries the summary, as with a full summary
+            continues = kept[0].model_copy(update = {"content": "Here is a summary of our conversation thus far:\n\n" + future.result() + "\n\nNow, please continue the conversation naturally from the following:\n\n" + kept[0].content})
+            continues._num_tokens = None
+            self._count_message_tokens(continues)
+            self.history.reset([messages[0], continues] + kept[1:])
+            return True
+
+
+    def _latest_user_message_index(self) -> Optional[int]:
+        """Returns the index in the history of the latest message from the user, if any."""
+        for index in range(len(self.history.messages) - 1, 0, -1):
+            if self.history.messages[index].role == "user":
+                return index
+        return None
+
+
+    def _apply_summary(self, summary_str: str) -> Message:
+        """Resets the history to the system prompt followed by the last message, rewritten to include the summary.
+
+        Args:
+            summary_str (str): The summary of the conversation.
+
+        Returns:
+            The message presenting the summary."""
+        new_user_message = self.history.messages[-1]
+
+        self.history.reset([self.history.messages[0]]) # reset with the system prompt
+        # rewrite (a copy of, as the original may be shared, e.g. by a UI's transcript) the last message to include the summary
+        update = {"content": "Here is a summary of our conversation thus far:\n\n" + summary_str + "\n\nNow, please respond to the following as if we were continuing the conversation naturally:\n\n" + new_user_message.content}
+        if new_user_message.tool_call_id is not None:
+            # the tool calls it answered have been summarized away, so it continues the conversation as a user message
+            update.update({"role": "user", "func_name": None, "tool_call_id": None})
+        new_user_message = new_user_message.model_copy(update = update)
+        new_user_message._num_tokens = None # the cached token count no longer applies
+        # we have to add it back to the now reset history
+        self._append_to_history(new_user_message)
+
+        return Message(role = "assistant", content = "Previous conversation summary: " + summary_str + "\n\nThanks for your patience. If I've missed anything important, please mention it before we continue.", author = self.name, intended_recipient = new_user_message.author)
 
 
-    def _process_model_response(self, response_raw: Dict[str, Any], intended_recipient: str) -> Generator[Message, None, None]:
-        """Processes the raw response from the model, yielding one or more messages.
+
+    def _process_model_response(self, response_raw: Union[Dict[str, Any], Iterator[Dict[str, Any]]], intended_recipient: str, stream: bool = False) -> Generator[Message, None, None]:
+        """Processes the raw response from the model, yielding one or more messages. While the model calls functions, their results
+        are sent back to it and its next response is processed in turn, until it replies without calling a function or one of the
+        turn's budgets (max_steps, max_wall_time, max_tokens_per_turn) is exhausted, which ends the turn with a message saying so.
+        The timing of each step is recorded in last_turn_steps.
         
         Args:
-            response_raw (Dict[str, Any]): The raw response from the model.
+            response_raw (Union[Dict[str, Any], Iterator[Dict[str, Any]]]): The raw response from the model, or an iterator of its chunks if streaming.
             intended_recipient (str): The name of the intended recipient of the message.
+            stream (bool, optional): Whether the response is streamed, in which case delta messages are yielded as it arrives and further completions are streamed too. Defaults to False.
             
         Yields:
             One or more messages from the agent."""
-        finish_reason = response_raw["choices"][0]["finish_reason"]
-        message = response_raw["choices"][0]["message"]
-        new_message = None
+        turn = _TurnBudget(self, self._count_history_tokens() + self._count_function_schema_tokens())
+        self.last_turn_steps = turn.steps
 
-        ## The model is not trying to make a function call, 
-        ## so we just return the message as-is
-        if "function_call" not in message:
-            new_message = Message(role = message["role"], 
-                                  content = message["content"], 
-                                  finish_reason = finish_reason, 
-                                  author = self.name,
-                                  intended_recipient = intended_recipient,
-                                  is_function_call = False)
-            yield new_message
-            ## do not continue, nothing more to do
+        while True:
+            result_messages = yield from self._tool_step(response_raw, intended_recipient, stream, turn)
+            if result_messages is None:
+                return
+
+            ## yield the message(s) to the stream
+            yield from result_messages
+
+            ## check to see if there are tokens in the budget, and that the turn may go on
+            out_of_tokens = self._check_token_budget(result_messages[-1], intended_recipient)
+            if out_of_tokens is not None:
+                yield out_of_tokens
+                return
+
+            exhausted = turn.exhausted(self._count_history_tokens() + self._count_function_schema_tokens())
+            if exhausted is not None:
+                yield self._turn_exhausted_message(exhausted, intended_recipient)
+                return
+
+            # there was a function call and a result, which we send back to the model for summarization for the caller;
+            # the model may want to make *another* function call, which is handled by the next step
+            turn.start_step()
+            try:
+                response_raw = self._create_completion(stream = stream)
+            except Exception as e:
+                yield Message(role = "assistant", content = f"Error in sending function or method call result to model: {str(e)}", author = "System", intended_recipient = intended_recipient)
+                # if there was a failure in the summary/further work determination, we shouldn't try to do further work, just exit
+                return
+
+
+    def _tool_step(self, response_raw: Union[Dict[str, Any], Iterator[Dict[str, Any]]], intended_recipient: str, stream: bool, turn: "_TurnBudget") -> Generator[Message, None, Optional[List[Message]]]:
+        """One step of the tool loop: yields the model's message(s) and executes the function call(s) they make.
+
+        Args:
+            response_raw (Union[Dict[str, Any], Iterator[Dict[str, Any]]]): The raw response from the model, or an iterator of its chunks if streaming.
+            intended_recipient (str): The name of the intended recipient of the message.
+            stream (bool): Whether the response is streamed.
+            turn (_TurnBudget): The budgets and step timings of the turn.
+
+        Returns:
+            The result message(s) of the function call(s), or None if the model didn't call a function."""
+        ## parallel tool calls are independent, so they are dispatched concurrently on the agent's bounded pool of threads
+        executor = self._tool_executor
+        dispatched = {}
+
+        if stream:
+            ## yield the text as it arrives, and start each tool call as soon as its arguments are complete
+            assembler = _StreamAssembler()
+            for chunk in response_raw:
+                content, completed_tool_calls = assembler.add(chunk)
+                if content:
+                    yield self._delta_message(content, intended_recipient)
+                for call_message in self._dispatchable_tool_calls(completed_tool_calls):
+                    dispatched[call_message.tool_call_id] = executor.submit(self._execute_tool_call, call_message)
+            response_raw = assembler.response()
+        turn.response_received()
+
+        ## yield the model's message(s); if it isn't a function call there is nothing more to do
+        call_messages = self._response_to_messages(response_raw, intended_recipient)
+        yield from call_messages
+        if not call_messages[0].is_function_call:
+            turn.end_step([])
             return None
-        
-        ## otherwise, the model is trying to call a function
+
+        ## otherwise, we need to call the function(s) and get the result(s)
+        if call_messages[0].tool_call_id is None:
+            result_messages = [self._execute_function_call(call_messages[0])]
         else:
-            ## first we extract it (the call info) and format it as a message, yielding it to the stream
-            func_name = message["function_call"]["name"]
-            func_arguments = json.loads(message["function_call"]["arguments"])
-
-            new_message = Message(role = message["role"], 
-                                  content = message["content"],
-                                  is_function_call = True,
-                                  func_name = func_name, 
-                                  author = self.name,
-                                  ## the intended recipient is the calling agent, noted as a function call
-                                  intended_recipient = f"{self.name} ({func_name} function)",
-                                  func_arguments = func_arguments)
-            
-            yield new_message
-
-            ## next we need to call the function and get the result
-            ## if the function is an API call, we call it and yield the result
-            if func_name in self.api_set.get_function_names():
-                func_result = self.api_set.call_endpoint({"name": func_name, "arguments": func_arguments})
-                if func_result["status_code"] == 200:
-                    func_result = json.dumps(func_result["data"])
-                else:
-                    func_result = f"Error in attempted API call: {json.dumps(func_result)}"
-
-                new_message = Message(role = "function", 
-                                      content = func_result, 
-                                      func_name = func_name, 
-                                      ## the author is the calling agent's function
-                                      author = f"{self.name} ({func_name} function)",
-                                      ## the intended recipient is the calling agent
-                                      intended_recipient = self.name,
-                                      is_function_call = False)
+            ## results are yielded (and so added to the history) in the order of the calls
+            futures = [dispatched.get(call_message.tool_call_id) or executor.submit(self._execute_tool_call, call_message) for call_message in call_messages]
+            result_messages = [future.result() for future in futures]
+
+        turn.end_step([call_message.func_name for call_message in call_messages])
+        return result_messages
+
+
+    async def _aprocess_model_response(self, response_raw: Union[Dict[str, Any], AsyncIterator[Dict[str, Any]]], intended_recipient: str, stream: bool = False) -> AsyncGenerator[Message, None]:
+        """The asyncio counterpart of _process_model_response.
+        
+        Args:
+            response_raw (Union[Dict[str, Any], AsyncIterator[Dict[str, Any]]]): The raw response from the model, or an async iterator of its chunks if streaming.
+            intended_recipient (str): The name of the intended recipient of the message.
+            stream (bool, optional): Whether the response is streamed. Defaults to False.
             
-            ## if its not an API call, maybe it's one of the local callable methods
-            elif func_name in self.callable_functions:
-                try:
-                    # call_method is a generator, even if the method it's calling is not
-                    # but if the method being called is a generator, it yields from the called generator
-                    # so regardless, we are looping over results, checking each to see if the result is 
-                    # already a message (as will happen in the case of a method that calls a sub-agent)
-                    func_result = self._call_function(func_name, func_arguments)
-                    for potential_message in func_result:
-                        # if it is a message already, just yield it to the stream
-                        if isinstance(potential_message, Message):
-                            new_message = potential_message
-                        else:
-                            # otherwise we turn the result into a message and yield it
-                            new_message = Message(role = "function", 
-                                                  content = json.dumps(potential_message), 
-                                                  func_name = func_name, 
-                                                  author = f"{self.name} ({func_name} function)",
-                                                  intended_recipient = self.name,
-                                                  is_function_call = False)
-
-
-                except ValueError as e:
-                    new_message = Message(role = "function",
-                                  content = f"Error in attempted method call: {str(e)}",
-                                  func_name = func_name,
-                                  author = f"{self.name} ({func_name} function)",
-                                  intended_recipient = self.name,
-                                  is_function_call = False)
-                    
-            ## if the function isn't found, let the model know (this shouldn't happen)
+        Yields:
+            One or more messages from the agent."""
+        turn = _TurnBudget(self, self._count_history_tokens() + self._count_function_schema_tokens())
+        self.last_turn_steps = turn.steps
+
+        while True:
+            result_messages = []
+            async for message in self._atool_step(response_raw, intended_recipient, stream, turn, result_messages):
+                yield message
+            if len(result_messages) == 0:
+                return
+
+            for message in result_messages:
+                yield message
+
+            out_of_tokens = self._check_token_budget(result_messages[-1], intended_recipient)
+            if out_of_tokens is not None:
+                yield out_of_tokens
+                return
+
+            exhausted = turn.exhausted(self._count_history_tokens() + self._count_function_schema_tokens())
+            if exhausted is not None:
+                yield self._turn_exhausted_message(exhausted, intended_recipient)
+                return
+
+            turn.start_step()
+            try:
+                response_raw = await self._acreate_completion(stream = stream)
+            except Exception as e:
+                yield Message(role = "assistant", content = f"Error in sending function or method call result to model: {str(e)}", author = "System", intended_recipient = intended_recipient)
+                return
+
+
+    async def _atool_step(self, response_raw: Union[Dict[str, Any], AsyncIterator[Dict[str, Any]]], intended_recipient: str, stream: bool, turn: "_TurnBudget", result_messages: List[Message]) -> AsyncGenerator[Message, None]:
+        """The asyncio counterpart of _tool_step. As async generators can't return a value, the result message(s) are
+        appended to result_messages (which is left empty if the model didn't call a function)."""
+        semaphore = asyncio.Semaphore(self.max_parallel_tool_calls)
+
+        async def execute(call_message):
+            async with semaphore:
+                return await self._aexecute_tool_call(call_message)
+
+        dispatched = {}
+        try:
+            if stream:
+                assembler = _StreamAssembler()
+                async for chunk in response_raw:
+                    content, completed_tool_calls = assembler.add(chunk)
+                    if content:
+                        yield self._delta_message(content, intended_recipient)
+                    for call_message in self._dispatchable_tool_calls(completed_tool_calls):
+                        dispatched[call_message.tool_call_id] = asyncio.ensure_future(execute(call_message))
+                response_raw = assembler.response()
+            turn.response_received()
+
+            call_messages = self._response_to_messages(response_raw, intended_recipient)
+            for message in call_messages:
+                yield message
+            if not call_messages[0].is_function_call:
+                turn.end_step([])
+                return
+
+            if call_messages[0].tool_call_id is None:
+                result_messages.append(await self._aexecute_function_call(call_messages[0]))
             else:
-                new_message = Message(role = "function",
-                              content = f"Error: function {func_name} not found.",
-                              func_name = None,
-                              author = "System",
-                              intended_recipient = self.name,
-                              is_function_call = False
-                              )
+                tasks = [dispatched.get(call_message.tool_call_id) or asyncio.ensure_future(execute(call_message)) for call_message in call_messages]
+                result_messages.extend(await asyncio.gather(*tasks))
+        finally:
+            for task in dispatched.values():
+                task.cancel()  # a no-op for finished tasks; cancels calls left over from a failed response
+
+        turn.end_step([call_message.func_name for call_message in call_messages])
+
+
+    def _turn_exhausted_message(self, reason: str, intended_recipient: str) -> Message:
+        """Returns the message ending a turn whose tool loop has exhausted one of its budgets."""
+        return Message(role = "assistant", content = f"I've stopped working on this request: {reason}. Please let me know if you'd like me to continue.", author = "System", intended_recipient = intended_recipient)
+
+
+    def _delta_message(self, content: str, intended_recipient: str) -> Message:
+        """Returns a delta message carrying a newly streamed piece of the model's reply."""
+        return Message(role = "assistant", content = content, author = self.name, intended_recipient = intended_recipient, is_delta = True)
+
+
+    def _dispatchable_tool_calls(self, tool_calls: List[Dict[str, Any]]) -> List[Message]:
+        """Returns function call messages for the completed tool calls of a streaming response that can be started early.
+        Calls with unparseable arguments are left for _response_to_messages to report."""
+        call_messages = []
+        for tool_call in tool_calls:
+            try:
+                call_messages.append(self._tool_call_message(tool_call, content = None))
+            except ValueError:
+                pass
+        return call_messages
+
+
+    def _execute_function_call(self, call_message: Message) -> Message:
+        """Calls the API endpoint or callable method requested by a function call message.
+
+        Args:
+            call_message (Message): The function call message.
+
+        Returns:
+            The function message holding the result."""
+        func_name = call_message.func_name
+        func_arguments = call_message.func_arguments
+
+        ## if the function is an API call, we call it and return the result
+        if self.api_set.has_function(func_name):
+            func_result = self.api_set.call_endpoint({"name": func_name, "arguments": func_arguments})
+            return self._api_result_message(func_name, func_result)
         
-        ## yield the message to the stream
-        yield new_message
+        ## if its not an API call, maybe it's one of the local callable methods
+        elif func_name in self.callable_functions:
+            new_message = call_message
+            try:
+                # call_method is a generator, even if the method it's calling is not
+                # but if the method being called is a generator, it yields from the called generator
+                # so regardless, we are looping over results, checking each to see if the result is 
+                # already a message (as will happen in the case of a method that calls a sub-agent)
+                for potential_message in self._call_function(func_name, func_arguments):
+                    new_message = self._callable_result_message(func_name, potential_message)
+            except ValueError as e:
+                new_message = self._function_error_message(func_name, e)
+            return new_message
+                
+        ## if the function isn't found, let the model know (this shouldn't happen)
+        return self._function_not_found_message(func_name)
+
+
+    async def _aexecute_function_call(self, call_message: Message) -> Message:
+        """The asyncio counterpart of _execute_function_call."""
+        func_name = call_message.func_name
+        func_arguments = call_message.func_arguments
+
+        if self.api_set.has_function(func_name):
+            func_result = await self.api_set.acall_endpoint({"name": func_name, "arguments": func_arguments})
+            return self._api_result_message(func_name, func_result)
+
+        elif func_name in self.callable_functions:
+            new_message = call_message
+            try:
+                async for potential_message in self._acall_function(func_name, func_arguments):
+                    new_message = self._callable_result_message(func_name, potential_message)
+            except ValueError as e:
+                new_message = self._function_error_message(func_name, e)
+            return new_message
 
-        ## check to see if there are tokens in the budget
-        self.token_bucket.refill()
-        needed_tokens = self.compute_token_cost(new_message.content)
-        sufficient_budget = self.token_bucket.consume(needed_tokens)
-        if not sufficient_budget:
-            yield Message(role = "assistant", content = f"Sorry, I'm out of tokens. Please try again later.", author = "System", intended_recipient = intended_recipient)
-            return
+        return self._function_not_found_message(func_name)
 
 
-        # if we've gotten here, there was a function call and a result
-        # now we send the result back to the model for summarization for the caller or,
-        # the model may want to make *another* function call, so it is processed recursively using the logic above
-        # (TODO? set a maximum recursive depth to avoid infinite-loop behavior)
-        try:
-            reponse_raw = openai.ChatCompletion.create(
-                              model=self.model,
-                              temperature = 0,
-                              messages = self._reserialize_history(),
-                              functions = self.api_set.get_function_schemas() + self._get_method_schemas(),
-                              function_call = "auto")
-        except Exception as e:
-            yield Message(role = "assistant", content = f"Error in sending function or method call result to model: {str(e)}", author = "System", intended_recipient = intended_recipient)
-            # if there was a failure in the summary/further work determination, we shouldn't try to do further work, just exit
-            return None
+    def _execute_tool_call(self, call_message: Message) -> Message:
+        """Executes one of several parallel tool calls, returning its result as a function message answering the call's id."""
+        return self._as_tool_result(call_message, self._execute_function_call(call_message))
 
-        # the intended recipient of the summary/further work is still the original indended recipient            
-        # and we just want to yield all the messages that come out
-        yield from self._process_model_response(reponse_raw, intended_recipient = intended_recipient)
 
+    async def _aexecute_tool_call(self, call_message: Message) -> Message:
+        """The asyncio counterpart of _execute_tool_call."""
+        return self._as_tool_result(call_message, await self._aexecute_function_call(call_message))
 
 
-    def _reserialize_message(self, message: Message) -> Dict[str, Any]:
-        """Reserializes a message object into a dictionary in the format used by the OpenAI API.
-        This is a helper function for _reserialize_chat.
+    def _as_tool_result(self, call_message: Message, result_message: Message) -> Message:
+        """Tags a function result with the id of the tool call it answers. Every tool call must be answered by a function
+        message, so other messages (e.g. a sub-agent's reply) are wrapped in one."""
+        if result_message.role != "function" or result_message.is_function_call:
+            result_message = Message(role = "function",
+                                     content = result_message.content,
+                                     func_name = call_message.func_name,
+                                     author = f"{self.name} ({call_message.func_name} function)",
+                                     intended_recipient = self.name,
+                                     is_function_call = False)
+        return result_message.model_copy(update = {"tool_call_id": call_message.tool_call_id})
+
+
+    def _response_to_messages(self, response_raw: Dict[str, Any], intended_recipient: str) -> List[Message]:
+        """Converts the raw response from the model into messages: a single message, unless the model made several
+        (parallel) tool calls, in which case there is one function call message per call.
         
         Args:
-            message (Message): The message to be reserialized.
+            response_raw (Dict[str, Any]): The raw response from the model.
+            intended_recipient (str): The name of the intended recipient of the message.
             
         Returns:
-            Dict[str, Any]: The reserialized message."""
+            The model's message(s)."""
+        finish_reason = response_raw["choices"][0]["finish_reason"]
+        message = response_raw["choices"][0]["message"]
 
-        if message.is_function_call:
-            return {"role": message.role, 
-                        "content": message.content, 
-                        "function_call": {"name": message.func_name,
-                                          "arguments": json.dumps(message.func_arguments)}}
-        if message.role == "function":
-            return {"role": message.role, 
-                        "name": message.func_name,
-                        "content": message.content}
-            
-        return {"role": message.role, "content": message.content}
+        if message.get("tool_calls"):
+            # any accompanying text is kept with the first call
+            return [self._tool_call_message(tool_call, content = message["content"] if i == 0 else None) for i, tool_call in enumerate(message["tool_calls"])]
 
+        ## The model is not trying to make a function call, 
+        ## so we just return the message as-is
+        if not message.get("function_call"):
+            return [Message(role = message["role"], 
+                            content = message["content"], 
+                            finish_reason = finish_reason, 
+                            author = self.name,
+                            intended_recipient = intended_recipient,
+                            is_function_call = False)]
+
+        ## otherwise, the model is trying to call a function, so we extract the call info
+        func_name = message["function_call"]["name"]
+        func_arguments = json.loads(message["function_call"]["arguments"])
+
+        return [Message(role = message["role"], 
+                        content = message["content"],
+                        is_function_call = True,
+                        func_name = func_name, 
+                        author = self.name,
+                        ## the intended recipient is the calling agent, noted as a function call
+                        intended_recipient = f"{self.name} ({func_name} function)",
+                        func_arguments = func_arguments)]
+
+
+    def _tool_call_message(self, tool_call: Dict[str, Any], content: Optional[str]) -> Message:
+        """Converts one of the tool calls in a model response into a function call message."""
+        func_name = tool_call["function"]["name"]
+        return Message(role = "assistant",
+                       content = content,
+                       is_function_call = True,
+                       func_name = func_name,
+                       author = self.name,
+                       intended_recipient = f"{self.name} ({func_name} function)",
+                       func_arguments = json.loads(tool_call["function"]["arguments"]),
+                       tool_call_id = tool_call["id"])
+
+
+    def _api_result_message(self, func_name: str, func_result: Dict[str, Any]) -> Message:
+        """Formats the result of an API endpoint call as a function message."""
+        if func_result["status_code"] == 200:
+            content = self._result_compactor(func_name).compact(func_result["data"], model = self.model)
+        else:
+            content = f"Error in attempted API call: {json.dumps(func_result)}"
+
+        return Message(role = "function", 
+                       content = content, 
+                       func_name = func_name, 
+                       ## the author is the calling agent's function
+                       author = f"{self.name} ({func_name} function)",
+                       ## the intended recipient is the calling agent
+                       intended_recipient = self.name,
+                       is_function_call = False)
+
+
+    def _result_compactor(self, func_name: str) -> ResultCompactor:
+        """Returns the compactor for the results of an API endpoint: the endpoint's own, its API's, or the agent's."""
+        compactor = self.result_compactors.get(func_name)
+        if compactor is None:
+            # the owning API is found through the dispatch index, as API names may themselves contain hyphens
+            wrapper = self.api_set.function_index.get(func_name)
+            compactor = self.result_compactors.get(wrapper.prefix, self.result_compactor) if wrapper is not None else self.result_compactor
+        return compactor
+
+
+    def _callable_result_message(self, func_name: str, result: Any) -> Message:
+        """Formats a result of a callable method as a function message; results that are already messages are passed through."""
+        # if it is a message already, just yield it to the stream
+        if isinstance(result, Message):
+            return result
+
+        # otherwise we turn the result into a message and yield it
+        return Message(role = "function", 
+                       content = json.dumps(result), 
+                       func_name = func_name, 
+                       author = f"{self.name} ({func_name} function)",
+                       intended_recipient = self.name,
+                       is_function_call = False)
+
+
+    def _function_error_message(self, func_name: str, error: Exception) -> Message:
+        """Formats an error raised by a callable method as a function message."""
+        return Message(role = "function",
+                       content = f"Error in attempted method call: {str(error)}",
+                       func_name = func_name,
+                       author = f"{self.name} ({func_name} function)",
+                       intended_recipient = self.name,
+                       is_function_call = False)
+
+
+    def _function_not_found_message(self, func_name: str) -> Message:
+        """Returns the function message telling the model that the function it called doesn't exist."""
+        return Message(role = "function",
+                       content = f"Error: function {func_name} not found.",
+                       func_name = None,
+                       author = "System",
+                       intended_recipient = self.name,
+                       is_function_call = False)
 
-    def _reserialize_history(self) -> List[Dict[str, Any]]:
-        """Reserializes a chat object (like self.history) into a list of dictionaries in the format used by the OpenAI API."""
-        messages = []
-        if self.history is None:
-            return messages
-        
-        for message in self.history.messages:
-            messages.append(self._reserialize_message(message))
-        return messages
 
 
+    def _reserialize_message(self, message: Message) -> Dict[str, Any]:
+        """Reserializes a message object into a dictionary in the format used by the OpenAI API (see models.to_wire_format).
+        
+        Args:
+            message (Message): The message to be reserialized.
+            
+        Returns:
+            Dict[str, Any]: The reserialized message."""
+        return to_wire_format(message)
 
 
+    def _reserialize_history(self) -> List[Dict[str, Any]]:
+        """Returns the history in the format used by the OpenAI API, as kept up to date by the history as messages are appended
+        (see Chat.wire_format). The list is copied, so messages appended while a request is being made don't change it;
+        the messages in it are not, so they must not be modified."""
+        if self.history is None:
+            return []
+        return list(self.history.wire_format)
 
-def _python_type_to_json_schema(py_type: type) -> Dict[str, any]:
-    """Translate Python typing annotation to JSON schema-like types."""
-    origin = get_origin(py_type)
-    if origin is None:  # means it's a built-in type
-        if py_type in [float, int]:
-            return {'type': 'number'}
-        elif py_type is str:
-            return {'type': 'string'}
-        elif py_type is bool:
-            return {'type': 'boolean'}
-        elif py_type is None:
-            return {'type': 'null'}
-        elif py_type is Any:
-            return {'type': 'object'}
-        else:
-            raise NotImplementedError(f'Unsupported type: {py_type}')
-    elif origin is list:
-        item_type = get_args(py_type)[0]
-        return {'type': 'array', 'items': _python_type_to_json_schema(item_type)}
-    elif origin is dict:
-        key_type, value_type = get_args(py_type)
-        return {'type': 'object', 'properties': {
-            'key': _python_type_to_json_schema(key_type),
-            'value': _python_type_to_json_schema(value_type)
-        }}
-    elif origin is Union:
-        return {'anyOf': [_python_type_to_json_schema(t) for t in get_args(py_type)]}
-    elif origin is Literal:
-        return {'enum': get_args(py_type)}
-    elif origin is tuple:
-        return {'type': 'array', 'items': [_python_type_to_json_schema(t) for t in get_args(py_type)]}
-    elif origin is set:
-        return {'type': 'array', 'items': _python_type_to_json_schema(get_args(py_type)[0]), 'uniqueItems': True}
-    else:
-        raise NotImplementedError(f'Unsupported type: {origin}')
-    
 
 
-def _generate_schema(fn: Callable) -> Dict[str, Any]:
-    """Generate JSON schema for a function. Used to generate the function schema for a local method.
-    
-    Args:
-        fn (Callable): The function to generate the schema for.
-        
-    Returns:
-        Dict[str, Any]: The generated schema."""
-    docstring = parse(fn.__doc__)
-    sig = inspect.signature(fn)
-    params = sig.parameters
-    schema = {
-        'name': fn.__name__,
-        'parameters': {
-            'type': 'object',
-            'properties': {},
-            'required': list(params.keys())
-        },
-        'description': docstring.short_description,
-    }
-    for p in docstring.params:
-        schema['parameters']['properties'][p.arg_name] = {
-            **_python_type_to_json_schema(params[p.arg_name].annotation),
-            'description': p.description
-        }
-    return schema
 
 
 def _context_size(model: str = "gpt-3.5-turbo-0613") -> int:
@@ -606,53 +1456,175 @@ def _context_size(model: str = "gpt-3.5-turbo-0613") -> int:
         return 4096
 
 
-## Straight from https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
-def _num_tokens_from_messages(messages: List[Dict[str, Any]], model="gpt-3.5-turbo-0613") -> int:
-    """Return the number of tokens used by a list of messages. 
-    As provided by https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb (Aug 2023).
-    
+class _TurnBudget:
+    """Tracks a turn's tool loop against the agent's max_steps, max_wall_time and max_tokens_per_turn, and records the
+    timing of each step: a dictionary with the seconds spent waiting for the model's response ("model_seconds") and
+    executing the functions it called ("function_seconds"), and the names of those functions ("functions"). The first
+    response is requested before the loop starts, so its model_seconds only covers receiving it if it is streamed."""
+
+    def __init__(self, agent: UtilityAgent, prompt_tokens: int) -> None:
+        self.agent = agent
+        self.started = time.monotonic()
+        self.prompt_tokens = prompt_tokens # sent to the model so far this turn
+        self.steps = []
+        self._step_started = self.started
+        self._response_received = self.started
+
+
+    def start_step(self) -> None:
+        self._step_started = time.monotonic()
+
+
+    def response_received(self) -> None:
+        self._response_received = time.monotonic()
+
+
+    def end_step(self, functions: List[str]) -> None:
+        now = time.monotonic()
+        self.steps.append({"model_seconds": self._response_received - self._step_started,
+                           "function_seconds": now - self._response_received,
+                           "functions": functions})
+
+
+    def exhausted(self, next_prompt_tokens: int) -> Optional[str]:
+        """Returns why the turn can't make another request to the model, or None if it can (counting that request's prompt tokens)."""
+        if self.agent.max_steps is not None and len(self.steps) >= self.agent.max_steps:
+            return f"I made {len(self.steps)} rounds of function calls, the most allowed for one request"
+        if self.agent.max_wall_time is not None and time.monotonic() - self.started >= self.agent.max_wall_time:
+            return f"it has taken {time.monotonic() - self.started:.1f} seconds, more than the {self.agent.max_wall_time} allowed for one request"
+        if self.agent.max_tokens_per_turn is not None and self.prompt_tokens + next_prompt_tokens > self.agent.max_tokens_per_turn:
+            return f"continuing would use more than the {self.agent.max_tokens_per_turn} tokens allowed for one request"
+        self.prompt_tokens += next_prompt_tokens
+        return None
+
+
+
+# runs optimistic completion requests in the background of sync chats
+_background_executor = concurrent.futures.ThreadPoolExecutor(max_workers = 32)
+
+
+def _close_discarded_completion(future: concurrent.futures.Future) -> None:
+    """Closes a discarded streamed completion, releasing its connection."""
+    if not future.cancelled() and future.exception() is None and hasattr(future.result(), "close"):
+        future.result().close()
+
+
+def _aclose_discarded_completion(future: asyncio.Future) -> None:
+    """Closes a discarded streamed completion from achat, releasing its connection."""
+    if not future.cancelled() and future.exception() is None and hasattr(future.result(), "aclose"):
+        asyncio.ensure_future(future.result().aclose())
+
+
+async def _await(awaitable):
+    return await awaitable
+
+
+# the event loop async callables are run on when called from sync code; started on first use
+_coroutine_loop = None
+_coroutine_loop_lock = threading.Lock()
+
+
+def _run_coroutine(coroutine) -> Any:
+    """Runs a coroutine to completion on the dedicated event loop thread, blocking until it is done. Unlike asyncio.run,
+    this works from threads that are already running an event loop (e.g. a sync chat driven from async code).
+
     Args:
-        messages (List[Dict[str, Any]]): The messages to count the tokens of.
-        model (str, optional): The model to use for tokenization. Defaults to "gpt-3.5-turbo-0613".
+        coroutine: The coroutine to run.
 
     Returns:
-        int: The number of tokens used by the messages.
-    """
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        print("Warning: model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
-    if model in {
-        "gpt-3.5-turbo-0613",
-        "gpt-3.5-turbo-16k-0613",
-        "gpt-4-0314",
-        "gpt-4-32k-0314",
-        "gpt-4-0613",
-        "gpt-4-32k-0613",
-        }:
-        tokens_per_message = 3
-        tokens_per_name = 1
-    elif model == "gpt-3.5-turbo-0301":
-        tokens_per_message = 4  # every message follows <|start|>{role/name}\n{content}<|end|>\n
-        tokens_per_name = -1  # if there's a name, the role is omitted
-    elif "gpt-3.5-turbo" in model:
-        print("Warning: gpt-3.5-turbo may update over time. Returning num tokens assuming gpt-3.5-turbo-0613.")
-        return _num_tokens_from_messages(messages, model="gpt-3.5-turbo-0613")
-    elif "gpt-4" in model:
-        print("Warning: gpt-4 may update over time. Returning num tokens assuming gpt-4-0613.")
-        return _num_tokens_from_messages(messages, model="gpt-4-0613")
-    else:
-        raise NotImplementedError(
-            f"""num_tokens_from_messages() is not implemented for model {model}. See https://github.com/openai/openai-python/blob/main/chatml.md for information on how messages are converted to tokens."""
-        )
-    num_tokens = 0
-    for message in messages:
-        num_tokens += tokens_per_message
-        for key, value in message.items():
-            num_tokens += len(encoding.encode(str(value)))
-            if key == "name":
-                num_tokens += tokens_per_name
-    num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
-    return num_tokens
+        The coroutine's result (or raises its exception)."""
+    global _coroutine_loop
+    with _coroutine_loop_lock:
+        if _coroutine_loop is None:
+            _coroutine_loop = asyncio.new_event_loop()
+            threading.Thread(target = _coroutine_loop.run_forever, name = "agent-smith-coroutines", daemon = True).start()
+    return asyncio.run_coroutine_threadsafe(coroutine, _coroutine_loop).result()
+
+
+class _StreamAssembler:
+    """Assembles the chunks of a streamed completion into the response the request would have had without streaming."""
+
+    def __init__(self) -> None:
+        self.role = "assistant"
+        self.content = []
+        self.function_call = None
+        self.tool_calls = []
+        self.finish_reason = None
 
+
+    def add(self, chunk: Dict[str, Any]) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+        """Adds a chunk to the response.
+
+        Args:
+            chunk (Dict[str, Any]): The chunk.
+
+        Returns:
+            The new piece of the reply's text (if any), and the tool calls this chunk showed to be complete (a call is
+            complete once the next one starts; the last is complete with the response)."""
+        completed_tool_calls = []
+        if len(chunk["choices"]) == 0:
+            return None, completed_tool_calls
+
+        choice = chunk["choices"][0]
+        delta = choice.get("delta") or {}
+        if delta.get("role"):
+            self.role = delta["role"]
+
+        content = delta.get("content")
+        if content:
+            self.content.append(content)
+
+        if delta.get("function_call"):
+            if self.function_call is None:
+                self.function_call = {"name": "", "arguments": ""}
+            self.function_call["name"] += delta["function_call"].get("name") or ""
+            self.function_call["arguments"] += delta["function_call"].get("arguments") or ""
+
+        for tool_call_delta in delta.get("tool_calls") or []:
+            while tool_call_delta["index"] >= len(self.tool_calls):
+                if len(self.tool_calls) > 0:
+                    completed_tool_calls.append(self.tool_calls[-1])
+                self.tool_calls.append({"id": "", "type": "function", "function": {"name": "", "arguments": ""}})
+            tool_call = self.tool_calls[tool_call_delta["index"]]
+            tool_call["id"] += tool_call_delta.get("id") or ""
+            function_delta = tool_call_delta.get("function") or {}
+            tool_call["function"]["name"] += function_delta.get("name") or ""
+            tool_call["function"]["arguments"] += function_delta.get("arguments") or ""
+
+        if choice.get("finish_reason"):
+            self.finish_reason = choice["finish_reason"]
+
+        return content, completed_tool_calls
+
+
+    def response(self) -> Dict[str, Any]:
+        """Returns the assembled response, in the form of a non-streamed response."""
+        message = {"role": self.role, "content": "".join(self.content) if len(self.content) > 0 else None}
+        if self.function_call is not None:
+            message["function_call"] = self.function_call
+        if len(self.tool_calls) > 0:
+            message["tool_calls"] = self.tool_calls
+        return {"choices": [{"index": 0, "message": message, "finish_reason": self.finish_reason}]}
+
+
+
+_SUMMARY_PROMPT = "Please summarize our conversation so far. The goal is to be able to continue our conversation from the summary only. Do not editorialize or ask any questions."
+_PART_SUMMARY_PROMPT = "Please summarize this part of our conversation. The goal is to be able to continue our conversation from the summaries of its parts only. Do not editorialize or ask any questions."
+
+# room left in a summarization request for the prompt, the summarizer's function definitions and the summary itself
+_SUMMARY_RESERVE_TOKENS = 1000
+
+
+def _transcript_line(message: Message) -> str:
+    """Renders a message as a line of a plain-text conversation transcript."""
+    speaker = message.author if message.author is not None else message.role
+    if message.is_function_call:
+        return f"{speaker} called {message.func_name}({json.dumps(message.func_arguments)})"
+    if message.role in ["function", "tool"]:
+        return f"Result of {message.func_name}: {message.content}"
+    return f"{speaker}: {message.content}"
+
+
+# function schema token counts, keyed by (model, sha256 of the serialized schema list, system message); shared across agents
+# since agents of the same class typically register identical function sets
+_FUNCTION_SCHEMA_TOKENS: Dict[tuple, int] = {}
@@ -0,0 +1,51 @@
+from agent_smith_ai import spec_cache
+from agent_smith_ai.moderation import get_default_moderation_batcher
+from agent_smith_ai.endpoint_cache import get_default_endpoint_cache
+from benchmarks.stub_servers import StubOpenAIServer
+import openai
+import pytest
+
+
+@pytest.fixture(autouse = True)
+def isolated_spec_cache(tmp_path):
+    """Keeps specs fetched during tests out of the user's spec cache."""
+    previous = spec_cache.get_default_spec_cache()
+    spec_cache.set_default_spec_cache(spec_cache.SpecCache(cache_dir = str(tmp_path / "specs")))
+    yield
+    spec_cache.set_default_spec_cache(previous)
+
+
+@pytest.fixture(autouse = True)
+def fresh_moderation_cache():
+    """Keeps moderation verdicts from one test from answering another's requests."""
+    get_default_moderation_batcher().cache.clear()
+    yield
+
+
+@pytest.fixture(autouse = True)
+def fresh_endpoint_cache():
+    """Keeps endpoint results cached by one test from answering another's calls."""
+    get_default_endpoint_cache().clear()
+    yield
+
+
+@pytest.fixture
+def openai_api_key(monkeypatch):
+    """Lets agents be created without a real OpenAI API key."""
+    monkeypatch.setenv("OPENAI_API_KEY", "placeholder")
+
+
+@pytest.fixture
+def start_openai_stub(monkeypatch, openai_api_key):
+    """Returns a function that starts a StubOpenAIServer with the given arguments and points the openai module at it;
+    the servers are stopped after the test."""
+    def start(script = None, **kwargs):
+        server = StubOpenAIServer(script = script, **kwargs).start()
+        monkeypatch.setattr(openai, "api_base", server.api_base)
+        servers.append(server)
+        return server
+
+    servers = []
+    yield start
+    for server in servers:
+        server.stop()
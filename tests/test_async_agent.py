@@ -0,0 +1,93 @@
+from agent_smith_ai.utility_agent import UtilityAgent
+from benchmarks.stub_servers import StubOpenAPIServer
+import asyncio
+import json
+
+
+async def _collect(agent, message):
+    return [message async for message in agent.achat(message)]
+
+
+def test_achat_matches_chat(start_openai_stub):
+    start_openai_stub(["Hello! How can I help?"])
+    agent = UtilityAgent()
+
+    sync_messages = list(agent.chat("Hi there"))
+    async_messages = asyncio.run(_collect(agent, "Hi again"))
+
+    assert [m.content for m in async_messages] == [m.content for m in sync_messages] == ["Hello! How can I help?"]
+    assert [m.role for m in agent.history.messages] == ["system", "user", "assistant", "user", "assistant"]
+
+
+def test_achat_many_concurrent_agents(start_openai_stub):
+    server = start_openai_stub(["Hello! How can I help?"])
+    agents = [UtilityAgent(name = f"Agent {i}") for i in range(50)]
+
+    async def run_all():
+        return await asyncio.gather(*[_collect(agent, "Hi") for agent in agents])
+
+    results = asyncio.run(run_all())
+
+    assert all([[m.content for m in messages] == ["Hello! How can I help?"] for messages in results])
+    assert server.request_counts["/v1/chat/completions"] == 50
+    # the identical messages are moderated together, and then from the verdict cache
+    assert server.request_counts["/v1/moderations"] < 50
+
+
+def test_achat_async_tools(start_openai_stub):
+    start_openai_stub([{"name": "lookup", "arguments": {"query": "BRCA1"}},
+                 {"name": "api-get_item_2", "arguments": {"id": "HGNC:1100"}},
+                 "Done."])
+
+    async def lookup(query: str) -> dict:
+        """Look up a gene.
+
+        Args:
+            query: The gene symbol."""
+        await asyncio.sleep(0)
+        return {"symbol": query}
+
+    with StubOpenAPIServer(num_operations = 3) as api:
+        agent = UtilityAgent(check_toxicity = False)
+        agent.register_callable_functions({"lookup": lookup})
+        agent.register_api("api", api.spec_url, api.url)
+
+        messages = asyncio.run(_collect(agent, "Tell me about BRCA1"))
+
+    assert [(m.role, m.func_name) for m in messages] == [("assistant", "lookup"), ("function", "lookup"),
+                                                         ("assistant", "api-get_item_2"), ("function", "api-get_item_2"),
+                                                         ("assistant", None)]
+    assert json.loads(messages[1].content) == {"symbol": "BRCA1"}
+    assert json.loads(messages[3].content)["params"] == {"id": "HGNC:1100"}
+    assert messages[-1].content == "Done."
+
+    # async callables also work from the sync API
+    assert list(agent._call_function("lookup", {"query": "TP53"})) == [{"symbol": "TP53"}]
+
+
+def test_sync_calls_of_async_tools_inside_a_running_loop(openai_api_key):
+    async def lookup(query: str) -> dict:
+        """Look up a gene.
+
+        Args:
+            query: The gene symbol."""
+        await asyncio.sleep(0)
+        return {"symbol": query}
+
+    async def spell(query: str):
+        """Spell a gene symbol.
+
+        Args:
+            query: The gene symbol."""
+        for letter in query:
+            await asyncio.sleep(0)
+            yield letter
+
+    agent = UtilityAgent(check_toxicity = False)
+    agent.register_callable_functions({"lookup": lookup, "spell": spell})
+
+    # e.g. a sync chat driven from a notebook or web handler, whose thread is already running an event loop
+    async def call_synchronously():
+        return list(agent._call_function("lookup", {"query": "BRCA1"})), list(agent._call_function("spell", {"query": "TP53"}))
+
+    assert asyncio.run(call_synchronously()) == ([{"symbol": "BRCA1"}], ["T", "P", "5", "3"])
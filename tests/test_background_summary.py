@@ -0,0 +1,87 @@
+from agent_smith_ai.utility_agent import UtilityAgent, _SUMMARY_PROMPT
+import asyncio
+import pytest
+import time
+
+
+LATENCY = 0.3
+
+
+@pytest.fixture
+def openai_stub(start_openai_stub):
+    return start_openai_stub(script = ["Hello! How can I help?"], latency = LATENCY)
+
+
+def _agent(**kwargs):
+    # a soft watermark just below the context size, so every turn after the first crosses it
+    return UtilityAgent(check_toxicity = False, auto_summarize_buffer_tokens = None, background_summarize_buffer_tokens = 4090, **kwargs)
+
+
+def test_summary_is_swapped_in_without_waiting(openai_stub):
+    agent = _agent()
+    list(agent.chat("First question"))
+    list(agent.chat("Second question"))
+    future, summarized = agent._background_summary
+    assert [m.content for m in summarized] == ["First question", "Hello! How can I help?"]
+    future.result()
+    openai_stub.reset_counts()
+
+    messages = list(agent.chat("Third question"))
+
+    assert [m.content for m in messages] == ["Hello! How can I help?"]
+    # the reply waited for no other request (the next background summary is made alongside it); the summary was already made
+    requests = openai_stub.request_log("/v1/chat/completions")
+    [reply] = [r for r in requests if r["body"]["messages"][-1]["content"] == "Third question"]
+    assert all([r["finished"] is None or reply["started"] < r["finished"] for r in requests])
+    history = agent.history.messages
+    assert len(history) == 5
+    assert history[1].content.startswith("Here is a summary of our conversation thus far:") and history[1].content.endswith("Second question")
+    assert [m.content for m in history[2:]] == ["Hello! How can I help?", "Third question", "Hello! How can I help?"]
+    assert agent.history.num_tokens == agent._count_messages_tokens(history)
+
+
+def test_unfinished_summaries_do_not_block_turns(openai_stub):
+    agent = _agent()
+    list(agent.chat("First question"))
+    list(agent.chat("Second question"))
+    agent._background_summary[0].result()
+
+    # the summary started by the second turn was made alongside its reply, which was requested without waiting for it
+    requests = openai_stub.request_log("/v1/chat/completions")
+    [summary] = [r for r in requests if r["body"]["messages"][-1]["content"] == _SUMMARY_PROMPT]
+    [reply] = [r for r in requests if r["body"]["messages"][-1]["content"] == "Second question"]
+    assert reply["started"] < summary["finished"]
+
+    messages = list(agent.chat("Third question"))
+    assert [m.content for m in messages] == ["Hello! How can I help?"]
+
+
+def test_stale_summaries_are_discarded(openai_stub):
+    agent = _agent()
+    list(agent.chat("First question"))
+    list(agent.chat("Second question"))
+    agent._background_summary[0].result()
+    agent.clear_history()
+
+    list(agent.chat("A new conversation"))
+    assert [m.content for m in agent.history.messages[1:]] == ["A new conversation", "Hello! How can I help?"]
+
+
+def test_hard_threshold_uses_the_background_summary(openai_stub):
+    agent = _agent()
+    list(agent.chat("First question"))
+    list(agent.chat("Second question"))
+    while len(openai_stub.request_log("/v1/chat/completions")) < 3: # for the summary request to reach the server
+        time.sleep(0.01)
+    openai_stub.reset_counts()
+    agent.auto_summarize = 4090
+
+    async def run():
+        return [message async for message in agent.achat("Third question")]
+
+    messages = asyncio.run(run())
+
+    # the summary in progress is waited for rather than started over; the conversation is still over the hard threshold,
+    # so it is then summarized in full
+    assert openai_stub.request_counts["/v1/chat/completions"] == 2
+    assert messages[-1].content == "Hello! How can I help?"
@@ -0,0 +1,20 @@
+from benchmarks import agent_turns
+
+
+def test_agent_turns_benchmark_counts_calls_per_turn(openai_api_key):
+    results = agent_turns.run(num_turns = 2)
+
+    assert set(results) == {"UtilityAgent", "CLIAgent", "BashAIAgent"}
+    for name, metrics in results.items():
+        assert set(metrics) == set(agent_turns.METRICS)
+        # a tool call and the reply to its result, and one moderation of the user's message
+        assert (metrics["completions_per_turn"], metrics["moderations_per_turn"]) == (2, 1)
+        assert metrics["turn_ms_mean"] > 0 and metrics["peak_memory_mb"] > 0
+    assert results["UtilityAgent"]["endpoint_calls_per_turn"] == 1
+
+
+def test_regressions_are_compared_with_the_baseline():
+    baseline = {"UtilityAgent": {"turn_ms_mean": 10.0, "completions_per_turn": 2.0}}
+    results = {"UtilityAgent": {"turn_ms_mean": 11.0, "completions_per_turn": 3.0, "peak_memory_mb": 1.0}}
+
+    assert agent_turns.compare(results, baseline, tolerance = 0.2) == ["UtilityAgent.completions_per_turn"]
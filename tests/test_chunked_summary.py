@@ -0,0 +1,89 @@
+from agent_smith_ai.utility_agent import UtilityAgent
+from agent_smith_ai.models import Chat, Message
+import asyncio
+import pytest
+
+
+LATENCY = 0.3
+
+
+@pytest.fixture
+def openai_stub(start_openai_stub):
+    return start_openai_stub(script = ["A summary."], latency = LATENCY)
+
+
+def _agent_with_history(num_turns, **kwargs):
+    kwargs = {"check_toxicity": False, "auto_summarize_buffer_tokens": None, "summary_chunk_tokens": 500, **kwargs}
+    agent = UtilityAgent(**kwargs)
+    agent.history = Chat()
+    agent._append_to_history(Message(role = "system", content = agent.system_message, author = "System"))
+    for i in range(num_turns):
+        agent._append_to_history(Message(role = "user", content = f"Tell me about gene {i}. " + "Some detail. " * 40, author = "User"))
+        agent._append_to_history(Message(role = "assistant", content = f"Gene {i} is interesting. " + "More detail. " * 40, author = agent.name))
+    return agent
+
+
+def test_chunks_fit_the_budget():
+    agent = _agent_with_history(8, openai_api_key = "placeholder")
+    agent._append_to_history(Message(role = "function", func_name = "monarch-search", content = "result " * 5000, author = "monarch-search"))
+
+    chunks = agent._summary_chunks(agent.history.messages)
+
+    assert len(chunks) > 4
+    assert all([agent._count_messages_tokens(agent.history.messages[:1] + [chunk]) <= 500 for chunk in chunks])
+    assert chunks[0].content.count("User: Tell me about gene 0") == 1
+    assert chunks[-1].content.startswith("Here is part of our conversation:\n\nResult of monarch-search: result")
+    assert chunks[-1].content.endswith("[truncated]")
+
+    short = _agent_with_history(1, openai_api_key = "placeholder")
+    assert short._summary_chunks(short.history.messages) is None
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_parts_are_summarized_concurrently(openai_stub, asynchronous):
+    agent = _agent_with_history(8, max_parallel_summaries = 8)
+    num_chunks = len(agent._summary_chunks(agent.history.messages))
+    assert num_chunks >= 4
+
+    if asynchronous:
+        summary = asyncio.run(agent._asummarize(agent.history.messages))
+    else:
+        summary = agent._summarize(agent.history.messages)
+
+    assert summary.content == "A summary."
+    # the parts in one round, all requested before any was answered, then the reduction
+    *parts, reduction = openai_stub.request_log("/v1/chat/completions")
+    assert len(parts) == num_chunks
+    assert max([part["started"] for part in parts]) < min([part["finished"] for part in parts])
+    assert reduction["started"] >= max([part["finished"] for part in parts])
+
+
+def test_oversized_conversations_are_summarized(openai_stub):
+    agent = _agent_with_history(2, auto_summarize_buffer_tokens = 500)
+    agent.summarize_quietly = True
+    agent._append_to_history(Message(role = "function", func_name = "monarch-search", content = "result " * 5000, author = "monarch-search"))
+
+    messages = list(agent.chat("What did we find?"))
+
+    assert messages[-1].content == "A summary."
+    assert agent.history.messages[1].content.startswith("Here is a summary of our conversation thus far:\n\nA summary.")
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_summaries_that_do_not_shrink_still_end(start_openai_stub, asynchronous):
+    # part summaries as long as the parts they summarize never reduce the number of parts
+    verbose_summary = "This part covers a gene in some detail. " * 50
+    openai_stub = start_openai_stub(script = [verbose_summary])
+    agent = _agent_with_history(8)
+    num_chunks = len(agent._summary_chunks(agent.history.messages))
+
+    if asynchronous:
+        summary = asyncio.run(agent._asummarize(agent.history.messages))
+    else:
+        summary = agent._summarize(agent.history.messages)
+
+    # one round of parts, then their summaries truncated to fit a single request
+    assert summary.content == verbose_summary
+    requests = openai_stub.request_log("/v1/chat/completions")
+    assert len(requests) == num_chunks + 1
+    assert requests[-1]["body"]["messages"][-2]["content"].endswith("[truncated]")
@@ -0,0 +1,87 @@
+from agent_smith_ai.completion_cache import CompletionCache, request_key
+from agent_smith_ai.moderation import ModerationBatcher
+from agent_smith_ai.utility_agent import UtilityAgent
+import asyncio
+import pytest
+import time
+
+
+REQUEST = {"model": "gpt-3.5-turbo-0613", "temperature": 0, "messages": [{"role": "user", "content": "Hi"}], "functions": ({"name": "time"},)}
+RESPONSE = {"choices": [{"index": 0, "message": {"role": "assistant", "content": "Hello!"}, "finish_reason": "stop"}]}
+
+
+@pytest.fixture
+def openai_stub(start_openai_stub):
+    return start_openai_stub(script = [{"name": "help", "arguments": {}}, "I'm an assistant."])
+
+
+def test_request_key_is_canonical():
+    reordered = {"messages": [{"content": "Hi", "role": "user"}], "functions": [{"name": "time"}], "temperature": 0, "model": "gpt-3.5-turbo-0613"}
+    assert request_key(REQUEST) == request_key(reordered)
+    assert request_key(REQUEST) != request_key({**REQUEST, "model": "gpt-4"})
+
+
+def test_memory_and_disk_tiers(tmp_path):
+    path = str(tmp_path / "completions.sqlite")
+    cache = CompletionCache(max_entries = 1, path = path)
+    assert cache.get(REQUEST) is None
+    cache.set(REQUEST, RESPONSE)
+    assert cache.get(REQUEST) == RESPONSE
+    assert (cache.hits, cache.misses, cache.disk_hits) == (1, 1, 0)
+
+    # evicted from memory by a newer entry, but still on disk
+    cache.set({**REQUEST, "model": "gpt-4"}, RESPONSE)
+    assert cache.get(REQUEST) == RESPONSE
+    assert cache.disk_hits == 1
+    cache.close()
+
+    # and across processes
+    assert CompletionCache(path = path).get(REQUEST) == RESPONSE
+
+
+def test_ttl_and_disk_size_limits(tmp_path):
+    cache = CompletionCache(ttl = 0.05, path = str(tmp_path / "completions.sqlite"), max_disk_entries = 2)
+    cache.set(REQUEST, RESPONSE)
+    time.sleep(0.1)
+    assert cache.get(REQUEST) is None
+
+    cache = CompletionCache(max_entries = 0, path = str(tmp_path / "other.sqlite"), max_disk_entries = 2)
+    for model in ["a", "b", "c"]:
+        cache.set({**REQUEST, "model": model}, RESPONSE)
+    assert cache.get({**REQUEST, "model": "a"}) is None
+    assert cache.get({**REQUEST, "model": "c"}) == RESPONSE
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_agents_reuse_cached_completions(openai_stub, stream):
+    cache = CompletionCache()
+    first = UtilityAgent(check_toxicity = False, completion_cache = cache)
+    second = UtilityAgent(check_toxicity = False, completion_cache = cache)
+
+    first_messages = [m for m in first.chat("Who are you?", stream = stream) if not m.is_delta]
+    second_messages = [m for m in second.chat("Who are you?", stream = stream) if not m.is_delta]
+
+    assert openai_stub.request_counts["/v1/chat/completions"] == 2 # the function call and the reply, once
+    assert [(m.role, m.func_name, m.content) for m in second_messages] == [(m.role, m.func_name, m.content) for m in first_messages]
+    assert second_messages[-1].content == "I'm an assistant."
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_discarded_optimistic_completions_are_not_cached(start_openai_stub, asynchronous):
+    server = start_openai_stub(script = ["I'm an assistant."], flagged_terms = ["nasty"])
+    cache = CompletionCache()
+    # moderation waits for more inputs, so the completion requested alongside it is answered first
+    agent = UtilityAgent(optimistic_moderation = True, completion_cache = cache, moderation_batcher = ModerationBatcher(max_wait = 0.2))
+
+    if asynchronous:
+        async def run(message):
+            return [m async for m in agent.achat(message)]
+        flagged, passed = asyncio.run(run("Something nasty")), asyncio.run(run("Who are you?"))
+    else:
+        flagged, passed = list(agent.chat("Something nasty")), list(agent.chat("Who are you?"))
+
+    assert "inappropriate" in flagged[0].content and passed[-1].content == "I'm an assistant."
+    assert server.request_counts["/v1/chat/completions"] == 2
+    # only the reply to the message that passed moderation was cached
+    assert len(cache._entries) == 1
@@ -0,0 +1,96 @@
+from agent_smith_ai.endpoint_cache import EndpointResponseCache
+from agent_smith_ai.openapi_wrapper import APIWrapperSet
+from agent_smith_ai.utility_agent import UtilityAgent
+from benchmarks.stub_servers import StubOpenAPIServer
+import asyncio
+import httpx
+import time
+
+
+CALL = {"name": "api-get_item_1", "arguments": {"id": "HGNC:1884"}}
+
+
+def _api_set(server, cache, cache_ttl = None):
+    api_set = APIWrapperSet([], response_cache = cache)
+    api_set.add_api("api", server.spec_url, server.url, cache_ttl = cache_ttl)
+    return api_set
+
+
+def test_fresh_results_are_served_from_the_cache():
+    cache = EndpointResponseCache()
+    with StubOpenAPIServer(num_operations = 2, cache_control = "max-age=60") as server:
+        api_set = _api_set(server, cache)
+        first = api_set.call_endpoint(CALL)
+        second = api_set.call_endpoint(CALL)
+        other = api_set.call_endpoint({"name": "api-get_item_1", "arguments": {"id": "HGNC:1885"}})
+
+        assert first == second and first["status_code"] == 200
+        assert other["data"]["params"] == {"id": "HGNC:1885"}
+        assert server.request_counts["/items/1"] == 2
+        assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_stale_results_are_revalidated():
+    cache = EndpointResponseCache()
+    with StubOpenAPIServer(num_operations = 2, cache_control = "no-cache") as server:
+        api_set = _api_set(server, cache)
+        first = api_set.call_endpoint(CALL)
+        second = api_set.call_endpoint(CALL)
+        third = asyncio.run(api_set.acall_endpoint(CALL))
+
+        assert first == second == third
+        assert server.request_counts["/items/1"] == 3 # but the last two are answered 304 Not Modified
+        assert cache.revalidations == 2
+
+
+def test_no_store_and_ttl_overrides():
+    cache = EndpointResponseCache()
+    for cache_control in ["no-store", "private, max-age=60"]:
+        with StubOpenAPIServer(num_operations = 2, cache_control = cache_control) as server:
+            api_set = _api_set(server, cache, cache_ttl = 60)
+            api_set.call_endpoint(CALL)
+            api_set.call_endpoint(CALL)
+            assert server.request_counts["/items/1"] == 2
+
+    with StubOpenAPIServer(num_operations = 2, cache_control = "max-age=60") as server:
+        api_set = _api_set(server, cache, cache_ttl = 0.05)
+        api_set.call_endpoint(CALL)
+        api_set.call_endpoint(CALL)
+        time.sleep(0.1)
+        api_set.call_endpoint(CALL)
+        assert server.request_counts["/items/1"] == 2
+        assert cache.revalidations == 1
+
+
+def test_cached_results_are_copies():
+    cache = EndpointResponseCache()
+    with StubOpenAPIServer(num_operations = 2, cache_control = "max-age=60") as server:
+        api_set = _api_set(server, cache)
+        first = api_set.call_endpoint(CALL)
+        first["data"]["params"]["id"] = "modified by the caller"
+        second = api_set.call_endpoint(CALL)
+        second["data"]["params"].clear()
+
+        assert api_set.call_endpoint(CALL)["data"]["params"] == {"id": "HGNC:1884"}
+        assert server.request_counts["/items/1"] == 1
+
+
+def test_memory_is_bounded():
+    cache = EndpointResponseCache(max_bytes = 250)
+    response = httpx.Response(200, content = b"x" * 100, headers = {"Cache-Control": "max-age=60"})
+    for i in range(3):
+        cache.store(cache.key("get", f"http://api/{i}", {}, None), response, {"status_code": 200, "data": i})
+
+    assert cache.size == 200
+    assert cache.lookup(cache.key("get", "http://api/0", {}, None)) == (None, False)
+    assert cache.lookup(cache.key("get", "http://api/2", {}, None))[1]
+
+
+def test_results_are_shared_across_agents(openai_api_key):
+    with StubOpenAPIServer(num_operations = 2, cache_control = "max-age=60") as server:
+        agents = [UtilityAgent(name = f"Agent {i}", check_toxicity = False) for i in range(3)]
+        for agent in agents:
+            agent.register_api("api", server.spec_url, server.url)
+            assert agent.api_set.call_endpoint(CALL)["status_code"] == 200
+
+        assert server.request_counts["/items/1"] == 1
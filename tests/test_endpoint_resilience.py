@@ -0,0 +1,134 @@
+from agent_smith_ai.openapi_wrapper import APIWrapperSet, clear_shared_api_wrappers, get_api_health
+from agent_smith_ai.resilience import CircuitBreaker, EndpointPolicy
+from agent_smith_ai.utility_agent import UtilityAgent
+from benchmarks.stub_servers import StubOpenAPIServer
+import asyncio
+import httpx
+import time
+
+
+CALL = {"name": "api-get_item_1", "arguments": {"id": "HGNC:1884"}}
+
+
+def _api_set(server, policy):
+    api_set = APIWrapperSet([])
+    api_set.add_api("api", server.spec_url, server.url, endpoint_policy = policy)
+    return api_set
+
+
+def test_transient_failures_are_retried():
+    with StubOpenAPIServer(num_operations = 2) as server:
+        api_set = _api_set(server, EndpointPolicy(max_retries = 2, backoff = 0.01))
+        server.fail_next(2)
+
+        result = api_set.call_endpoint(CALL)
+
+        assert result["status_code"] == 200
+        assert server.request_counts["/items/1"] == 3
+        assert api_set.health()[0]["state"] == "closed" and api_set.health()[0]["failures"] == 0
+
+
+def test_retries_wait_for_retry_after():
+    with StubOpenAPIServer(num_operations = 2) as server:
+        api_set = _api_set(server, EndpointPolicy(max_retries = 1, backoff = 0.01))
+        server.fail_next(1, status = 429, headers = {"Retry-After": "0.2"})
+
+        start = time.perf_counter()
+        result = asyncio.run(api_set.acall_endpoint(CALL))
+
+        assert result["status_code"] == 200
+        assert time.perf_counter() - start >= 0.2
+
+
+def test_read_timeouts_are_retried():
+    with StubOpenAPIServer(num_operations = 2) as server:
+        api_set = _api_set(server, EndpointPolicy(max_retries = 1, backoff = 0.01, read_timeout = 0.1))
+        server.fail_next(1, status = 200, delay = 0.5)
+
+        result = api_set.call_endpoint(CALL)
+
+        assert result["status_code"] == 200 and result["data"]["item"] == 1
+        # the retry was made without waiting for the slow response
+        slow, retry = server.request_log("/items/1")
+        assert slow["finished"] is None or retry["started"] < slow["finished"]
+
+
+def test_failures_left_after_retries_are_returned():
+    with StubOpenAPIServer(num_operations = 2) as server:
+        api_set = _api_set(server, EndpointPolicy(max_retries = 1, backoff = 0.01))
+        server.fail_next(5)
+
+        result = api_set.call_endpoint(CALL)
+
+        assert result["status_code"] == 503 and "error" in result
+        assert server.request_counts["/items/1"] == 2
+        assert api_set.health()[0]["last_error"] == "HTTP 503"
+
+
+def test_non_idempotent_methods_are_only_retried_before_sending():
+    policy = EndpointPolicy(max_retries = 2)
+    request = httpx.Request("POST", "http://localhost")
+    unavailable = httpx.Response(503, request = request)
+
+    assert not policy.should_retry("post", 0, response = unavailable)
+    assert not policy.should_retry("post", 0, error = httpx.ReadTimeout("timed out", request = request))
+    assert policy.should_retry("post", 0, error = httpx.ConnectError("refused", request = request))
+    assert policy.should_retry("get", 0, response = unavailable)
+    assert not policy.should_retry("get", 2, response = unavailable)
+
+
+def test_open_circuits_fail_fast_until_a_trial_call_succeeds():
+    with StubOpenAPIServer(num_operations = 2) as server:
+        api_set = _api_set(server, EndpointPolicy(max_retries = 0, failure_threshold = 2, reset_timeout = 0.2))
+        server.fail_next(3)
+
+        assert api_set.call_endpoint(CALL)["status_code"] == 503
+        assert api_set.call_endpoint(CALL)["status_code"] == 503
+        refused = api_set.call_endpoint(CALL)
+        assert "unavailable after repeated failures" in refused["error"]
+        assert server.request_counts["/items/1"] == 2
+        assert api_set.health()[0]["state"] == "open"
+
+        # the trial call fails, so the circuit opens again
+        time.sleep(0.25)
+        assert api_set.call_endpoint(CALL)["status_code"] == 503
+        assert api_set.health()[0]["state"] == "open"
+
+        time.sleep(0.25)
+        assert api_set.call_endpoint(CALL)["status_code"] == 200
+        assert api_set.health()[0]["state"] == "closed"
+        assert any([health["base_url"] == server.url for health in get_api_health()])
+
+
+def test_half_open_circuits_allow_one_trial_call():
+    breaker = CircuitBreaker(failure_threshold = 1, reset_timeout = 0.05)
+    breaker.record_failure("HTTP 500")
+    assert breaker.state == "open" and not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.state == "half-open"
+    assert breaker.allow() and not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_agents_expose_api_health(openai_api_key):
+    with StubOpenAPIServer(num_operations = 2) as server:
+        agent = UtilityAgent()
+        agent.register_api("api", server.spec_url, server.url, endpoint_policy = EndpointPolicy(max_retries = 0))
+
+        health = agent.api_health()
+
+        assert [(entry["api"], entry["state"]) for entry in health] == [("api", "closed")]
+
+
+def test_equal_policies_share_a_wrapper(openai_api_key):
+    clear_shared_api_wrappers()
+    with StubOpenAPIServer(num_operations = 2) as server:
+        agents = [UtilityAgent() for _ in range(3)]
+        agents[0].register_api("api", server.spec_url, server.url, endpoint_policy = EndpointPolicy(max_retries = 0))
+        agents[1].register_api("api", server.spec_url, server.url, endpoint_policy = EndpointPolicy(max_retries = 0))
+        agents[2].register_api("api", server.spec_url, server.url, endpoint_policy = EndpointPolicy(max_retries = 1))
+
+        wrappers = [agent.api_set.api_wrappers[0] for agent in agents]
+        assert wrappers[0] is wrappers[1] and wrappers[2] is not wrappers[0]
@@ -0,0 +1,73 @@
+import copy
+
+import pytest
+
+from agent_smith_ai.function_registry import FunctionRegistry
+import agent_smith_ai.function_registry as function_registry
+
+
+def sing_a_song(verses: int) -> str:
+    """Sings a song.
+
+    Args:
+        verses (int): The number of verses to sing.
+
+    Returns:
+        A song (str)."""
+    return "Lalalala" * verses
+
+
+def throw_error() -> None:
+    """Throws an error for testing purposes."""
+    raise Exception("This is a test error.")
+
+
+def test_schemas_are_compiled_once(monkeypatch):
+    registry = FunctionRegistry()
+    registry.register_callable("sing_a_song", sing_a_song)
+
+    def no_recompile(fn):
+        raise AssertionError("schemas should only be compiled at registration time")
+    monkeypatch.setattr(function_registry, "_generate_schema", no_recompile)
+
+    schemas = registry.schemas
+    assert schemas[0]["parameters"]["properties"]["verses"] == {"type": "number", "description": "The number of verses to sing."}
+    assert registry.schemas is schemas
+    assert registry.fingerprint is registry.fingerprint
+
+
+def test_registration_changes_rebuild_schemas():
+    registry = FunctionRegistry()
+    registry.register_callable("sing_a_song", sing_a_song)
+    fingerprint = registry.fingerprint
+
+    registry.register_callable("throw_error", throw_error)
+    assert registry.fingerprint != fingerprint
+    assert [schema["name"] for schema in registry.schemas] == ["sing_a_song", "throw_error"]
+
+    registry.set_api_schemas([{"name": "monarch-search_entity", "description": "Search", "parameters": {"type": "object", "properties": {}}}])
+    assert [schema["name"] for schema in registry.schemas] == ["monarch-search_entity", "sing_a_song", "throw_error"]
+    assert isinstance(registry.schemas, tuple)
+
+
+def test_compiled_schemas_are_read_only():
+    registry = FunctionRegistry()
+    registry.register_callable("sing_a_song", sing_a_song)
+    registry.set_api_schemas([{"name": "monarch-search_entity", "description": "Search", "parameters": {"type": "object", "properties": {}, "required": []}}])
+    fingerprint = registry.fingerprint
+
+    with pytest.raises(TypeError):
+        registry.schemas[0]["description"] = "Something else"
+    with pytest.raises(TypeError):
+        registry.schemas[0]["parameters"]["required"].append("term")
+    with pytest.raises(TypeError):
+        registry.method_schemas[0]["parameters"]["properties"].pop("verses")
+    with pytest.raises(TypeError):
+        registry.tools[0]["function"] = {}
+    assert registry.fingerprint == fingerprint
+
+    # copies are ordinary schemas again, and equal to the frozen ones
+    schema = copy.deepcopy(registry.schemas[0])
+    schema["parameters"]["required"].append("term")
+    assert type(schema) is dict and schema != registry.schemas[0]
+    assert copy.deepcopy(registry.schemas[1]) == registry.schemas[1]
@@ -0,0 +1,120 @@
+from agent_smith_ai.utility_agent import UtilityAgent
+from agent_smith_ai.moderation import ModerationBatcher, ModerationCache
+import asyncio
+import openai
+import pytest
+
+
+LATENCY = 0.3
+
+
+@pytest.fixture
+def openai_stub(start_openai_stub):
+    return start_openai_stub(script = ["Hello! How can I help?"], latency = LATENCY, flagged_terms = ["nasty"])
+
+
+def _check_completion_overlapped_moderation(server):
+    # the completion was requested while the moderation request was still being answered, rather than after it
+    [moderation] = server.request_log("/v1/moderations")
+    [completion] = server.request_log("/v1/chat/completions")
+    assert completion["started"] < moderation["finished"]
+
+
+def test_optimistic_moderation_saves_a_round_trip(openai_stub):
+    agent = UtilityAgent(optimistic_moderation = True)
+
+    messages = list(agent.chat("Hi there"))
+
+    assert [m.content for m in messages] == ["Hello! How can I help?"]
+    assert openai_stub.request_counts["/v1/moderations"] == 1
+    _check_completion_overlapped_moderation(openai_stub)
+
+
+@pytest.mark.parametrize("optimistic", [False, True])
+def test_flagged_messages_are_never_answered(openai_stub, optimistic):
+    agent = UtilityAgent(optimistic_moderation = optimistic)
+    list(agent.chat("Hi there"))
+
+    messages = list(agent.chat("Something nasty", stream = True))
+
+    assert len(messages) == 1
+    assert messages[0].author == "System" and "inappropriate" in messages[0].content
+    # the flagged message is rolled back out of the history
+    assert [m.content for m in agent.history.messages[1:]] == ["Hi there", "Hello! How can I help?"]
+    assert openai_stub.request_counts["/v1/chat/completions"] == (2 if optimistic else 1)
+
+
+def test_optimistic_moderation_async(openai_stub):
+    agent = UtilityAgent(optimistic_moderation = True)
+
+    async def run(message):
+        return [message async for message in agent.achat(message)]
+
+    messages = asyncio.run(run("Hi there"))
+    assert [m.content for m in messages] == ["Hello! How can I help?"]
+    _check_completion_overlapped_moderation(openai_stub)
+
+    messages = asyncio.run(run("Something nasty"))
+    assert len(messages) == 1 and "inappropriate" in messages[0].content
+    assert [m.content for m in agent.history.messages[1:]] == ["Hi there", "Hello! How can I help?"]
+
+
+def test_moderation_verdicts_are_cached(openai_stub):
+    agent = UtilityAgent(auto_summarize_buffer_tokens = None)
+    list(agent.chat("What is the CFTR gene?"))
+    agent.clear_history()
+    list(agent.chat("What is the CFTR gene?"))
+
+    assert openai_stub.request_counts["/v1/moderations"] == 1
+    assert agent.moderation_batcher.cache.hits >= 1
+
+
+def test_concurrent_sessions_share_moderation_requests(openai_stub):
+    batcher = ModerationBatcher(cache = ModerationCache())
+    agents = [UtilityAgent(name = f"Agent {i}", moderation_batcher = batcher) for i in range(20)]
+
+    async def run_all():
+        return await asyncio.gather(*[_achat(agent, f"Question number {i}") for i, agent in enumerate(agents)])
+
+    results = asyncio.run(run_all())
+
+    assert all([[m.content for m in messages] == ["Hello! How can I help?"] for messages in results])
+    # the first request may go out alone, but the other inputs arrive while it is in flight
+    assert batcher.requests_sent == openai_stub.request_counts["/v1/moderations"] <= 2
+
+
+def test_summarizer_skips_moderation(openai_stub):
+    agent = UtilityAgent(auto_summarize_buffer_tokens = 4090)
+    agent.summarize_quietly = True
+    list(agent.chat("Hi there"))
+
+    assert openai_stub.request_counts["/v1/moderations"] == 1
+    assert openai_stub.request_counts["/v1/chat/completions"] == 2  # the summary, then the reply
+
+
+class _ScriptedModeration:
+    """Stands in for a request scheduler, answering moderation requests with the given responses in turn."""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+
+    def call(self, func, **kwargs):
+        return self.responses.pop(0)
+
+
+def test_malformed_moderation_responses_fail_their_batch_only():
+    verdict = {"flagged": False, "categories": {}, "category_scores": {}}
+    batcher = ModerationBatcher(request_scheduler = _ScriptedModeration([{}, {"results": []}, {"results": [verdict]}]))
+
+    with pytest.raises(openai.error.APIError):
+        batcher.moderate("Hi there")
+    with pytest.raises(openai.error.APIError):
+        asyncio.run(batcher.amoderate("Hi there"))
+
+    # the worker carries on with later requests
+    assert batcher.moderate("Hi there") == verdict
+    assert batcher.cache.get("Hi there") == verdict
+
+
+async def _achat(agent, message):
+    return [message async for message in agent.achat(message)]
@@ -0,0 +1,85 @@
+from agent_smith_ai.openapi_wrapper import APIWrapperSet, clear_shared_api_wrappers
+from agent_smith_ai import openapi_wrapper
+from agent_smith_ai import spec_cache
+from agent_smith_ai.utility_agent import UtilityAgent
+from agent_smith_ai.http_client import HTTPClientPool
+from benchmarks.stub_servers import StubOpenAPIServer
+import concurrent.futures
+import pytest
+
+
+@pytest.fixture(scope = "module")
+def stub_api():
+    with StubOpenAPIServer(num_operations = 5) as server:
+        yield server
+
+
+def test_dispatch_index(stub_api):
+    api_set = APIWrapperSet([])
+    api_set.add_api("first", stub_api.spec_url, stub_api.url)
+    api_set.add_api("second", stub_api.spec_url, stub_api.url, callable_endpoints = ["get_item_3"])
+
+    assert len(api_set.get_function_names()) == 6
+    assert api_set.has_function("first-get_item_0")
+    assert api_set.has_function("second-get_item_3")
+    assert not api_set.has_function("second-get_item_0")
+
+    result = api_set.call_endpoint({"name": "second-get_item_3", "arguments": {"id": "HGNC:1884", "limit": 2}})
+    assert result["status_code"] == 200
+    assert result["data"] == {"item": 3, "method": "GET", "params": {"id": "HGNC:1884", "limit": "2"}}
+
+    result = api_set.call_endpoint({"name": "second-get_item_0", "arguments": {"id": "HGNC:1884"}})
+    assert result["status_code"] == 400
+
+
+def test_client_pool_shares_clients_per_base_url(stub_api):
+    pool = HTTPClientPool()
+    first = APIWrapperSet([], client_pool = pool)
+    second = APIWrapperSet([], client_pool = pool)
+    first.add_api("first", stub_api.spec_url, stub_api.url)
+    second.add_api("second", stub_api.spec_url, stub_api.url)
+
+    assert first.call_endpoint({"name": "first-get_item_1", "arguments": {"id": "a"}})["status_code"] == 200
+    assert second.call_endpoint({"name": "second-get_item_1", "arguments": {"id": "b"}})["status_code"] == 200
+    assert pool.get_client(stub_api.url) is pool.get_client(stub_api.url)
+    assert len(pool._clients) == 1
+
+    client = pool.get_client(stub_api.url)
+    pool.configure_host(stub_api.url, max_connections = 2)
+    assert pool.get_client(stub_api.url) is not client
+    assert client.is_closed
+
+    with pytest.raises(ValueError):
+        pool.configure_host(stub_api.url, max_conections = 2)
+    pool.close()
+
+
+def test_agents_share_one_parsed_spec(stub_api, openai_api_key):
+    clear_shared_api_wrappers()
+    stub_api.reset_counts()
+
+    agents = [UtilityAgent() for _ in range(10)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers = 10) as executor:
+        list(executor.map(lambda agent: agent.register_api("shared", stub_api.spec_url, stub_api.url, callable_endpoints = ["get_item_0", "get_item_1"]), agents))
+
+    assert stub_api.request_counts["/openapi.json"] == 1
+    assert openapi_wrapper._shared_wrapper_locks == {} # the build locks don't outlive the builds
+    wrappers = set([id(agent.api_set.api_wrappers[0]) for agent in agents])
+    assert len(wrappers) == 1
+    assert agents[0].function_registry.schemas[0] is agents[-1].function_registry.schemas[0]
+
+    # a different endpoint selection is a different wrapper
+    agents[0].register_api("shared", stub_api.spec_url, stub_api.url, callable_endpoints = ["get_item_2"])
+    assert agents[0].api_set.api_wrappers[1] is not agents[0].api_set.api_wrappers[0]
+
+
+def test_agents_survive_unavailable_specs(openai_api_key, tmp_path):
+    # no cached copy of the spec, and offline, so it can't be fetched (the isolated_spec_cache fixture restores the default)
+    spec_cache.set_default_spec_cache(spec_cache.SpecCache(cache_dir = str(tmp_path), offline = True))
+
+    agent = UtilityAgent()
+    agent.register_api("missing", "http://127.0.0.1:9/openapi.json", "http://127.0.0.1:9")
+
+    assert agent.api_set.get_function_schemas() == []
+    assert not agent.function_registry.has_function("missing-get_item_0")
+    assert [schema["name"] for schema in agent.function_registry.schemas] == ["time", "help"]
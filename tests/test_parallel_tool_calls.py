@@ -0,0 +1,71 @@
+from agent_smith_ai.utility_agent import UtilityAgent
+from benchmarks.stub_servers import StubOpenAPIServer
+import asyncio
+import json
+import pytest
+
+
+LATENCY = 0.4
+
+SCRIPT = [[{"name": "api-get_item_0", "arguments": {"id": "HGNC:1100"}},
+           {"name": "api-get_item_1", "arguments": {"id": "HGNC:1100"}},
+           {"name": "api-get_item_2", "arguments": {"id": "HGNC:1100"}},
+           {"name": "time", "arguments": {}}],
+          "Done."]
+
+
+@pytest.fixture
+def servers(start_openai_stub):
+    openai_server = start_openai_stub(SCRIPT)
+    with StubOpenAPIServer(num_operations = 3, latency = LATENCY) as api:
+        yield openai_server, api
+
+
+def _agent(api):
+    agent = UtilityAgent(check_toxicity = False, parallel_tool_calls = True)
+    agent.register_api("api", api.spec_url, api.url)
+    return agent
+
+
+def _check_turn(agent, messages):
+    assert [(m.is_function_call, m.func_name) for m in messages] == [(True, "api-get_item_0"), (True, "api-get_item_1"), (True, "api-get_item_2"), (True, "time"),
+                                                                     (False, "api-get_item_0"), (False, "api-get_item_1"), (False, "api-get_item_2"), (False, "time"),
+                                                                     (False, None)]
+    assert [json.loads(m.content)["item"] for m in messages[4:7]] == [0, 1, 2]
+    assert [m.tool_call_id for m in messages[4:8]] == [m.tool_call_id for m in messages[0:4]]
+
+    # the calls go back to the model as one assistant message, followed by one tool message per call
+    wire = agent._reserialize_history()
+    assert [m["role"] for m in wire] == ["system", "user", "assistant", "tool", "tool", "tool", "tool", "assistant"]
+    assert [call["id"] for call in wire[2]["tool_calls"]] == [m["tool_call_id"] for m in wire[3:7]]
+
+
+def _check_lookups_overlapped(api):
+    # three lookups at the cost of about one: each was requested before any was answered
+    lookups = [entry for entry in api.request_log() if entry["path"].startswith("/items/")]
+    assert len(lookups) == 3
+    assert max([lookup["started"] for lookup in lookups]) < min([lookup["finished"] for lookup in lookups])
+
+
+def test_parallel_tool_calls(servers):
+    openai_server, api = servers
+    agent = _agent(api)
+
+    messages = list(agent.chat("Tell me about HGNC:1100"))
+
+    _check_turn(agent, messages)
+    assert openai_server.request_counts["/v1/chat/completions"] == 2
+    _check_lookups_overlapped(api)
+
+
+def test_parallel_tool_calls_async(servers):
+    openai_server, api = servers
+    agent = _agent(api)
+
+    async def run():
+        return [message async for message in agent.achat("Tell me about HGNC:1100")]
+
+    messages = asyncio.run(run())
+
+    _check_turn(agent, messages)
+    _check_lookups_overlapped(api)
@@ -0,0 +1,155 @@
+from agent_smith_ai.utility_agent import UtilityAgent
+from agent_smith_ai.moderation import ModerationBatcher
+from agent_smith_ai.rate_limits import RequestScheduler, retry_delay
+import asyncio
+import openai
+import pytest
+import threading
+import time
+
+
+@pytest.fixture
+def openai_stub(start_openai_stub):
+    return start_openai_stub(script = ["Hello! How can I help?"])
+
+
+def test_refused_completions_are_retried_after_retry_after(openai_stub):
+    scheduler = RequestScheduler()
+    agent = UtilityAgent(check_toxicity = False, request_scheduler = scheduler)
+    openai_stub.refuse_next(2, headers = {"retry-after-ms": "100"})
+
+    start = time.perf_counter()
+    messages = list(agent.chat("Hi there"))
+    elapsed = time.perf_counter() - start
+
+    assert [m.content for m in messages] == ["Hello! How can I help?"]
+    assert openai_stub.refused == 2 and scheduler.retries == 2
+    assert elapsed >= 0.2
+
+
+def test_refusals_beyond_max_retries_end_the_turn(openai_stub):
+    agent = UtilityAgent(check_toxicity = False, request_scheduler = RequestScheduler(max_retries = 1, backoff = 0.01))
+    openai_stub.refuse_next(5)
+
+    messages = list(agent.chat("Hi there"))
+
+    assert len(messages) == 1 and messages[0].author == "System"
+    assert openai_stub.refused == 2
+
+
+def test_refused_completions_are_retried_async(openai_stub):
+    scheduler = RequestScheduler()
+    agent = UtilityAgent(check_toxicity = False, request_scheduler = scheduler)
+    openai_stub.refuse_next(1, headers = {"x-ratelimit-reset-requests": "150ms", "x-ratelimit-remaining-requests": "0"})
+
+    async def run():
+        return [message async for message in agent.achat("Hi there", stream = True)]
+
+    start = time.perf_counter()
+    messages = asyncio.run(run())
+    elapsed = time.perf_counter() - start
+
+    assert messages[-1].content == "Hello! How can I help?"
+    assert openai_stub.refused == 1
+    assert elapsed >= 0.15
+
+
+def test_moderation_requests_are_retried(openai_stub):
+    batcher = ModerationBatcher(request_scheduler = RequestScheduler(backoff = 0.01))
+    openai_stub.refuse_next(1)
+
+    assert batcher.moderate("Hi there")["flagged"] == False
+    assert openai_stub.refused == 1
+
+
+def test_exhausted_quota_is_not_retried():
+    scheduler = RequestScheduler(backoff = 0.01)
+    calls = []
+
+    def refuse():
+        calls.append(1)
+        raise openai.error.RateLimitError("You exceeded your current quota", code = "insufficient_quota")
+
+    with pytest.raises(openai.error.RateLimitError):
+        scheduler.call(refuse)
+    assert len(calls) == 1
+
+
+def test_retry_delay_headers():
+    assert retry_delay({"Retry-After-Ms": "250"}) == 0.25
+    assert retry_delay({"retry-after": "2"}) == 2.0
+    assert retry_delay({"x-ratelimit-reset-requests": "1s", "x-ratelimit-reset-tokens": "6m0s"}) == 360.0
+    assert retry_delay({"x-ratelimit-reset-tokens": "20ms"}) == pytest.approx(0.02)
+    assert retry_delay({"x-ratelimit-reset-tokens": "soon"}) is None
+    assert retry_delay({}) is None
+
+
+def test_requests_are_limited_per_minute():
+    scheduler = RequestScheduler(requests_per_minute = 600)
+    scheduler.requests.consume(600)
+
+    start = time.perf_counter()
+    for _ in range(3):
+        scheduler.call(lambda: None)
+    elapsed = time.perf_counter() - start
+
+    # 10 requests per second
+    assert elapsed >= 0.28
+
+
+def test_reserved_tokens_are_reconciled_with_usage():
+    scheduler = RequestScheduler(tokens_per_minute = 10000)
+
+    scheduler.call(lambda: {"usage": {"total_tokens": 500}}, estimated_tokens = 100)
+
+    assert scheduler.tokens.tokens == pytest.approx(9500, abs = 5)
+
+
+def test_failed_requests_give_back_their_reservation():
+    scheduler = RequestScheduler(tokens_per_minute = 10000, backoff = 0.01)
+
+    def fail():
+        raise openai.error.InvalidRequestError("This model's maximum context length is 4097 tokens", param = "messages")
+
+    async def afail():
+        fail()
+
+    with pytest.raises(openai.error.InvalidRequestError):
+        scheduler.call(fail, estimated_tokens = 3000)
+    with pytest.raises(openai.error.InvalidRequestError):
+        asyncio.run(scheduler.acall(afail, estimated_tokens = 3000))
+    assert scheduler.tokens.tokens == pytest.approx(10000, abs = 5)
+
+
+def test_sessions_are_served_round_robin():
+    scheduler = RequestScheduler(requests_per_minute = 300)
+    scheduler.requests.consume(300)
+    order = []
+
+    def request(session):
+        scheduler.call(lambda: order.append(session), session = session)
+
+    threads = []
+    for session in ["busy"] * 4 + ["quiet"] * 2:
+        threads.append(threading.Thread(target = request, args = (session,)))
+        threads[-1].start()
+        time.sleep(0.01)
+    for thread in threads:
+        thread.join()
+
+    assert order == ["busy", "quiet", "busy", "quiet", "busy", "busy"]
+
+
+def test_cancelled_requests_leave_the_queue():
+    scheduler = RequestScheduler()
+    scheduler.pause(10)
+
+    async def run():
+        task = asyncio.ensure_future(scheduler.acall(asyncio.sleep, 0))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    assert len(scheduler._sessions) == 0
@@ -0,0 +1,63 @@
+from agent_smith_ai.result_compaction import ResultCompactor
+from agent_smith_ai.utility_agent import UtilityAgent
+from agent_smith_ai import tokenizer
+from benchmarks.stub_servers import StubOpenAPIServer
+import copy
+import json
+
+
+ASSOCIATIONS = {"total": 50, "items": [{"id": f"assoc:{i}", "subject": {"id": "HGNC:1884", "name": "CFTR", "category": "Gene"},
+                                        "object": {"id": f"MONDO:{i}", "name": f"disease {i}"}, "evidence_count": i}
+                                       for i in range(50)]}
+
+
+def test_projection_and_row_limits():
+    original = copy.deepcopy(ASSOCIATIONS)
+    compacted = ResultCompactor(fields = ["id", "object.name"], max_rows = 2).compact(ASSOCIATIONS)
+
+    assert compacted == '{"total":50,"items":[{"id":"assoc:0","object":{"name":"disease 0"}},{"id":"assoc:1","object":{"name":"disease 1"}},"truncated 2 of 50"]}'
+    assert ASSOCIATIONS == original # the data isn't modified
+
+    rows = ResultCompactor(fields = ["id"]).compact(ASSOCIATIONS["items"][:2])
+    assert json.loads(rows) == [{"id": "assoc:0"}, {"id": "assoc:1"}]
+
+
+def test_token_budget():
+    compacted = ResultCompactor(max_tokens = 200).compact(ASSOCIATIONS)
+    assert tokenizer.count_tokens(compacted) <= 200
+    data = json.loads(compacted)
+    assert len(data["items"]) > 1 and data["items"][-1] == f"truncated {len(data['items']) - 1} of 50"
+
+    truncated = ResultCompactor(max_tokens = 20).compact({"text": "gene " * 100})
+    assert tokenizer.count_tokens(truncated) <= 20 and truncated.endswith("[truncated]")
+
+
+def test_compactors_are_configured_per_api_and_endpoint(openai_api_key):
+    with StubOpenAPIServer(num_operations = 2, cache_control = "max-age=60") as server:
+        agent = UtilityAgent(check_toxicity = False)
+        agent.register_api("first", server.spec_url, server.url)
+        agent.register_api("second", server.spec_url, server.url, result_compactor = ResultCompactor(fields = ["item"]))
+        agent.register_api("third", server.spec_url, server.url, result_compactor = {"get_item_1": ResultCompactor(fields = ["params.id"])})
+
+        def content(func_name):
+            return agent._api_result_message(func_name, agent.api_set.call_endpoint({"name": func_name, "arguments": {"id": "a"}})).content
+
+        assert content("first-get_item_1") == '{"item":1,"method":"GET","params":{"id":"a"}}'
+        assert content("second-get_item_1") == '{"item":1}'
+        assert content("third-get_item_1") == '{"params":{"id":"a"}}'
+        assert content("third-get_item_0") == '{"item":0,"method":"GET","params":{"id":"a"}}'
+        # the cached results shared by the APIs are left whole
+        assert content("first-get_item_1") == '{"item":1,"method":"GET","params":{"id":"a"}}'
+        assert server.request_counts["/items/1"] == 1
+
+
+def test_compactors_of_hyphenated_api_names(openai_api_key):
+    with StubOpenAPIServer(num_operations = 2, cache_control = "max-age=60") as server:
+        agent = UtilityAgent(check_toxicity = False)
+        agent.register_api("my", server.spec_url, server.url)
+        agent.register_api("my-api", server.spec_url, server.url, result_compactor = ResultCompactor(fields = ["item"]))
+
+        result = agent.api_set.call_endpoint({"name": "my-api-get_item_1", "arguments": {"id": "a"}})
+        assert agent._api_result_message("my-api-get_item_1", result).content == '{"item":1}'
+        result = agent.api_set.call_endpoint({"name": "my-get_item_1", "arguments": {"id": "a"}})
+        assert agent._api_result_message("my-get_item_1", result).content == '{"item":1,"method":"GET","params":{"id":"a"}}'
@@ -0,0 +1,43 @@
+from agent_smith_ai.spec_cache import SpecCache, SpecUnavailableError
+from agent_smith_ai.openapi_wrapper import APIWrapper
+from benchmarks.stub_servers import StubOpenAPIServer
+import pytest
+import time
+
+
+def test_spec_is_persisted_and_revalidated(tmp_path):
+    with StubOpenAPIServer(num_operations = 3) as server:
+        spec = SpecCache(cache_dir = str(tmp_path)).get(server.spec_url)
+        assert len(spec["paths"]) == 3
+
+        # a fresh cache (as in a new process) within revalidate_after serves from disk without any request
+        server.reset_counts()
+        assert SpecCache(cache_dir = str(tmp_path)).get(server.spec_url) == spec
+        assert server.total_requests() == 0
+
+        # once stale, it revalidates with a conditional GET
+        cache = SpecCache(cache_dir = str(tmp_path), revalidate_after = 0, stale_while_revalidate = False)
+        assert cache.get(server.spec_url) == spec
+        assert server.total_requests() == 1
+
+        # or serves the cached copy immediately while revalidating in the background
+        cache = SpecCache(cache_dir = str(tmp_path), revalidate_after = 0)
+        assert cache.get(server.spec_url) == spec
+        deadline = time.time() + 5
+        while server.total_requests() < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        assert server.total_requests() == 2
+
+
+def test_offline_mode(tmp_path):
+    with StubOpenAPIServer(num_operations = 3) as server:
+        spec_url, base_url = server.spec_url, server.url
+        SpecCache(cache_dir = str(tmp_path)).get(spec_url)
+
+    offline = SpecCache(cache_dir = str(tmp_path), revalidate_after = 0, offline = True)
+    wrapper = APIWrapper("stub", spec_url, base_url, spec_cache = offline)
+    assert [ep["name"] for ep in wrapper.endpoints] == ["stub-get_item_0", "stub-get_item_1", "stub-get_item_2"]
+
+    with pytest.raises(SpecUnavailableError):
+        offline.get(spec_url + "?other")
+    assert "error" in APIWrapper("stub", spec_url + "?other", base_url, spec_cache = offline).endpoints
@@ -0,0 +1,63 @@
+from agent_smith_ai.utility_agent import UtilityAgent
+import asyncio
+import time
+
+
+def test_stream_yields_deltas_then_complete_message(start_openai_stub):
+    start_openai_stub([{"name": "time", "arguments": {}}, "The time is shown above."])
+    agent = UtilityAgent(check_toxicity = False)
+
+    messages = list(agent.chat("What time is it?", stream = True))
+    deltas = [m for m in messages if m.is_delta]
+    complete = [m for m in messages if not m.is_delta]
+
+    assert "".join([m.content for m in deltas]) == "The time is shown above."
+    assert len(deltas) == 5
+    assert [(m.role, m.func_name) for m in complete] == [("assistant", "time"), ("function", "time"), ("assistant", None)]
+    assert complete[-1].content == "The time is shown above."
+    assert messages[-1] is complete[-1]
+
+    # deltas are not added to the history
+    assert [m.role for m in agent.history.messages] == ["system", "user", "assistant", "function", "assistant"]
+    assert not any([m.is_delta for m in agent.history.messages])
+
+
+def test_stream_achat(start_openai_stub):
+    start_openai_stub(["Hello! How can I help?"])
+    agent = UtilityAgent(check_toxicity = False)
+
+    async def run():
+        return [message async for message in agent.achat("Hi", stream = True)]
+
+    messages = asyncio.run(run())
+    assert "".join([m.content for m in messages if m.is_delta]) == "Hello! How can I help?"
+    assert messages[-1].content == "Hello! How can I help?" and not messages[-1].is_delta
+    assert agent.history.messages[-1].content == "Hello! How can I help?"
+
+
+def test_stream_dispatches_completed_tool_calls_early(start_openai_stub):
+    start_openai_stub([[{"name": "lookup", "arguments": {"query": "BRCA1"}},
+                  {"name": "lookup", "arguments": {"query": "a much longer query string that takes a while to stream"}}],
+                 "Done."],
+                chunk_latency = 0.02)
+    called_at = {}
+
+    def lookup(query: str) -> str:
+        """Look up a gene.
+
+        Args:
+            query: The query."""
+        called_at[query] = time.perf_counter()
+        return query
+
+    agent = UtilityAgent(check_toxicity = False, parallel_tool_calls = True)
+    agent.register_callable_functions({"lookup": lookup})
+
+    calls_yielded_at = None
+    for message in agent.chat("Look up BRCA1", stream = True):
+        if message.is_function_call and calls_yielded_at is None:
+            calls_yielded_at = time.perf_counter()
+
+    # the first call started while the second call's arguments were still streaming in
+    assert called_at["BRCA1"] < calls_yielded_at
+    assert [m.content for m in agent.history.messages[-3:-1]] == ['"BRCA1"', '"a much longer query string that takes a while to stream"']
@@ -0,0 +1,70 @@
+from agent_smith_ai.token_bucket import SQLiteBucketStore, TokenBucket, TokenBucketManager
+import asyncio
+import concurrent.futures
+import multiprocessing
+import pytest
+import time
+
+
+def test_consume_is_atomic_across_threads():
+    bucket = TokenBucket(tokens = 500, refill_rate = 0)
+
+    def consume_all():
+        return sum([bucket.consume(1) for _ in range(100)])
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers = 8) as executor:
+        granted = sum(executor.map(lambda _: consume_all(), range(8)))
+
+    assert granted == 500
+    assert not bucket.consume(1)
+
+
+def test_acquire_waits_for_tokens():
+    bucket = TokenBucket(tokens = 1, refill_rate = 20)
+    assert bucket.acquire(1)
+
+    start = time.monotonic()
+    assert bucket.acquire(1)
+    assert 0.03 < time.monotonic() - start < 0.5
+
+    assert not bucket.acquire(1, timeout = 0.01)
+    assert not bucket.acquire(2) # more than the bucket can ever hold
+    assert asyncio.run(bucket.aacquire(1, timeout = 1))
+    assert TokenBucket(tokens = None, refill_rate = 0).acquire(10 ** 9)
+
+
+def test_manager_reports_time_until_available():
+    manager = TokenBucketManager()
+    manager.create_bucket("user:alice", tokens = 10, refill_rate = 5)
+    assert manager.consume("user:alice", 10)
+
+    assert 1.5 < manager.time_until_tokens_available("user:alice", 10) <= 2
+    assert manager.time_until_tokens_available("user:bob", 10) is None
+    assert manager.get_or_create_bucket("user:alice", tokens = 99, refill_rate = 1) is manager.get_bucket("user:alice")
+
+
+@pytest.mark.parametrize("in_store", [False, True])
+def test_adjust_can_leave_the_bucket_in_debt(tmp_path, in_store):
+    store = SQLiteBucketStore(str(tmp_path / "buckets.sqlite")) if in_store else None
+    bucket = TokenBucket(tokens = 10, refill_rate = 0, store = store, key = "user:alice" if in_store else None)
+
+    bucket.adjust(15)
+    assert not bucket.consume(1)
+    assert bucket.time_until_tokens_available(1) == float("inf")
+
+    bucket.adjust(-100)
+    assert bucket.consume(10) and not bucket.consume(1)
+
+
+def _consume_from_store(path):
+    bucket = TokenBucketManager(store = SQLiteBucketStore(path)).get_or_create_bucket("user:alice", tokens = 20, refill_rate = 0)
+    return sum([bucket.consume(1) for _ in range(10)])
+
+
+def test_processes_share_a_budget_through_the_store(tmp_path):
+    path = str(tmp_path / "buckets.sqlite")
+    with multiprocessing.get_context("spawn").Pool(4) as pool:
+        granted = pool.map(_consume_from_store, [path] * 4)
+
+    assert sum(granted) == 20
+    assert not TokenBucket(tokens = 20, refill_rate = 0, store = SQLiteBucketStore(path), key = "user:alice").consume(1)
@@ -0,0 +1,169 @@
+from agent_smith_ai.utility_agent import UtilityAgent
+from agent_smith_ai import tokenizer
+from agent_smith_ai.models import Chat, Message
+import openai
+import pytest
+
+# usage.prompt_tokens as reported by the ChatCompletion API (gpt-3.5-turbo-0613) for the given requests
+RECORDED_USAGE = [
+    {"messages": [{"role": "user", "content": "hello"}],
+     "functions": [],
+     "prompt_tokens": 8},
+    {"messages": [{"role": "user", "content": "hello world"}],
+     "functions": [],
+     "prompt_tokens": 9},
+    {"messages": [{"role": "system", "content": "hello"}],
+     "functions": [],
+     "prompt_tokens": 8},
+    {"messages": [{"role": "system", "content": "hello:"}],
+     "functions": [],
+     "prompt_tokens": 9},
+    {"messages": [{"role": "system", "content": "# Important: you're the best robot"}, {"role": "user", "content": "hello robot"}, {"role": "assistant", "content": "hello world"}],
+     "functions": [],
+     "prompt_tokens": 27},
+    {"messages": [{"role": "user", "content": "hello"}],
+     "functions": [{"name": "foo", "parameters": {"type": "object", "properties": {}}}],
+     "prompt_tokens": 31},
+    {"messages": [{"role": "user", "content": "hello"}],
+     "functions": [{"name": "foo", "description": "Do a foo", "parameters": {"type": "object", "properties": {}}}],
+     "prompt_tokens": 36},
+    {"messages": [{"role": "user", "content": "hello"}],
+     "functions": [{"name": "bing_bong", "description": "Do a bing bong", "parameters": {"type": "object", "properties": {"foo": {"type": "string"}}}}],
+     "prompt_tokens": 49},
+    {"messages": [{"role": "user", "content": "hello"}],
+     "functions": [{"name": "bing_bong", "description": "Do a bing bong", "parameters": {"type": "object", "properties": {"foo": {"type": "string"}, "bar": {"type": "number", "description": "A number"}}}}],
+     "prompt_tokens": 57},
+    {"messages": [{"role": "user", "content": "hello"}],
+     "functions": [{"name": "bing_bong", "description": "Do a bing bong", "parameters": {"type": "object", "properties": {"foo": {"type": "object", "properties": {"bar": {"type": "string", "enum": ["a", "b", "c"]}, "baz": {"type": "boolean"}}}}}}],
+     "prompt_tokens": 68},
+    {"messages": [{"role": "system", "content": "Hello"}, {"role": "user", "content": "Hi there"}],
+     "functions": [{"name": "do_stuff", "parameters": {"type": "object", "properties": {}}}],
+     "prompt_tokens": 35},
+    {"messages": [{"role": "system", "content": "Hello:"}, {"role": "user", "content": "Hi there"}],
+     "functions": [{"name": "do_stuff", "parameters": {"type": "object", "properties": {}}}],
+     "prompt_tokens": 35},
+]
+
+
+@pytest.mark.parametrize("recorded", RECORDED_USAGE)
+def test_prompt_tokens_match_recorded_usage(recorded):
+    assert tokenizer.count_prompt(recorded["messages"], recorded["functions"]) == recorded["prompt_tokens"]
+
+
+def test_count_many_matches_individual_counts():
+    messages = [record["messages"][-1] for record in RECORDED_USAGE]
+    texts = ["hello world", "", "<|endoftext|> is counted as plain text"]
+
+    assert tokenizer.count_many(messages + texts) == [tokenizer.count_message(m) for m in messages] + [tokenizer.count_tokens(t) for t in texts]
+
+
+def test_truncate():
+    text = "The CFTR gene encodes a chloride channel. " * 10
+    assert tokenizer.truncate(text, 1000) == text
+    assert tokenizer.count_tokens(tokenizer.truncate(text, 12)) == 12
+    assert text.startswith(tokenizer.truncate(text, 12))
+
+
+def test_unversioned_models_resolve_silently(capsys):
+    messages = RECORDED_USAGE[0]["messages"]
+
+    assert tokenizer.count_messages(messages, model = "gpt-3.5-turbo") == tokenizer.count_messages(messages, model = "gpt-3.5-turbo-0613")
+    assert tokenizer.get_encoding("gpt-4") is tokenizer.get_encoding("gpt-4")
+    assert capsys.readouterr().out == ""
+
+
+def test_format_function_definitions():
+    functions = [{"name": "get_weather",
+                  "description": "Get the weather",
+                  "parameters": {"type": "object",
+                                 "properties": {"city": {"type": "string", "description": "The city"},
+                                                "days": {"type": "array", "items": {"type": "number"}}},
+                                 "required": ["city"]}}]
+
+    assert tokenizer.format_function_definitions(functions) == "\n".join([
+        "namespace functions {",
+        "",
+        "// Get the weather",
+        "type get_weather = (_: {",
+        "// The city",
+        "city: string,",
+        "days?: number[],",
+        "}) => any;",
+        "",
+        "} // namespace functions"])
+
+
+def test_function_schema_tokens_are_counted_locally(monkeypatch, openai_api_key):
+
+    def no_network(*args, **kwargs):
+        raise AssertionError("function schema tokens should not require a completion request")
+    monkeypatch.setattr(openai.ChatCompletion, "create", no_network)
+
+    agent = UtilityAgent()
+    base_tokens = agent._count_function_schema_tokens()
+    assert base_tokens > 0
+    assert agent.compute_token_cost("hi") > base_tokens
+
+    # the schemas cost what they add to a prompt starting with the agent's system message
+    prompt = [{"role": "system", "content": agent.system_message}, {"role": "user", "content": "hi"}]
+    schemas = list(agent.function_registry.schemas)
+    assert base_tokens == tokenizer.count_prompt(prompt, schemas, model = agent.model) - tokenizer.count_prompt(prompt, model = agent.model)
+
+    def sing_a_song() -> str:
+        """Sings a song."""
+        return "Lalalala"
+
+    # registering a new function invalidates the cached count
+    agent.register_callable_functions({"sing_a_song": sing_a_song})
+    assert agent.function_schema_tokens is None
+    assert agent._count_function_schema_tokens() > base_tokens
+
+
+def test_history_token_total_tracks_appends_and_resets(openai_api_key):
+    agent = UtilityAgent()
+    agent.history = Chat()
+
+    def full_recount():
+        return tokenizer.count_messages(agent._reserialize_history(), model = agent.model)
+
+    agent._append_to_history(Message(role = "system", content = agent.system_message))
+    agent._append_to_history(Message(role = "user", content = "What genes are associated with Cystic Fibrosis?"))
+    agent._append_to_history(Message(role = "assistant", is_function_call = True, func_name = "search_entity", func_arguments = {"term": "Cystic Fibrosis"}))
+    agent._append_to_history(Message(role = "function", func_name = "search_entity", content = '{"id": "MONDO:0009061"}'))
+    assert agent._count_history_tokens() == full_recount()
+
+    agent.history.reset(agent.history.messages[:2])
+    assert agent._count_history_tokens() == full_recount()
+
+    agent.clear_history()
+    assert agent._count_history_tokens() == tokenizer.count_messages([], model = agent.model)
+
+
+def test_wire_format_is_kept_as_messages_are_appended():
+    chat = Chat(messages = [Message(role = "system", content = "You are a helpful assistant.")])
+    wire = chat.wire_format
+    chat.append(Message(role = "user", content = "Compare CFTR and BRCA1."))
+    chat.append(Message(role = "assistant", is_function_call = True, func_name = "search", func_arguments = {"term": "CFTR"}, tool_call_id = "call_0"))
+    chat.append(Message(role = "assistant", is_function_call = True, func_name = "search", func_arguments = {"term": "BRCA1"}, tool_call_id = "call_1"))
+    chat.append(Message(role = "function", func_name = "search", content = "{}", tool_call_id = "call_0"))
+
+    assert chat.wire_format is wire # appended to, not rebuilt
+    assert [m["role"] for m in wire] == ["system", "user", "assistant", "tool"]
+    assert [call["id"] for call in wire[2]["tool_calls"]] == ["call_0", "call_1"]
+    assert Chat(messages = chat.messages).wire_format == wire
+
+    chat.reset(chat.messages[:2])
+    assert chat.wire_format == wire[:2] and len(wire) == 4 # the old list is left alone
+
+
+def test_reserialized_history_is_a_snapshot(openai_api_key):
+    agent = UtilityAgent()
+    agent.history = Chat()
+    agent._append_to_history(Message(role = "system", content = agent.system_message))
+    wire = agent._reserialize_history()
+
+    # a request built from the history isn't changed by messages appended (e.g. by a tool step) while it is made
+    agent._append_to_history(Message(role = "user", content = "What genes are associated with Cystic Fibrosis?"))
+    assert len(wire) == 1
+    wire.append({"role": "user", "content": "Injected"})
+    assert [m["role"] for m in agent._reserialize_history()] == ["system", "user"]
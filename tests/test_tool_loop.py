@@ -0,0 +1,67 @@
+from agent_smith_ai.utility_agent import UtilityAgent
+import asyncio
+import pytest
+import sys
+import time
+
+
+@pytest.fixture
+def looping_stub(start_openai_stub):
+    # a model that never stops calling functions
+    return start_openai_stub(script = [{"name": "time", "arguments": {}}])
+
+
+def _chat(agent, message, asynchronous, stream = False):
+    if asynchronous:
+        async def run():
+            return [m async for m in agent.achat(message, stream = stream)]
+        return asyncio.run(run())
+    return [m for m in agent.chat(message, stream = stream) if not m.is_delta]
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_max_steps_ends_the_turn(looping_stub, asynchronous):
+    agent = UtilityAgent(check_toxicity = False, max_steps = 3)
+    messages = _chat(agent, "What time is it?", asynchronous)
+
+    assert len([m for m in messages if m.is_function_call]) == 3
+    assert messages[-1].author == "System" and "3 rounds of function calls" in messages[-1].content
+    assert looping_stub.request_counts["/v1/chat/completions"] == 3
+    assert [step["functions"] for step in agent.last_turn_steps] == [["time"]] * 3
+    assert all([step["model_seconds"] >= 0 and step["function_seconds"] >= 0 for step in agent.last_turn_steps])
+
+
+def test_long_loops_do_not_recurse(looping_stub):
+    agent = UtilityAgent(check_toxicity = False, auto_summarize_buffer_tokens = None, max_steps = sys.getrecursionlimit() // 10)
+    depth = []
+    agent.register_callable_functions({"time": lambda: depth.append(len(_stack())) or "now"})
+
+    messages = _chat(agent, "What time is it?", asynchronous = False, stream = True)
+
+    assert messages[-1].author == "System"
+    assert len(agent.last_turn_steps) == agent.max_steps
+    assert max(depth) == min(depth) # the stack doesn't grow with the steps
+
+
+def test_wall_time_and_token_budgets(looping_stub, monkeypatch):
+    # a clock that only moves when the function is called, so the number of steps doesn't depend on the machine's speed
+    clock = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: clock[0])
+    agent = UtilityAgent(check_toxicity = False, max_steps = None, max_wall_time = 2.5)
+    agent.register_callable_functions({"time": lambda: clock.__setitem__(0, clock[0] + 1.0) or "now"})
+    messages = _chat(agent, "What time is it?", asynchronous = False)
+    assert "3.0 seconds" in messages[-1].content and len(agent.last_turn_steps) == 3
+
+    agent = UtilityAgent(check_toxicity = False, max_steps = None, max_tokens_per_turn = 1000)
+    messages = _chat(agent, "What time is it?", asynchronous = True)
+    assert "tokens" in messages[-1].content
+    assert 1 <= len(agent.last_turn_steps) < 10
+
+
+def _stack():
+    frame = sys._getframe()
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    return frames